@@ -3,7 +3,7 @@ Hệ thống OCR Văn Bản
 Phần mềm quản lý và trích xuất thông tin từ văn bản hành chính
 """
 from pdf2image import convert_from_path
-from typing import List, Dict, Any, Optional, Union, Tuple
+from typing import Callable, List, Dict, Any, Optional, Union, Tuple
 import os
 import sys
 from pathlib import Path
@@ -22,14 +22,25 @@ from datetime import datetime
 import pandas as pd
 import multiprocessing as mp
 import threading
+from contextlib import contextmanager
 from queue import Empty, Queue
+from collections import Counter
 import qdarkstyle
 from typing import List, Dict, Any, Optional, Tuple
 import io
+import struct
+import bisect
+import heapq
+import unicodedata
 import shutil
+import stat
+import hashlib
 import re
 import traceback
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from statistics_dialog import StatisticsDialog
+from word_converter import WordConverterService, make_default_converter_factory
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                            QPushButton, QLabel, QFileDialog, QTableWidget, QTableWidgetItem,
                            QLineEdit, QTextEdit, QScrollArea, QFrame, QSplitter, QMessageBox,
@@ -37,10 +48,12 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                            QCompleter, QRadioButton, QButtonGroup, QGroupBox, QTabWidget,
                            QHeaderView, QSpacerItem, QSizePolicy, QStatusBar, QToolBar, 
                            QToolButton, QStyle, QStyleFactory, QCalendarWidget, QDateEdit, 
-                           QCheckBox, QStyledItemDelegate, QGraphicsDropShadowEffect, QGridLayout, QFormLayout, QInputDialog)
+                           QCheckBox, QStyledItemDelegate, QGraphicsDropShadowEffect, QGridLayout, QFormLayout, QInputDialog,
+                           QTableView, QListView)
 from PyQt5.QtCore import (Qt, QThread, pyqtSignal, QSize, QRect, QPoint, QTimer, QStringListModel,
                          QDate, QDateTime, QEvent, QPropertyAnimation, QEasingCurve, QSettings,
-                         QModelIndex, QSortFilterProxyModel, QAbstractTableModel, QRegExp, QUrl)
+                         QModelIndex, QSortFilterProxyModel, QAbstractTableModel, QRegExp, QUrl,
+                         QObject, QRunnable, QThreadPool, QIdentityProxyModel, QAbstractListModel)
 from PyQt5.QtGui import (QImage, QPixmap, QPainter, QPen, QKeySequence, QFont, QIcon, QColor,
                        QBrush, QLinearGradient, QPalette, QFontDatabase, QCursor, QRegExpValidator,
                        QDesktopServices, QPainterPath, QStandardItemModel, QStandardItem)
@@ -80,97 +93,512 @@ logger = logging.getLogger("OCRApp")
 # Configuration Constants
 DEFAULT_CONFIDENCE_THRESHOLD = 0.5
 DATABASE_TIMEOUT = 30.0
+DB_STATEMENT_CACHE_SIZE = 256  # Số câu lệnh đã biên dịch giữ lại trên mỗi kết nối
+DB_WRITER_BATCH_MS = 50  # Thời gian tối đa một transaction của writer gom thêm lệnh ghi
+DB_WRITER_BATCH_SIZE = 200  # Số lệnh ghi tối đa trong một transaction của writer
 MAX_RETRY_ATTEMPTS = 5
 DEFAULT_USER = "OCR System"
 DEFAULT_WAIT_CURSOR = True
 AUTOSAVE_INTERVAL = 60000  # ms (1 minute)
 MAX_RECENT_FILES = 10
+DOCUMENT_PAGE_SIZE = 200  # Số dòng mỗi lần nạp thêm vào danh sách văn bản
+THUMBNAIL_CACHE_SIZE = 500  # Số thumbnail giữ trong bộ nhớ cho chế độ thư viện
+OCR_RENDER_SCALE = 1.5  # Tỷ lệ render trang PDF cho OCR (1.5 = 108 DPI)
+PAGE_SKEW_MAX_ANGLE = 5.0  # Góc nghiêng tối đa được dò tìm (độ)
+PAGE_SKEW_MIN_ANGLE = 0.2  # Bỏ qua độ nghiêng nhỏ hơn ngưỡng này
+REOCR_RENDER_SCALE = 3.0  # Tỷ lệ render lại vùng khó (3.0 = 216 DPI)
+DEFAULT_REOCR_THRESHOLD = 0.6
+# Ngưỡng độ tin cậy theo class, vùng thấp hơn ngưỡng mới chạy lại OCR
+REOCR_CONFIDENCE_THRESHOLDS = {
+    0: 0.6,   # CQBH
+    1: 0.4,   # Chu_Ky - chữ viết tay, độ tin cậy thường thấp
+    2: 0.6,   # Chuc_Vu
+    3: 0.5,   # Do_Khan
+    4: 0.6,   # Loai_VB
+    5: 0.5,   # ND_Chinh - vùng lớn, chạy lại rất tốn kém
+    6: 0.7,   # Ngay_BH - cần chính xác từng chữ số
+    7: 0.5,   # Noi_Nhan
+    8: 0.7    # So_Ki_Hieu - cần chính xác từng ký tự
+}
+CUSTOM_BOX_MAX_THREADS = 2  # Số job OCR vùng tự vẽ chạy đồng thời
+CUSTOM_BOX_ACCEPT_SCORE = 0.85  # Điểm tin cậy đủ tốt để nhận kết quả ngay
+WORD_CONVERTER_WORKERS = 2  # Số converter Word -> PDF giữ sẵn
+PAGE_TEXT_MIN_CHARS = 30  # Số ký tự chữ/số tối thiểu để dùng lớp text của PDF thay cho OCR toàn trang
+SUGGESTION_LIMIT = 50  # Số gợi ý tối đa hiển thị trong completer
+SUGGESTION_FLUSH_INTERVAL = 5000  # ms, ghi dồn tần suất gợi ý xuống database
+SUGGESTION_FLUSH_MAX_PENDING = 100  # Số lượt tăng tần suất tối đa chưa ghi (tối đa mất khi crash)
+FILE_VERIFY_WORKERS = 16  # Số thread stat file song song khi kiểm tra đường dẫn (ổ mạng chậm)
+FILE_VERIFY_MAX_AGE = 6 * 3600  # Giây; kết quả kiểm tra file mới hơn ngưỡng này không stat lại
+FILE_VERIFY_BATCH = 200  # Số file mỗi lô ghi kết quả/báo tiến độ
+FILE_HASH_WORKERS = 4  # Số file được băm SHA-256 đồng thời
+FILE_HASH_BUFFER_SIZE = 1024 * 1024  # Bộ đệm đọc khi băm toàn bộ file
+QUICK_FINGERPRINT_BYTES = 1024 * 1024  # Số byte đầu/cuối file dùng cho dấu vân tay nhanh
+BACKUP_BLOB_DIR = BACKUP_DIR / 'blobs'  # Kho bản sao lưu đặt tên theo SHA-256 nội dung
+BACKUP_STORE_ATTEMPTS = 3  # Số lần lưu lại blob khi GC xóa mất giữa lúc lưu và lúc ghi
+BACKUP_USE_HARDLINKS = False  # Hardlink khi không reflink được: blob dùng chung inode với file gốc
+BACKUP_RETENTION_DAYS = 180  # Bản sao lưu cũ hơn số ngày này bị xóa khi dọn dẹp...
+BACKUP_KEEP_PER_DOCUMENT = 3  # ...trừ số bản mới nhất luôn giữ lại cho mỗi văn bản
+VERSION_SNAPSHOT_INTERVAL = 10  # Phiên bản lưu đầy đủ sau mỗi số phiên bản này, giữa đó chỉ lưu trường thay đổi
+DB_BACKUP_DIR = BACKUP_DIR / 'database'  # Bản sao lưu database tự động theo lịch
+DB_BACKUP_PAGES_PER_STEP = 1024  # Số trang SQLite chép mỗi bước của backup API
+DB_BACKUP_STEP_PAUSE = 0.005  # Giây nghỉ giữa các bước để không chiếm hết ổ đĩa
+DB_BACKUP_INTERVAL = 24 * 3600  # Giây giữa hai bản sao lưu tự động (chỉ khi database đã thay đổi)
+DB_BACKUP_KEEP = 7  # Số bản sao lưu tự động giữ lại
+DB_BACKUP_CHECK_INTERVAL = 30 * 60 * 1000  # ms, chu kỳ kiểm tra lịch sao lưu
+DB_MAINTENANCE_CHECK_INTERVAL = 5 * 60 * 1000  # ms, chu kỳ kiểm tra có nên bảo trì database
+DB_MAINTENANCE_IDLE_SECONDS = 120  # Chỉ bảo trì khi không có lệnh ghi trong số giây này
+DB_MAINTENANCE_INTERVAL = 6 * 3600  # Giây giữa hai lần bảo trì tự động
+DB_ANALYZE_INTERVAL = 24 * 3600  # Giây giữa hai lần ANALYZE (các lần khác chỉ PRAGMA optimize)
+DB_ANALYSIS_LIMIT = 1000  # PRAGMA analysis_limit: số dòng mẫu mỗi chỉ mục khi ANALYZE
+DB_VACUUM_STEP_PAGES = 1000  # Số trang trả lại mỗi lệnh incremental_vacuum (xen kẽ với lệnh ghi)
+DB_VACUUM_MIN_FREE_RATIO = 0.25  # Database chưa ở chế độ incremental: VACUUM đầy đủ khi trang trống vượt tỷ lệ này
+# Thứ tự class của model YOLO (vị trí = class_id), dùng khi lưu detections dạng nhị phân
+DETECTION_CLASS_NAMES = ('CQBH', 'Chu_Ky', 'Chuc_Vu', 'Do_Khan', 'Loai_VB',
+                         'ND_Chinh', 'Ngay_BH', 'Noi_Nhan', 'So_Ki_Hieu')
 
 #############################
 # Database Connection Pool  #
 #############################
 class DBConnectionPool:
-    """Thread-safe database connection pool for SQLite"""
+    """Pool kết nối SQLite có mượn/trả rõ ràng
     
-    def __init__(self, db_path, max_connections=10, timeout=30.0):
+    - Một kết nối ghi (SQLite chỉ cho một writer) và tối đa max_connections - 1 kết nối
+      chỉ đọc mở bằng URI mode=ro; kết nối đọc dùng snapshot WAL nên không chặn writer.
+    - Dùng: ``with pool.connection() as conn`` (ghi) hoặc ``pool.connection(readonly=True)``.
+      Kết nối được trả lại khi ra khỏi khối, không bao giờ bị đóng khi thread khác đang dùng.
+    - Lồng nhau trong cùng thread dùng lại kết nối đang mượn (ghi lồng trong ghi, đọc trong ghi/đọc).
+    - allow_writes=False: pool chỉ cho mượn kết nối đọc, kết nối ghi do DatabaseWriter sở hữu.
+    - get_metrics(): số lần mượn, thời gian chờ, số lần phải chờ (tranh chấp), số lần hết giờ.
+    """
+    
+    def __init__(self, db_path, max_connections=10, timeout=30.0, cached_statements=DB_STATEMENT_CACHE_SIZE,
+                 allow_writes=True):
         self.db_path = db_path
-        self.max_connections = max_connections
+        self.max_connections = max(2, max_connections)
         self.timeout = timeout
-        self.connections = {}
-        self.lock = threading.RLock()
-        
-    def get_connection(self):
-        """Get a connection for the current thread"""
-        thread_id = threading.get_ident()
+        self.cached_statements = cached_statements
+        self.allow_writes = allow_writes
+        self.lock = threading.Condition(threading.RLock())
+        self.idle = {False: [], True: []}  # readonly -> kết nối rảnh
+        self.created = {False: 0, True: 0}
+        self.limits = {False: 1 if allow_writes else 0, True: self.max_connections - 1}
+        self.local = threading.local()  # kết nối thread hiện tại đang mượn
+        self.closed = False
+        self.metrics = {
+            kind: {'checkouts': 0, 'contended': 0, 'timeouts': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+            for kind in ('write', 'read')
+        }
         
-        with self.lock:
-            if thread_id not in self.connections:
-                if len(self.connections) >= self.max_connections:
-                    # Find and close the oldest connection
-                    oldest_thread = min(self.connections.keys(), 
-                                       key=lambda k: self.connections[k]['last_used'])
-                    self.connections[oldest_thread]['conn'].close()
-                    del self.connections[oldest_thread]
-                
-                # Create new connection
-                conn = sqlite3.connect(self.db_path, timeout=self.timeout)
-                conn.row_factory = sqlite3.Row
-                self._optimize_connection(conn)
-                
-                self.connections[thread_id] = {
-                    'conn': conn,
-                    'last_used': time.time()
-                }
-            else:
-                # Update last used time
-                self.connections[thread_id]['last_used'] = time.time()
-                
-            return self.connections[thread_id]['conn']
+    def _connect(self, readonly):
+        """Mở kết nối mới (kết nối được chuyển giữa các thread nên tắt check_same_thread)"""
+        if readonly:
+            uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                                   cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        self._optimize_connection(conn, readonly)
+        return conn
     
-    def _optimize_connection(self, conn):
+    def _optimize_connection(self, conn, readonly=False):
         """Optimize SQLite connection settings"""
-        conn.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging
+        if not readonly:
+            conn.execute("PRAGMA journal_mode = WAL")  # Write-Ahead Logging
         conn.execute("PRAGMA synchronous = NORMAL")  # Faster writes, still safe
-        conn.execute("PRAGMA busy_timeout = 30000")  # 30 second timeout
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
         conn.execute("PRAGMA temp_store = MEMORY")  # Store temp data in memory
         conn.execute("PRAGMA foreign_keys = ON")    # Enable foreign key constraints
         return conn
     
+    def _checkout(self, readonly):
+        kind = 'read' if readonly else 'write'
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        waited = False
+        with self.lock:
+            while True:
+                if self.closed:
+                    raise sqlite3.ProgrammingError("Connection pool is closed")
+                if self.idle[readonly]:
+                    conn = self.idle[readonly].pop()
+                    break
+                if self.created[readonly] < self.limits[readonly]:
+                    self.created[readonly] += 1
+                    try:
+                        conn = self._connect(readonly)
+                    except Exception:
+                        self.created[readonly] -= 1
+                        raise
+                    break
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.metrics[kind]['timeouts'] += 1
+                    raise sqlite3.OperationalError(f"Timed out waiting for a {kind} connection")
+                waited = True
+                self.lock.wait(remaining)
+            
+            wait_ms = (time.perf_counter() - start) * 1000.0
+            stats = self.metrics[kind]
+            stats['checkouts'] += 1
+            stats['wait_ms_total'] += wait_ms
+            stats['wait_ms_max'] = max(stats['wait_ms_max'], wait_ms)
+            if waited:
+                stats['contended'] += 1
+        return conn
+    
+    def _checkin(self, conn, readonly):
+        if conn.in_transaction:
+            # Khối dùng kết nối kết thúc mà chưa commit: không để transaction treo cho lần mượn sau
+            logger.warning("Connection returned with an open transaction, rolling back")
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+        with self.lock:
+            if self.closed:
+                conn.close()
+                self.created[readonly] -= 1
+            else:
+                self.idle[readonly].append(conn)
+            self.lock.notify()
+    
+    @contextmanager
+    def connection(self, readonly=False):
+        """Mượn một kết nối cho khối with, tự trả lại khi kết thúc"""
+        held = getattr(self.local, 'held', None)
+        if held and (readonly or not held['readonly']):
+            held['depth'] += 1
+            try:
+                yield held['conn']
+            finally:
+                held['depth'] -= 1
+            return
+        if not readonly and not self.allow_writes:
+            raise sqlite3.ProgrammingError("Write connections are owned by DatabaseWriter, submit writes to it")
+            
+        conn = self._checkout(readonly)
+        previous = held
+        self.local.held = {'conn': conn, 'readonly': readonly, 'depth': 1}
+        try:
+            yield conn
+        finally:
+            self.local.held = previous
+            self._checkin(conn, readonly)
+    
+    def get_metrics(self):
+        """Thống kê mượn kết nối theo loại (wait_ms_avg tính từ tổng)"""
+        with self.lock:
+            result = {}
+            for kind, stats in self.metrics.items():
+                readonly = kind == 'read'
+                result[kind] = dict(
+                    stats,
+                    wait_ms_avg=stats['wait_ms_total'] / stats['checkouts'] if stats['checkouts'] else 0.0,
+                    open=self.created[readonly],
+                    in_use=self.created[readonly] - len(self.idle[readonly])
+                )
+            return result
+    
     def close_all(self):
-        """Close all connections in the pool"""
+        """Close idle connections; connections still checked out are closed when returned"""
         with self.lock:
-            for conn_data in self.connections.values():
-                try:
-                    conn_data['conn'].close()
-                except:
-                    pass
-            self.connections.clear()
+            for readonly, connections in self.idle.items():
+                for conn in connections:
+                    try:
+                        conn.close()
+                    except:
+                        pass
+                self.created[readonly] -= len(connections)
+                connections.clear()
+        logger.info(f"Connection pool metrics: {self.get_metrics()}")
+
+#############################
+# Database Writer Thread    #
+#############################
+class _WriterConnection:
+    """Kết nối ghi đưa cho lệnh trong writer thread
     
-    def execute_with_retry(self, query, params=None, max_retries=5):
-        """Execute a query with retry for locked database"""
-        conn = self.get_connection()
+    commit()/rollback()/``with conn`` không làm gì: transaction và SAVEPOINT do DatabaseWriter
+    quản lý. Muốn hủy thay đổi của lệnh thì ném exception.
+    """
+    
+    def __init__(self, conn):
+        self._conn = conn
         
-        for attempt in range(max_retries):
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        pass
+
+
+class DatabaseWriter:
+    """Thread ghi duy nhất, sở hữu kết nối ghi của database
+    
+    - submit(func, *args) đưa lệnh vào hàng đợi và trả về Future; func(conn, *args) chạy trong
+      writer thread, mỗi lệnh trong một SAVEPOINT riêng nên lệnh lỗi chỉ hủy phần của nó.
+    - Lệnh đang chờ được gom vào một transaction đến khi đủ batch_size lệnh hoặc transaction
+      đã chạy quá batch_ms; Future chỉ có kết quả sau khi COMMIT thành công.
+    - Lệnh gửi từ chính writer thread (ghi lồng) chạy ngay trong transaction hiện tại.
+    - Đọc qua pool trong lệnh dùng lại kết nối ghi nên thấy dữ liệu chưa commit.
+    - submit_unbatched() chạy lệnh ngoài transaction, giữa hai lô (VACUUM, wal_checkpoint).
+    - Thread tự khởi động ở lệnh đầu tiên; stop() ghi hết hàng đợi rồi đóng kết nối.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, pool, batch_ms=DB_WRITER_BATCH_MS, batch_size=DB_WRITER_BATCH_SIZE):
+        self.pool = pool
+        self.batch_ms = batch_ms
+        self.batch_size = max(1, batch_size)
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.conn = None
+        self.stopping = False
+        self.savepoint_depth = 0
+        self.last_command_at = time.monotonic()
+        self.metrics = {'commands': 0, 'failed': 0, 'transactions': 0, 'batch_max': 0,
+                        'queue_wait_ms_total': 0.0, 'queue_wait_ms_max': 0.0}
+        
+    def in_writer_thread(self) -> bool:
+        return threading.current_thread() is self.thread
+    
+    def submit(self, func, *args, **kwargs) -> concurrent.futures.Future:
+        """Đưa lệnh ghi func(conn, *args, **kwargs) vào hàng đợi"""
+        if self.in_writer_thread():
+            future = concurrent.futures.Future()
             try:
-                cursor = conn.cursor()
-                if params:
-                    result = cursor.execute(query, params)
-                else:
-                    result = cursor.execute(query)
-                conn.commit()
-                return result
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    # Exponential backoff
-                    sleep_time = 0.1 * (2 ** attempt)
-                    logger.warning(f"Database locked, retrying in {sleep_time:.2f}s (attempt {attempt+1}/{max_retries})")
-                    time.sleep(sleep_time)
-                else:
-                    conn.rollback()
-                    raise
+                future.set_result(self._apply(func, args, kwargs))
             except Exception as e:
-                conn.rollback()
+                future.set_exception(e)
+            return future
+        return self._enqueue(func, args, kwargs, unbatched=False)
+    
+    def submit_unbatched(self, func, *args, **kwargs) -> concurrent.futures.Future:
+        """Đưa lệnh func(conn, ...) chạy ngoài transaction (autocommit), sau lô đang chạy"""
+        if self.in_writer_thread():
+            raise sqlite3.ProgrammingError("Unbatched commands cannot run inside a write transaction")
+        return self._enqueue(func, args, kwargs, unbatched=True)
+    
+    def _enqueue(self, func, args, kwargs, unbatched):
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.thread is None:
+                self.stopping = False
+                self.thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+                self.thread.start()
+            self.queue.put((func, args, kwargs, future, time.perf_counter(), unbatched))
+        return future
+    
+    def idle_seconds(self) -> float:
+        """Số giây kể từ lệnh ghi cuối cùng (0 nếu còn lệnh đang chờ)"""
+        if self.queue.qsize():
+            return 0.0
+        return time.monotonic() - self.last_command_at
+    
+    def execute(self, func, *args, **kwargs):
+        """submit() rồi chờ đến khi lệnh đã commit, ném lại lỗi của lệnh"""
+        return self.submit(func, *args, **kwargs).result()
+    
+    def stop(self, timeout=None):
+        """Ghi hết các lệnh đang chờ rồi dừng thread"""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return
+            self.queue.put(self._STOP)
+        if thread is not threading.current_thread():
+            thread.join(timeout)
+        logger.info(f"Database writer metrics: {self.get_metrics()}")
+    
+    def get_metrics(self):
+        """Số lệnh, số transaction, lô lớn nhất và thời gian chờ trong hàng đợi"""
+        with self.lock:
+            stats = dict(self.metrics)
+        stats['commands_per_transaction'] = stats['commands'] / stats['transactions'] if stats['transactions'] else 0.0
+        stats['queue_wait_ms_avg'] = stats['queue_wait_ms_total'] / stats['commands'] if stats['commands'] else 0.0
+        stats['pending'] = self.queue.qsize()
+        return stats
+    
+    def _run(self):
+        try:
+            conn = self.pool._connect(readonly=False)
+            conn.isolation_level = None  # BEGIN/COMMIT do writer tự quản lý
+        except Exception as e:
+            logger.error(f"Database writer cannot open connection: {str(e)}")
+            self._fail_pending(e)
+            return
+            
+        self.conn = _WriterConnection(conn)
+        self.pool.local.held = {'conn': self.conn, 'readonly': False, 'depth': 1}
+        try:
+            while True:
+                if self.stopping:
+                    try:
+                        item = self.queue.get_nowait()
+                    except Empty:
+                        with self.lock:
+                            # Kiểm tra và dừng trong cùng khóa với submit() để không bỏ sót lệnh
+                            if self.queue.empty():
+                                self._shutdown(conn)
+                                return
+                        continue
+                else:
+                    item = self.queue.get()
+                if item is self._STOP:
+                    self.stopping = True
+                    continue
+                while item is not None:
+                    if item[5]:
+                        self._run_unbatched(item)
+                        item = None
+                    else:
+                        item = self._run_batch(conn, item)
+        except Exception as e:
+            logger.error(f"Database writer stopped unexpectedly: {str(e)}")
+            with self.lock:
+                self._shutdown(conn)
+            self._fail_pending(e)
+    
+    def _shutdown(self, conn):
+        """Đóng kết nối ghi và đánh dấu thread đã dừng (gọi khi đang giữ self.lock)"""
+        self.pool.local.held = None
+        self.conn = None
+        self.thread = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    def _run_batch(self, conn, item):
+        """Chạy một lô lệnh trong một transaction, trả kết quả cho Future sau COMMIT
+        
+        Trả về lệnh unbatched lấy ra khỏi hàng đợi khi gom lô (để chạy ngay sau lô), hoặc None.
+        """
+        start = time.perf_counter()
+        deadline = start + self.batch_ms / 1000.0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except Exception as e:
+            logger.error(f"Database writer cannot begin transaction: {str(e)}")
+            item[3].set_exception(e)
+            return None
+            
+        done = []
+        wait_ms = []
+        deferred = None
+        while True:
+            func, args, kwargs, future, queued_at, _ = item
+            if future.set_running_or_notify_cancel():
+                wait_ms.append((time.perf_counter() - queued_at) * 1000.0)
+                try:
+                    done.append((future, self._apply(func, args, kwargs), None))
+                except Exception as e:
+                    done.append((future, None, e))
+            if len(done) >= self.batch_size or time.perf_counter() >= deadline:
+                break
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            if item is self._STOP:
+                self.stopping = True
+                break
+            if item[5]:
+                deferred = item
+                break
+                
+        try:
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Database writer commit failed: {str(e)}")
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            done = [(future, None, e) for future, _, _ in done]
+            
+        with self.lock:
+            stats = self.metrics
+            stats['commands'] += len(done)
+            stats['failed'] += sum(1 for _, _, error in done if error is not None)
+            stats['transactions'] += 1
+            stats['batch_max'] = max(stats['batch_max'], len(done))
+            stats['queue_wait_ms_total'] += sum(wait_ms)
+            stats['queue_wait_ms_max'] = max([stats['queue_wait_ms_max']] + wait_ms)
+        self.last_command_at = time.monotonic()
+        for future, result, error in done:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        return deferred
+    
+    def _run_unbatched(self, item):
+        """Chạy một lệnh ngoài transaction (kết nối ở chế độ autocommit)"""
+        func, args, kwargs, future, queued_at, _ = item
+        if not future.set_running_or_notify_cancel():
+            return
+        wait_ms = (time.perf_counter() - queued_at) * 1000.0
+        try:
+            result = func(self.conn, *args, **kwargs)
+        except Exception as e:
+            error, result = e, None
+        else:
+            error = None
+        with self.lock:
+            stats = self.metrics
+            stats['commands'] += 1
+            stats['failed'] += error is not None
+            stats['queue_wait_ms_total'] += wait_ms
+            stats['queue_wait_ms_max'] = max(stats['queue_wait_ms_max'], wait_ms)
+        self.last_command_at = time.monotonic()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def _apply(self, func, args, kwargs):
+        """Chạy một lệnh trong SAVEPOINT riêng (lồng được)"""
+        self.savepoint_depth += 1
+        name = f"cmd_{self.savepoint_depth}"
+        conn = self.conn._conn
+        try:
+            conn.execute(f"SAVEPOINT {name}")
+            try:
+                result = func(self.conn, *args, **kwargs)
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {name}")
+                conn.execute(f"RELEASE {name}")
                 raise
+            conn.execute(f"RELEASE {name}")
+            return result
+        finally:
+            self.savepoint_depth -= 1
+    
+    def _fail_pending(self, error):
+        """Không mở được kết nối: báo lỗi cho mọi lệnh đang chờ"""
+        with self.lock:
+            self.thread = None
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+                if item is not self._STOP and item[3].set_running_or_notify_cancel():
+                    item[3].set_exception(error)
 
 #############################
 # Theme Manager & Styling   #
@@ -427,6 +855,7 @@ class PDFViewer(QWidget):
         self.detection_boxes = []
         self.custom_boxes_by_page = {}  # Lưu custom box theo trang
         self.pdf_path = None
+        self.pdf_mtime = None  # mtime của file lúc render, để biết có cần render lại
         self.is_updating = False
         self.zoom_level = 100  # percentage
         self.zoom_idx = 3      # index in ZOOM_LEVELS (100%)
@@ -700,6 +1129,7 @@ class PDFViewer(QWidget):
                 
             # Convert PDF to images
             self.pages = convert_from_path(pdf_path, dpi=self.dpi)
+            self.pdf_mtime = os.path.getmtime(pdf_path)
             self.current_page = 0
             self.detection_boxes = []
             self.update_page_display()
@@ -713,10 +1143,14 @@ class PDFViewer(QWidget):
             self.update_controls()
             return False
 
-    def set_detection_boxes(self, boxes):
-        """Set detection boxes to visualize"""
-        self.detection_boxes = boxes
-        # Không cần gọi update vì chúng ta không vẽ detection boxes nữa
+    def is_loaded(self, pdf_path):
+        """True nếu file này đã được render và chưa thay đổi trên đĩa"""
+        if not self.pages or self.pdf_path != pdf_path:
+            return False
+        try:
+            return os.path.getmtime(pdf_path) == self.pdf_mtime
+        except OSError:
+            return False
 
     def set_highlight_text(self, text):
         """Set text to highlight in the document"""
@@ -975,6 +1409,7 @@ class PDFViewer(QWidget):
         self.current_page = 0
         self.detection_boxes = []
         self.pdf_path = None
+        self.pdf_mtime = None
         self.zoom_level = 100
         self.zoom_idx = self.ZOOM_LEVELS.index(self.zoom_level)
         self.rotation = 0
@@ -1175,11 +1610,341 @@ class PDFViewer(QWidget):
             self.custom_boxes_by_page = {}
         self.draw_boxes_on_pixmap()
         
-    def set_detection_boxes(self, boxes):
-        """Set detection boxes to visualize"""
-        self.detection_boxes = boxes
+    def set_detection_boxes(self, boxes, transform=None):
+        """Set detection boxes to visualize (đổi từ tọa độ OCR sang tọa độ ảnh hiển thị)"""
+        render_scale = transform.get('render_scale', OCR_RENDER_SCALE) if transform else OCR_RENDER_SCALE
+        factor = (self.dpi / 72.0) / render_scale
+        
+        # boxes: mảng NumPy [N, 4] (DocumentDatabase.get_detection_boxes) hoặc list các box
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) if len(boxes) else np.zeros((0, 4), np.float32)
+        if not DocumentOCR.is_identity_transform(transform):
+            # Box được tính trên trang đã hiệu chỉnh hướng/độ nghiêng -> đưa về trang gốc
+            boxes = np.array([DocumentOCR.map_box(box, transform['matrix'], inverse=True) for box in boxes],
+                             dtype=np.float32).reshape(-1, 4)
+        
+        self.detection_boxes = boxes * factor
         # Không cần gọi update vì chúng ta không vẽ detection boxes nữa
 
+#############################
+#   Detection Storage       #
+#############################
+class DetectionCodec:
+    """Mã hóa detections của một trang thành blob nhị phân (số) + JSON riêng cho text
+    
+    Blob v1 (little-endian): header '<4sBxH' = b'DETB', version, số detection N;
+    sau đó các mảng liền nhau: box float32[N,4], original_box float32[N,4],
+    confidence float32[N], ocr_confidence float32[N], class_id int8[N] (-1 = class lạ).
+    Text sidecar: {"text": [...], "ocr_pass": [...], "ocr_engine": [...], "class": [...]}
+    (class chỉ lưu tên với class không có trong DETECTION_CLASS_NAMES).
+    """
+    
+    MAGIC = b'DETB'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBxH')
+    
+    @classmethod
+    def encode(cls, detections: List[Dict]) -> Tuple[bytes, Optional[str]]:
+        """List[dict] (định dạng DocumentOCR) -> (blob, text_json)"""
+        detections = detections or []
+        count = len(detections)
+        boxes = np.zeros((count, 4), dtype='<f4')
+        original_boxes = np.zeros((count, 4), dtype='<f4')
+        confidence = np.zeros(count, dtype='<f4')
+        ocr_confidence = np.zeros(count, dtype='<f4')
+        class_ids = np.full(count, -1, dtype='i1')
+        sidecar = {'text': [], 'ocr_pass': [], 'ocr_engine': [], 'class': []}
+        
+        for i, det in enumerate(detections):
+            box = det.get('box') or [0, 0, 0, 0]
+            boxes[i] = box[:4]
+            original_boxes[i] = (det.get('original_box') or box)[:4]
+            confidence[i] = det.get('confidence') or 0.0
+            ocr_confidence[i] = det.get('ocr_confidence') or 0.0
+            class_name = det.get('class')
+            if class_name in DETECTION_CLASS_NAMES:
+                class_ids[i] = DETECTION_CLASS_NAMES.index(class_name)
+                class_name = None
+            sidecar['text'].append(det.get('text') or '')
+            sidecar['ocr_pass'].append(det.get('ocr_pass'))
+            sidecar['ocr_engine'].append(det.get('ocr_engine'))
+            sidecar['class'].append(class_name)
+        
+        if not any(sidecar['class']):
+            del sidecar['class']
+        blob = b''.join((
+            cls.HEADER.pack(cls.MAGIC, cls.VERSION, count),
+            boxes.tobytes(), original_boxes.tobytes(),
+            confidence.tobytes(), ocr_confidence.tobytes(), class_ids.tobytes()
+        ))
+        text_json = json.dumps(sidecar, ensure_ascii=False) if count else None
+        return blob, text_json
+    
+    @classmethod
+    def decode_arrays(cls, blob: bytes) -> Dict[str, np.ndarray]:
+        """Blob -> dict mảng NumPy (không copy): boxes, original_boxes, confidence, ocr_confidence, class_id"""
+        magic, version, count = cls.HEADER.unpack_from(blob, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"Unsupported detection blob (magic={magic!r}, version={version})")
+        
+        arrays = {}
+        offset = cls.HEADER.size
+        for name, dtype, shape in (('boxes', '<f4', (count, 4)), ('original_boxes', '<f4', (count, 4)),
+                                   ('confidence', '<f4', (count,)), ('ocr_confidence', '<f4', (count,)),
+                                   ('class_id', 'i1', (count,))):
+            size = int(np.prod(shape))
+            arrays[name] = np.frombuffer(blob, dtype=dtype, count=size, offset=offset).reshape(shape)
+            offset += size * np.dtype(dtype).itemsize
+        return arrays
+    
+    @classmethod
+    def decode(cls, blob: bytes, text_json: Optional[str]) -> List[Dict]:
+        """Blob + text sidecar -> List[dict] cùng định dạng lúc encode"""
+        arrays = cls.decode_arrays(blob)
+        sidecar = json.loads(text_json) if text_json else {}
+        count = len(arrays['confidence'])
+        column = lambda key: sidecar.get(key) or [None] * count
+        texts, passes, engines, names = column('text'), column('ocr_pass'), column('ocr_engine'), column('class')
+        
+        detections = []
+        for i in range(count):
+            class_id = int(arrays['class_id'][i])
+            detections.append({
+                'box': arrays['boxes'][i].tolist(),
+                'original_box': arrays['original_boxes'][i].tolist(),
+                'confidence': round(float(arrays['confidence'][i]), 4),
+                'class': DETECTION_CLASS_NAMES[class_id] if class_id >= 0 else names[i],
+                'text': texts[i] or '',
+                'ocr_confidence': round(float(arrays['ocr_confidence'][i]), 4),
+                'ocr_pass': passes[i],
+                'ocr_engine': engines[i]
+            })
+        return detections
+
+#############################
+#     Suggestion Index      #
+#############################
+class SuggestionIndex:
+    """Chỉ mục gợi ý trong bộ nhớ theo từng trường
+    
+    - Tiền tố: danh sách khóa đã gộp dấu, sắp xếp để bisect; top-K theo tần suất
+      được cache theo tiền tố và chỉ xóa cache của các tiền tố bị ảnh hưởng khi thêm.
+    - Chuỗi con: chỉ mục trigram trên khóa đã gộp dấu.
+    Khóa gộp dấu: chữ thường, bỏ dấu tiếng Việt, đ -> d (gõ "quyet dinh" khớp "Quyết định").
+    """
+    
+    TOP_CACHE_MAX_PREFIX = 4  # Chỉ cache top-K cho tiền tố ngắn (nhiều kết quả nhất)
+    
+    def __init__(self):
+        self.frequencies = {}   # field -> {value: frequency}
+        self.folded = {}        # field -> {value: khóa gộp dấu}
+        self.sorted_keys = {}   # field -> [(folded, value)] đã sắp xếp
+        self.trigrams = {}      # field -> {trigram: set(value)}
+        self.top_cache = {}     # field -> {(prefix, limit): [value]}
+        self.lock = threading.RLock()
+    
+    @staticmethod
+    def fold(text: str) -> str:
+        """Chữ thường, bỏ dấu (kể cả đ) để so khớp không phân biệt dấu"""
+        text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+        decomposed = unicodedata.normalize('NFD', text)
+        return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+    
+    @staticmethod
+    def _trigrams(folded: str):
+        return {folded[i:i + 3] for i in range(len(folded) - 2)}
+    
+    def load(self, rows):
+        """Nạp lại toàn bộ từ các dòng (field_name, value, frequency)"""
+        with self.lock:
+            self.frequencies, self.folded, self.sorted_keys, self.trigrams, self.top_cache = {}, {}, {}, {}, {}
+            for field, value, frequency in rows:
+                self.frequencies.setdefault(field, {})[value] = frequency
+                self.folded.setdefault(field, {})[value] = self.fold(value)
+            for field, values in self.frequencies.items():
+                keys = sorted((folded, value) for value, folded in self.folded[field].items())
+                self.sorted_keys[field] = keys
+                grams = self.trigrams[field] = {}
+                for folded, value in keys:
+                    for gram in self._trigrams(folded):
+                        grams.setdefault(gram, set()).add(value)
+    
+    def add(self, field: str, value: str, count: int = 1) -> int:
+        """Tăng tần suất (thêm mới nếu chưa có), trả về tần suất mới"""
+        with self.lock:
+            values = self.frequencies.setdefault(field, {})
+            folded = self.fold(value)
+            if value not in values:
+                self.folded.setdefault(field, {})[value] = folded
+                bisect.insort(self.sorted_keys.setdefault(field, []), (folded, value))
+                grams = self.trigrams.setdefault(field, {})
+                for gram in self._trigrams(folded):
+                    grams.setdefault(gram, set()).add(value)
+            values[value] = values.get(value, 0) + count
+            
+            # Chỉ tiền tố của giá trị này đổi thứ hạng
+            cache = self.top_cache.get(field)
+            if cache:
+                for key in [key for key in cache if folded.startswith(key[0])]:
+                    del cache[key]
+            return values[value]
+    
+    def frequency(self, field: str, value: str) -> int:
+        return self.frequencies.get(field, {}).get(value, 0)
+    
+    def fields(self) -> List[str]:
+        return list(self.frequencies)
+    
+    def complete(self, field: str, prefix: str = "", limit: int = None) -> List[str]:
+        """Giá trị bắt đầu bằng prefix (gộp dấu), tần suất cao trước"""
+        with self.lock:
+            values = self.frequencies.get(field)
+            if not values:
+                return []
+            folded = self.fold(prefix)
+            cache_key = (folded, limit)
+            cache = self.top_cache.setdefault(field, {})
+            if cache_key in cache:
+                return list(cache[cache_key])
+            
+            keys = self.sorted_keys[field]
+            start = bisect.bisect_left(keys, (folded,))
+            end = bisect.bisect_left(keys, (folded + '\uffff',)) if folded else len(keys)
+            matches = [value for _, value in keys[start:end]]
+            result = self._top(values, matches, limit)
+            if len(folded) <= self.TOP_CACHE_MAX_PREFIX:
+                cache[cache_key] = result
+            return list(result)
+    
+    def search(self, field: str, text: str, limit: int = None) -> List[str]:
+        """Giá trị chứa text ở bất kỳ vị trí nào (gộp dấu), tần suất cao trước"""
+        with self.lock:
+            values = self.frequencies.get(field)
+            if not values:
+                return []
+            folded = self.fold(text)
+            if len(folded) < 3:
+                candidates = values
+            else:
+                grams = self.trigrams.get(field, {})
+                postings = sorted((grams.get(gram, set()) for gram in self._trigrams(folded)), key=len)
+                candidates = set.intersection(*postings) if postings else set()
+            folded_values = self.folded[field]
+            matches = [value for value in candidates if folded in folded_values[value]]
+            return self._top(values, matches, limit)
+    
+    @staticmethod
+    def _top(values, matches, limit):
+        key = lambda value: (values[value], value)
+        if limit is None:
+            return sorted(matches, key=key, reverse=True)
+        return heapq.nlargest(limit, matches, key=key)
+
+#############################
+#    Backup Blob Store      #
+#############################
+class BackupBlobStore:
+    """Kho file sao lưu theo nội dung: mỗi nội dung (SHA-256) chỉ lưu một lần
+    
+    Blob nằm ở <root>/<2 ký tự đầu hash>/<hash><đuôi file>. Khi lưu, thử lần lượt reflink
+    (copy-on-write, Linux btrfs/xfs), hardlink (nếu BACKUP_USE_HARDLINKS) rồi mới copy.
+    Blob hardlink được đặt chỉ đọc (kéo theo cả file gốc) và được băm lại trước khi dùng lại,
+    vì sửa file gốc tại chỗ sẽ sửa luôn bản sao lưu.
+    Số lượt tham chiếu nằm trong database (backup_blobs.refcount), kho chỉ quản lý file.
+    """
+    
+    FICLONE = 0x40049409  # ioctl reflink của Linux
+    
+    def __init__(self, root=BACKUP_BLOB_DIR, use_hardlinks=BACKUP_USE_HARDLINKS):
+        self.root = Path(root)
+        self.use_hardlinks = use_hardlinks
+        
+    def blob_path(self, content_hash: str, suffix: str = '') -> Path:
+        return self.root / content_hash[:2] / f"{content_hash}{suffix.lower()}"
+    
+    def store(self, source, content_hash: str, suffix: str = '') -> Tuple[Path, str]:
+        """Đưa file vào kho nếu chưa có, trả về (đường dẫn blob, cách lưu)"""
+        target = self.blob_path(content_hash, suffix)
+        if target.exists():
+            if target.stat().st_nlink == 1 or self._content_hash(target) == content_hash:
+                return target, 'existing'
+            # Blob hardlink đã bị sửa qua file gốc: thay bằng nội dung đúng
+            logger.warning(f"Backup blob {target.name} no longer matches its hash, replacing it")
+            target.unlink()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Ghi vào file tạm rồi đổi tên để blob không bao giờ dở dang
+        staging = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            method = self._place(Path(source), staging)
+            if method == 'hardlink':
+                mode = staging.stat().st_mode
+                os.chmod(staging, stat.S_IMODE(mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            os.replace(staging, target)
+            return target, method
+        finally:
+            if staging.exists():
+                staging.unlink()
+    
+    def adopt(self, source, content_hash: str, suffix: str = '') -> Tuple[Path, str]:
+        """Chuyển hẳn một file vào kho (dùng cho bản sao lưu kiểu cũ); nội dung đã có thì giữ nguyên source"""
+        target = self.blob_path(content_hash, suffix)
+        if target.exists():
+            return target, 'existing'
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(source), str(target))
+        return target, 'moved'
+    
+    def _place(self, source: Path, staging: Path) -> str:
+        if self._reflink(source, staging):
+            return 'reflink'
+        if self.use_hardlinks:
+            try:
+                os.link(source, staging)
+                return 'hardlink'
+            except OSError:
+                pass
+        shutil.copy2(source, staging)
+        return 'copy'
+    
+    @staticmethod
+    def _content_hash(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(FILE_HASH_BUFFER_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _reflink(self, source: Path, staging: Path) -> bool:
+        try:
+            import fcntl
+        except ImportError:
+            return False
+        try:
+            with open(source, 'rb') as src, open(staging, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), self.FICLONE, src.fileno())
+            shutil.copystat(source, staging)
+            return True
+        except OSError:
+            if staging.exists():
+                staging.unlink()
+            return False
+    
+    def stray_files(self, known_paths, min_age: float = 3600) -> List[Path]:
+        """File trong kho không có trong known_paths (bỏ qua file mới hơn min_age giây)"""
+        known = {os.path.normcase(str(Path(path).resolve())) for path in known_paths}
+        cutoff = time.time() - min_age
+        strays = []
+        if not self.root.exists():
+            return strays
+        for path in self.root.glob('*/*'):
+            try:
+                if (path.is_file() and path.stat().st_mtime < cutoff
+                        and os.path.normcase(str(path.resolve())) not in known):
+                    strays.append(path)
+            except OSError:
+                continue
+        return strays
+
 #############################
 #  Document Database Class  #
 #############################
@@ -1188,8 +1953,19 @@ class DocumentDatabase:
     
     def __init__(self, db_path=DATABASE_DIR / "documents.db"):
         self.db_path = db_path
-        self.suggestions_cache = {}
-        self.conn_pool = DBConnectionPool(db_path, max_connections=10, timeout=DATABASE_TIMEOUT)
+        self.suggestion_index = SuggestionIndex()
+        self.suggestion_listeners = []  # callback(field_name, value, frequency) sau khi gợi ý thay đổi
+        self.pending_suggestions = Counter()  # (field_name, value) -> số lượt chưa ghi xuống database
+        self.pending_since = None  # time.monotonic() của lượt chưa ghi cũ nhất
+        self.pending_lock = threading.Lock()
+        self.change_listeners = []  # callback(doc_id, version_number) sau khi văn bản thay đổi
+        # Pool chỉ cho mượn kết nối đọc (snapshot WAL); mọi lệnh ghi đi qua writer thread
+        self.conn_pool = DBConnectionPool(db_path, max_connections=10, timeout=DATABASE_TIMEOUT,
+                                          allow_writes=False)
+        self.writer = DatabaseWriter(self.conn_pool)
+        self.backup_store = BackupBlobStore()
+        self.version_snapshot_interval = max(1, VERSION_SNAPSHOT_INTERVAL)
+        self.last_analyze = 0.0  # time.time() của lần ANALYZE gần nhất
         self.init_db()
         self.load_suggestions()
 
@@ -1198,6 +1974,10 @@ class DocumentDatabase:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             
+            # Database mới: trả trang trống bằng incremental_vacuum (database cũ được
+            # chuyển khi bảo trì chạy VACUUM đầy đủ)
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            
             # Create documents table first with all required columns
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS documents (
@@ -1230,6 +2010,8 @@ class DocumentDatabase:
                     do_khan TEXT,
                     modified_by TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    do_mat TEXT,
+                    changed_mask INTEGER,  -- NULL: snapshot đầy đủ, khác NULL: bit các trường được lưu
                     FOREIGN KEY (document_id) REFERENCES documents(id)
                 )
             ''')
@@ -1240,8 +2022,11 @@ class DocumentDatabase:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     document_id INTEGER,
                     page_number INTEGER,
-                    detection_data TEXT,
+                    detection_data TEXT,  -- JSON cũ, chỉ còn trước khi migrate
+                    detection_blob BLOB,
+                    detection_text TEXT,
                     page_text TEXT,
+                    page_transform TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (document_id) REFERENCES documents(id)
                 )
@@ -1271,6 +2056,17 @@ class DocumentDatabase:
                 )
             ''')
             
+            # Blob sao lưu theo nội dung, refcount = số dòng document_backups trỏ tới
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS backup_blobs (
+                    hash TEXT PRIMARY KEY,
+                    blob_path TEXT NOT NULL,
+                    file_size INTEGER,
+                    refcount INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             # Document tags table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS document_tags (
@@ -1283,44 +2079,634 @@ class DocumentDatabase:
                 )
             ''')
             
+            # Cache hash theo (đường dẫn, kích thước, mtime): file không đổi thì không băm lại
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS file_hash_cache (
+                    file_path TEXT PRIMARY KEY,
+                    file_size INTEGER NOT NULL,
+                    file_mtime_ns INTEGER NOT NULL,
+                    quick_hash TEXT NOT NULL,
+                    full_hash TEXT NOT NULL
+                )
+            ''')
+            
+            # Kết quả kiểm tra file gần nhất (cache cho verify_file_paths)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS file_status (
+                    document_id INTEGER PRIMARY KEY,
+                    file_path TEXT NOT NULL,
+                    file_size INTEGER,
+                    file_mtime REAL,
+                    file_exists INTEGER NOT NULL,
+                    last_verified REAL NOT NULL,
+                    FOREIGN KEY (document_id) REFERENCES documents(id)
+                )
+            ''')
+            
+            # Processing metrics table (thời gian xử lý theo giai đoạn)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS processing_metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    document_id INTEGER,
+                    page_number INTEGER,
+                    stage TEXT NOT NULL,
+                    duration_ms REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (document_id) REFERENCES documents(id)
+                )
+            ''')
+            
             # Add indexes for performance
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_filename ON documents(file_name)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_lastmod ON documents(last_modified)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_versions_docid ON document_versions(document_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_detections_docid ON page_detections(document_id, page_number)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_created ON documents(created_at)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_suggestions_field ON field_suggestions(field_name, frequency)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_tags_docid ON document_tags(document_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_stage ON processing_metrics(stage, duration_ms)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_metrics_docid ON processing_metrics(document_id)')
+            
+            conn.commit()
+            
+            # Các bảng dẫn xuất (document_current, stats_rollup, FTS) và nâng cấp schema
+            # của database cũ đều là migration theo PRAGMA user_version
+            self._apply_migrations(conn)
+            
+            # FTS5 không có sẵn thì migration bỏ qua chỉ mục, tìm kiếm dùng LIKE
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('pages_fts', 'documents_fts')")
+            self.fts_enabled = cursor.fetchone()[0] == 2
             
             conn.commit()
 
-    def _convert_vn_date_to_standard(self, date_string):
+    def _init_page_text_index(self, cursor):
+        """Tạo (lại) bảng FTS5 cho page_detections.page_text và đánh chỉ mục toàn bộ
+
+        Bảng contentless (content=''): chỉ mục lưu text đã gộp đ -> d nên không trỏ về
+        page_detections được; đoạn trích lấy từ page_text gốc (_page_snippet).
         """
-        Chuyển đổi chuỗi ngày tháng tiếng Việt sang định dạng chuẩn yyyy-mm-dd
-        
-        Args:
-            date_string: Chuỗi ngày tháng cần chuyển đổi
+        try:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS page_detections_fts_{suffix}")
+            cursor.execute("DROP TABLE IF EXISTS pages_fts")
+            cursor.execute('''
+                CREATE VIRTUAL TABLE pages_fts USING fts5(
+                    page_text,
+                    content='',
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
             
-        Returns:
-            str: Chuỗi ngày tháng định dạng yyyy-mm-dd hoặc chuỗi gốc nếu không chuyển đổi được
-        """
-        if not isinstance(date_string, str):
-            return date_string
+            # Giữ chỉ mục đồng bộ với page_detections; 'delete' của bảng contentless cần đúng text đã gộp
+            new_text = self._sql_fold('new.page_text')
+            old_text = self._sql_fold('old.page_text')
+            cursor.execute(f'''
+                CREATE TRIGGER page_detections_fts_ai AFTER INSERT ON page_detections BEGIN
+                    INSERT INTO pages_fts(rowid, page_text) VALUES (new.id, {new_text});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER page_detections_fts_ad AFTER DELETE ON page_detections BEGIN
+                    INSERT INTO pages_fts(pages_fts, rowid, page_text) VALUES ('delete', old.id, {old_text});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER page_detections_fts_au AFTER UPDATE OF page_text ON page_detections BEGIN
+                    INSERT INTO pages_fts(pages_fts, rowid, page_text) VALUES ('delete', old.id, {old_text});
+                    INSERT INTO pages_fts(rowid, page_text) VALUES (new.id, {new_text});
+                END
+            ''')
             
+            cursor.execute(f'''
+                INSERT INTO pages_fts(rowid, page_text)
+                SELECT id, {self._sql_fold('page_text')} FROM page_detections WHERE page_text IS NOT NULL
+            ''')
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 not available, page text search falls back to LIKE: {str(e)}")
+            return False
+
+    # Cột của documents_fts và trọng số BM25 tương ứng (số ký hiệu, nội dung chính quan trọng hơn)
+    DOCUMENT_FTS_COLUMNS = ('cqbh', 'so_ki_hieu', 'loai_vb', 'nd_chinh', 'ngay_bh', 'noi_nhan',
+                            'chuc_vu', 'chu_ky', 'do_khan')
+    DOCUMENT_FTS_WEIGHTS = (2.0, 5.0, 2.0, 3.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+
+    def _init_document_text_index(self, cursor):
+        """Tạo (lại) bảng FTS5 cho các trường của phiên bản mới nhất, rowid = document_id"""
         try:
-            # Loại bỏ khoảng trắng thừa và chuyển về chữ thường
-            date_string = date_string.lower().strip()
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS document_current_fts_{suffix}")
+                cursor.execute(f"DROP TRIGGER IF EXISTS document_versions_fts_{suffix}")
+            cursor.execute("DROP TABLE IF EXISTS documents_fts")
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE documents_fts USING fts5(
+                    {', '.join(self.DOCUMENT_FTS_COLUMNS)},
+                    tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
             
-            # Xử lý format "ngày dd tháng mm năm yyyy"
-            if "ngày" in date_string and "tháng" in date_string and "năm" in date_string:
-                # Loại bỏ các từ không cần thiết
-                date_string = date_string.replace("ngày", "").replace("tháng", "").replace("năm", "")
-                
-                # Tách và lấy các phần ngày, tháng, năm
-                parts = [part.strip() for part in date_string.split() if part.strip()]
-                if len(parts) >= 3:
-                    day = int(parts[0])
-                    month = int(parts[1])
-                    year = int(parts[2])
+            # Cột rank dùng BM25 có trọng số theo cột
+            weights = ', '.join(str(w) for w in self.DOCUMENT_FTS_WEIGHTS)
+            cursor.execute(f"INSERT INTO documents_fts(documents_fts, rank) VALUES ('rank', 'bm25({weights})')")
+            
+            columns = ', '.join(self.DOCUMENT_FTS_COLUMNS)
+            new_values = ', '.join(self._document_fts_values('new'))
+            
+            cursor.execute(f'''
+                CREATE TRIGGER document_current_fts_ai AFTER INSERT ON document_current BEGIN
+                    INSERT INTO documents_fts(rowid, {columns}) VALUES (new.document_id, {new_values});
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER document_current_fts_ad AFTER DELETE ON document_current BEGIN
+                    DELETE FROM documents_fts WHERE rowid = old.document_id;
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER document_current_fts_au AFTER UPDATE ON document_current BEGIN
+                    DELETE FROM documents_fts WHERE rowid = old.document_id;
+                    INSERT INTO documents_fts(rowid, {columns}) VALUES (new.document_id, {new_values});
+                END
+            ''')
+            
+            cursor.execute(self._document_fts_refill_sql())
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 not available, document search falls back to LIKE: {str(e)}")
+            return False
+
+    def _document_fts_values(self, alias):
+        """Biểu thức giá trị các cột documents_fts từ một dòng document_current"""
+        return [
+            self._sql_fold(f"COALESCE({alias}.cqbh_tren, '') || ' ' || COALESCE({alias}.cqbh_duoi, '')"),
+            *[self._sql_fold(f"{alias}.{column}") for column in self.DOCUMENT_FTS_COLUMNS[1:]]
+        ]
+
+    def _document_fts_refill_sql(self):
+        """INSERT ... SELECT toàn bộ document_current vào documents_fts"""
+        return f'''
+            INSERT INTO documents_fts(rowid, {', '.join(self.DOCUMENT_FTS_COLUMNS)})
+            SELECT c.document_id, {', '.join(self._document_fts_values('c'))}
+            FROM document_current c
+        '''
+
+    # Thống kê cộng dồn: dimension -> (bảng nguồn, cột theo dõi khi UPDATE, biểu thức bucket theo alias dòng)
+    STATS_ROLLUP_DIMENSIONS = {
+        'total': ('documents', None, "''"),
+        'month': ('documents', 'created_at', "COALESCE(strftime('%Y-%m', {row}.created_at), '')"),
+        'type': ('document_current', 'loai_vb', "COALESCE({row}.loai_vb, '')"),
+        'urgency': ('document_current', 'do_khan', "COALESCE({row}.do_khan, '')"),
+        'agency': ('document_current', 'cqbh_tren', "COALESCE({row}.cqbh_tren, '')"),
+        'tag': ('document_tags', 'tag_name', "COALESCE({row}.tag_name, '')"),
+    }
+
+    def _init_backup_refcounts(self, cursor):
+        """Trigger giữ backup_blobs.refcount khớp với số dòng document_backups"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_backups_blob ON document_backups(blob_hash)')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_backups_ref_ai AFTER INSERT ON document_backups
+            WHEN new.blob_hash IS NOT NULL BEGIN
+                UPDATE backup_blobs SET refcount = refcount + 1 WHERE hash = new.blob_hash;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_backups_ref_ad AFTER DELETE ON document_backups
+            WHEN old.blob_hash IS NOT NULL BEGIN
+                UPDATE backup_blobs SET refcount = refcount - 1 WHERE hash = old.blob_hash;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS document_backups_ref_au AFTER UPDATE OF blob_hash ON document_backups
+            WHEN old.blob_hash IS NOT new.blob_hash BEGIN
+                UPDATE backup_blobs SET refcount = refcount - 1 WHERE hash = old.blob_hash;
+                UPDATE backup_blobs SET refcount = refcount + 1 WHERE hash = new.blob_hash;
+            END
+        ''')
+
+    def _init_stats_rollups(self, cursor):
+        """Tạo bảng stats_rollup và trigger giữ nó đồng bộ khi thêm/sửa/xóa văn bản và thẻ
+
+        Migration: đổi STATS_ROLLUP_DIMENSIONS thì thêm migration mới gọi lại hàm này.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS stats_rollup (
+                dimension TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, bucket)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Tạo lại trigger theo STATS_ROLLUP_DIMENSIONS hiện tại
+        tables = {}
+        for dimension, (table, column, bucket) in self.STATS_ROLLUP_DIMENSIONS.items():
+            tables.setdefault(table, []).append((dimension, column, bucket))
+        for table, dimensions in tables.items():
+            increment = ''.join(
+                f"INSERT INTO stats_rollup (dimension, bucket, count) "
+                f"VALUES ('{dimension}', {bucket.format(row='new')}, 1) "
+                f"ON CONFLICT(dimension, bucket) DO UPDATE SET count = count + 1;\n"
+                for dimension, _, bucket in dimensions
+            )
+            decrement = ''.join(
+                f"UPDATE stats_rollup SET count = count - 1 "
+                f"WHERE dimension = '{dimension}' AND bucket = {bucket.format(row='old')};\n"
+                for dimension, _, bucket in dimensions
+            )
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {table}_stats_{suffix}")
+            cursor.execute(f"CREATE TRIGGER {table}_stats_ai AFTER INSERT ON {table} BEGIN\n{increment}END")
+            cursor.execute(f"CREATE TRIGGER {table}_stats_ad AFTER DELETE ON {table} BEGIN\n{decrement}END")
+            
+            # UPDATE chỉ chuyển bucket của những dimension có cột thay đổi
+            tracked = [(dimension, column, bucket) for dimension, column, bucket in dimensions if column]
+            if tracked:
+                moves = ''.join(
+                    f"UPDATE stats_rollup SET count = count - 1 "
+                    f"WHERE dimension = '{dimension}' AND bucket = {bucket.format(row='old')} "
+                    f"AND {bucket.format(row='old')} IS NOT {bucket.format(row='new')};\n"
+                    f"INSERT INTO stats_rollup (dimension, bucket, count) "
+                    f"SELECT '{dimension}', {bucket.format(row='new')}, 1 "
+                    f"WHERE {bucket.format(row='old')} IS NOT {bucket.format(row='new')} "
+                    f"ON CONFLICT(dimension, bucket) DO UPDATE SET count = count + 1;\n"
+                    for dimension, column, bucket in tracked
+                )
+                columns = ', '.join(dict.fromkeys(column for _, column, _ in tracked))
+                cursor.execute(f"CREATE TRIGGER {table}_stats_au AFTER UPDATE OF {columns} ON {table} BEGIN\n{moves}END")
+        
+        self._rebuild_stats_rollups(cursor)
+
+    def _stats_rollup_source_sql(self):
+        """SELECT (dimension, bucket, count) tính lại toàn bộ thống kê từ bảng gốc"""
+        return ' UNION ALL '.join(
+            f"SELECT '{dimension}', {bucket.format(row='t')}, COUNT(*) FROM {table} t GROUP BY 2"
+            for dimension, (table, _, bucket) in self.STATS_ROLLUP_DIMENSIONS.items()
+        )
+
+    def _rebuild_stats_rollups(self, cursor):
+        """Tính lại stats_rollup từ đầu (trong transaction của cursor)"""
+        cursor.execute('DELETE FROM stats_rollup')
+        cursor.execute(f'''
+            INSERT INTO stats_rollup (dimension, bucket, count)
+            SELECT * FROM ({self._stats_rollup_source_sql()})
+        ''')
+
+    def check_stats_rollups(self, repair: bool = True) -> List[Tuple[str, str, int, int]]:
+        """So stats_rollup với số liệu tính lại từ bảng gốc
+        
+        Trả về [(dimension, bucket, giá trị đang lưu, giá trị đúng)] các bucket lệch;
+        repair=True thì dựng lại bảng khi có lệch (và dọn các bucket đã về 0).
+        """
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT dimension, bucket, count FROM stats_rollup WHERE count != 0")
+                stored = {(dimension, bucket): count for dimension, bucket, count in cursor.fetchall()}
+                cursor.execute(self._stats_rollup_source_sql())
+                actual = {(dimension, bucket): count for dimension, bucket, count in cursor.fetchall()}
+                
+            mismatches = [
+                (dimension, bucket, stored.get((dimension, bucket), 0), actual.get((dimension, bucket), 0))
+                for dimension, bucket in sorted(set(stored) | set(actual))
+                if stored.get((dimension, bucket), 0) != actual.get((dimension, bucket), 0)
+            ]
+            if mismatches:
+                logger.warning(f"Statistics rollups out of sync in {len(mismatches)} buckets: {mismatches[:5]}")
+            if repair and (mismatches or self._stats_rollups_have_empty_buckets()):
+                self.writer.execute(lambda conn: self._rebuild_stats_rollups(conn.cursor()))
+            return mismatches
+        except Exception as e:
+            logger.error(f"Error checking statistics rollups: {str(e)}")
+            return []
+
+    def _stats_rollups_have_empty_buckets(self) -> bool:
+        with self.conn_pool.connection(readonly=True) as conn:
+            return conn.execute("SELECT 1 FROM stats_rollup WHERE count = 0 LIMIT 1").fetchone() is not None
+
+    # Các trường nội dung được chép từ document_versions sang document_current
+    CURRENT_VERSION_FIELDS = ('cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb', 'nd_chinh', 'ngay_bh',
+                              'noi_nhan', 'chuc_vu', 'chu_ky', 'do_khan', 'do_mat', 'modified_by')
+    # Trường nội dung của phiên bản delta: bit i của changed_mask ứng với VERSION_DELTA_FIELDS[i].
+    # Thứ tự đã lưu trong database, chỉ được thêm vào cuối.
+    VERSION_DELTA_FIELDS = ('cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb', 'nd_chinh', 'ngay_bh',
+                            'noi_nhan', 'chuc_vu', 'chu_ky', 'do_khan', 'do_mat')
+    # Cột của một phiên bản trả về cho giao diện (vị trí giống SELECT * của schema cũ)
+    VERSION_ROW_COLUMNS = ('id', 'document_id', 'version_number', 'cqbh_tren', 'cqbh_duoi', 'so_ki_hieu',
+                           'loai_vb', 'nd_chinh', 'ngay_bh', 'noi_nhan', 'chuc_vu', 'chu_ky', 'do_khan',
+                           'modified_by', 'created_at', 'do_mat')
+
+    # Migration schema theo thứ tự: (user_version, mô tả, method nhận cursor).
+    # Chỉ thêm vào cuối, không sửa/đổi số migration đã phát hành. Các bước phải chạy được
+    # trên database đã được nâng cấp thủ công trước khi có user_version (dùng _ensure_column,
+    # IF NOT EXISTS).
+    SCHEMA_MIGRATIONS = (
+        (1, "page_detections.page_transform", '_migrate_v1_page_transform'),
+        (2, "binary page detections", '_migrate_v2_binary_detections'),
+        (3, "unique page_detections(document_id, page_number)", '_ensure_unique_page_detections'),
+        (4, "documents.quick_hash", '_migrate_v4_quick_hash'),
+        (5, "content-addressed document backups", '_migrate_v5_backup_blobs'),
+        (6, "do_mat column", '_migrate_v6_do_mat'),
+        (7, "documents(file_hash), documents(file_path) indexes", '_migrate_v7_file_indexes'),
+        (8, "delta-encoded document versions", '_migrate_v8_version_deltas'),
+        (9, "document_current table", '_migrate_v9_document_current'),
+        (10, "stats_rollup table and triggers", '_init_stats_rollups'),
+        (11, "pages_fts full-text index", '_init_page_text_index'),
+        (12, "documents_fts full-text index", '_init_document_text_index'),
+    )
+
+    def _apply_migrations(self, conn) -> int:
+        """Chạy các migration có version lớn hơn PRAGMA user_version, mỗi migration một transaction
+
+        user_version được ghi trong cùng transaction nên migration lỗi không để lại schema dở dang.
+        Thời gian từng bước lưu ở self.migration_log. Trả về user_version sau khi chạy.
+        """
+        self.migration_log = []
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        latest = self.SCHEMA_MIGRATIONS[-1][0]
+        if current > latest:
+            logger.warning(f"Database schema version {current} is newer than this application ({latest})")
+            return current
+            
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None  # BEGIN/COMMIT tự quản lý
+        try:
+            for version, description, method in self.SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                start = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    getattr(self, method)(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {int(version)}")
+                    conn.execute("COMMIT")
+                except Exception as e:
+                    conn.execute("ROLLBACK")
+                    logger.error(f"Schema migration {version} ({description}) failed: {str(e)}")
+                    raise
+                elapsed_ms = (time.perf_counter() - start) * 1000.0
+                self.migration_log.append((version, description, elapsed_ms))
+                logger.info(f"Applied schema migration {version} ({description}) in {elapsed_ms:.1f} ms")
+                current = version
+        finally:
+            conn.isolation_level = isolation_level
+        return current
+
+    def _migrate_v1_page_transform(self, cursor):
+        self._ensure_column(cursor, 'page_detections', 'page_transform', 'TEXT')
+
+    def _migrate_v2_binary_detections(self, cursor):
+        self._ensure_column(cursor, 'page_detections', 'detection_blob', 'BLOB')
+        self._ensure_column(cursor, 'page_detections', 'detection_text', 'TEXT')
+        self._migrate_detection_data(cursor)
+
+    def _migrate_v4_quick_hash(self, cursor):
+        self._ensure_column(cursor, 'documents', 'quick_hash', 'TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_quick_hash ON documents(quick_hash)')
+
+    def _migrate_v5_backup_blobs(self, cursor):
+        self._ensure_column(cursor, 'document_backups', 'blob_hash', 'TEXT')
+        self._ensure_column(cursor, 'document_backups', 'file_name', 'TEXT')
+        self._init_backup_refcounts(cursor)
+
+    def _migrate_v6_do_mat(self, cursor):
+        """Cột độ mật (trước đây thêm tay bằng add_column.py), chép sang document_current"""
+        self._ensure_column(cursor, 'document_versions', 'do_mat', 'TEXT')
+        # Database mới: document_current được tạo (đã có do_mat) ở migration 9
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_current'")
+        if not cursor.fetchone():
+            return
+        self._ensure_column(cursor, 'document_current', 'do_mat', 'TEXT')
+        cursor.execute('''
+            UPDATE document_current SET do_mat = (
+                SELECT do_mat FROM document_versions WHERE id = document_current.version_id
+            )
+            WHERE version_id IN (SELECT id FROM document_versions WHERE do_mat IS NOT NULL)
+        ''')
+
+    def _migrate_v7_file_indexes(self, cursor):
+        """Chỉ mục cho tra cứu trùng lặp/đường dẫn (_find_existing_documents, update_file_path)"""
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_file_hash ON documents(file_hash)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_doc_file_path ON documents(file_path)')
+
+    def _migrate_v8_version_deltas(self, cursor):
+        """changed_mask cho phiên bản dạng delta (dòng cũ giữ NULL = snapshot)"""
+        self._ensure_column(cursor, 'document_versions', 'changed_mask', 'INTEGER')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_versions_doc_version
+            ON document_versions(document_id, version_number)
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_versions_docid')
+
+    def _migrate_v9_document_current(self, cursor):
+        """Phiên bản mới nhất của mỗi văn bản (bảng phi chuẩn hóa cho danh sách/thống kê)"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS document_current (
+                document_id INTEGER PRIMARY KEY,
+                version_id INTEGER,
+                version_number INTEGER,
+                version_count INTEGER DEFAULT 0,
+                cqbh_tren TEXT,
+                cqbh_duoi TEXT,
+                so_ki_hieu TEXT,
+                loai_vb TEXT,
+                nd_chinh TEXT,
+                ngay_bh TEXT,
+                noi_nhan TEXT,
+                chuc_vu TEXT,
+                chu_ky TEXT,
+                do_khan TEXT,
+                do_mat TEXT,
+                modified_by TEXT,
+                modified_at TIMESTAMP,
+                FOREIGN KEY (document_id) REFERENCES documents(id)
+            )
+        ''')
+        # Điền/đồng bộ từ document_versions (UPSERT, chạy lại được trên bảng đã có)
+        self._refresh_document_current(cursor)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_current_so_ki_hieu ON document_current(so_ki_hieu)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_current_loai_vb ON document_current(loai_vb)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_current_do_khan ON document_current(do_khan)')
+
+    def _migrate_detection_data(self, cursor, batch_size: int = 500):
+        """Chuyển detection_data (JSON) của database cũ sang detection_blob + detection_text
+
+        Đọc theo từng trang batch_size dòng (theo id) để không nạp toàn bộ JSON cũ vào bộ nhớ.
+        """
+        migrated = 0
+        last_id = 0
+        while True:
+            cursor.execute('''
+                SELECT id, detection_data FROM page_detections
+                WHERE id > ? AND detection_data IS NOT NULL AND detection_blob IS NULL
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for row_id, detection_data in rows:
+                try:
+                    detections = json.loads(detection_data)
+                except (ValueError, RecursionError):
+                    logger.warning(f"Invalid detection_data in page_detections row {row_id}, dropped")
+                    detections = []
+                updates.append(DetectionCodec.encode(detections if isinstance(detections, list) else []) + (row_id,))
+            cursor.executemany('''
+                UPDATE page_detections
+                SET detection_blob = ?, detection_text = ?, detection_data = NULL
+                WHERE id = ?
+            ''', updates)
+            migrated += len(updates)
+        if migrated:
+            logger.info(f"Migrated {migrated} page_detections rows to binary detections")
+
+    def _ensure_unique_page_detections(self, cursor):
+        """Mỗi trang một dòng page_detections (cần cho UPSERT), bỏ bản ghi trùng của database cũ"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_detections_page'")
+        if cursor.fetchone():
+            return
+        cursor.execute('''
+            DELETE FROM page_detections
+            WHERE id NOT IN (
+                SELECT MAX(id) FROM page_detections GROUP BY document_id, page_number
+            )
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_detections_docid')
+        cursor.execute('CREATE UNIQUE INDEX idx_detections_page ON page_detections(document_id, page_number)')
+
+    def _refresh_document_current(self, cursor, doc_id: int = None, doc_ids: List[int] = None):
+        """Cập nhật document_current từ phiên bản mới nhất (một văn bản, danh sách doc_ids,
+        hoặc tất cả khi không truyền)
+
+        Gọi trong cùng transaction với thao tác ghi document_versions. Trường không có trong
+        phiên bản delta mới nhất lấy từ phiên bản gần nhất có lưu trường đó.
+        """
+        fields = ', '.join(self.CURRENT_VERSION_FIELDS)
+        selected = ', '.join(self._sql_version_field(field) for field in self.CURRENT_VERSION_FIELDS)
+        updates = ', '.join(f"{field} = excluded.{field}" for field in
+                            ('version_id', 'version_number', 'version_count') + self.CURRENT_VERSION_FIELDS + ('modified_at',))
+        where = "v.document_id = ? AND " if doc_id is not None or doc_ids is not None else ""
+        sql = f'''
+            INSERT INTO document_current (
+                document_id, version_id, version_number, version_count, {fields}, modified_at
+            )
+            SELECT v.document_id, v.id, v.version_number,
+                   (SELECT COUNT(*) FROM document_versions WHERE document_id = v.document_id),
+                   {selected}, v.created_at
+            FROM document_versions v
+            WHERE {where}v.id = (
+                SELECT id FROM document_versions
+                WHERE document_id = v.document_id
+                ORDER BY version_number DESC, id DESC LIMIT 1
+            )
+            ON CONFLICT(document_id) DO UPDATE SET {updates}
+        '''
+        if doc_ids is not None:
+            cursor.executemany(sql, [(i,) for i in doc_ids])
+        else:
+            cursor.execute(sql, (doc_id,) if doc_id is not None else ())
+
+    def _sql_version_field(self, field: str) -> str:
+        """Biểu thức SQL giá trị của field tại phiên bản v (dò ngược qua các delta nếu cần)"""
+        if field not in self.VERSION_DELTA_FIELDS:
+            return f"v.{field}"
+        bit = 1 << self.VERSION_DELTA_FIELDS.index(field)
+        return f'''CASE WHEN v.changed_mask IS NULL OR v.changed_mask & {bit} THEN v.{field} ELSE (
+                SELECT x.{field} FROM document_versions x
+                WHERE x.document_id = v.document_id AND x.version_number < v.version_number
+                  AND (x.changed_mask IS NULL OR x.changed_mask & {bit})
+                ORDER BY x.version_number DESC, x.id DESC LIMIT 1
+            ) END'''
+
+    def _read_versions(self, cursor, doc_id: int, version_number: int = None) -> List[tuple]:
+        """Dựng lại các phiên bản (tuple theo VERSION_ROW_COLUMNS, tăng dần)
+
+        version_number=None: mọi phiên bản; ngược lại chỉ đọc từ snapshot gần nhất đến
+        version_number (tối đa VERSION_SNAPSHOT_INTERVAL dòng).
+        """
+        columns = ', '.join(self.VERSION_ROW_COLUMNS)
+        if version_number is None:
+            cursor.execute(f'''
+                SELECT {columns}, changed_mask FROM document_versions
+                WHERE document_id = ?
+                ORDER BY version_number, id
+            ''', (doc_id,))
+        else:
+            cursor.execute(f'''
+                SELECT {columns}, changed_mask FROM document_versions
+                WHERE document_id = ? AND version_number <= ? AND version_number >= COALESCE((
+                    SELECT MAX(version_number) FROM document_versions
+                    WHERE document_id = ? AND version_number <= ? AND changed_mask IS NULL
+                ), 0)
+                ORDER BY version_number, id
+            ''', (doc_id, version_number, doc_id, version_number))
+            
+        versions = []
+        state = {}
+        for row in cursor.fetchall():
+            row = dict(zip(self.VERSION_ROW_COLUMNS + ('changed_mask',), row))
+            mask = row['changed_mask']
+            for i, field in enumerate(self.VERSION_DELTA_FIELDS):
+                if mask is None or mask & (1 << i):
+                    state[field] = row[field]
+            row.update(state)
+            versions.append(tuple(row[column] for column in self.VERSION_ROW_COLUMNS))
+        return versions
+
+    @staticmethod
+    def _sql_fold(expr: str) -> str:
+        """Biểu thức SQL gộp đ/Đ thành d/D (tokenizer unicode61 không bỏ được nét gạch của đ)"""
+        return f"replace(replace({expr}, 'đ', 'd'), 'Đ', 'D')"
+
+    @staticmethod
+    def fold_vietnamese(text: str) -> str:
+        """Gộp đ/Đ giống _sql_fold, các dấu còn lại do tokenizer bỏ"""
+        return (text or '').replace('đ', 'd').replace('Đ', 'D')
+
+    @staticmethod
+    def _fts_match_query(text: str) -> str:
+        """Chuyển chuỗi người dùng nhập thành biểu thức MATCH an toàn (AND các từ, từ cuối khớp tiền tố)"""
+        tokens = re.findall(r'\w+', DocumentDatabase.fold_vietnamese(text))
+        if not tokens:
+            return ''
+        terms = [f'"{token}"' for token in tokens]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def _ensure_column(self, cursor, table, column, definition):
+        """Thêm cột vào bảng nếu chưa có"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [info[1] for info in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            logger.info(f"Added column {column} to {table}")
+
+    def _convert_vn_date_to_standard(self, date_string):
+        """
+        Chuyển đổi chuỗi ngày tháng tiếng Việt sang định dạng chuẩn yyyy-mm-dd
+        
+        Args:
+            date_string: Chuỗi ngày tháng cần chuyển đổi
+            
+        Returns:
+            str: Chuỗi ngày tháng định dạng yyyy-mm-dd hoặc chuỗi gốc nếu không chuyển đổi được
+        """
+        if not isinstance(date_string, str):
+            return date_string
+            
+        try:
+            # Loại bỏ khoảng trắng thừa và chuyển về chữ thường
+            date_string = date_string.lower().strip()
+            
+            # Xử lý format "ngày dd tháng mm năm yyyy"
+            if "ngày" in date_string and "tháng" in date_string and "năm" in date_string:
+                # Loại bỏ các từ không cần thiết
+                date_string = date_string.replace("ngày", "").replace("tháng", "").replace("năm", "")
+                
+                # Tách và lấy các phần ngày, tháng, năm
+                parts = [part.strip() for part in date_string.split() if part.strip()]
+                if len(parts) >= 3:
+                    day = int(parts[0])
+                    month = int(parts[1])
+                    year = int(parts[2])
                     
                     # Kiểm tra tính hợp lệ của ngày tháng
                     if 1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 9999:
@@ -1358,229 +2744,550 @@ class DocumentDatabase:
     def get_statistics(self):
         """Lấy thống kê từ database"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            stats = {}
-
-            # Tổng số văn bản
-            cursor.execute("SELECT COUNT(*) FROM documents")
-            stats['total_documents'] = cursor.fetchone()[0]
-
-            # Thống kê theo loại văn bản
-            cursor.execute("""
-                SELECT loai_vb, COUNT(*) as count 
-                FROM document_versions 
-                WHERE version_number = (
-                    SELECT MAX(version_number) 
-                    FROM document_versions v2 
-                    WHERE v2.document_id = document_versions.document_id
-                )
-                GROUP BY loai_vb 
-                ORDER BY count DESC
-            """)
-            stats['by_type'] = cursor.fetchall()
-
-            # Thống kê theo độ khẩn
-            cursor.execute("""
-                SELECT do_khan, COUNT(*) as count 
-                FROM document_versions 
-                WHERE version_number = (
-                    SELECT MAX(version_number) 
-                    FROM document_versions v2 
-                    WHERE v2.document_id = document_versions.document_id
-                )
-                GROUP BY do_khan 
-                ORDER BY count DESC
-            """)
-            stats['by_urgency'] = cursor.fetchall()
-
-            # Thống kê theo thời gian
-            cursor.execute("""
-                SELECT 
-                    strftime('%Y-%m', created_at) as month,
-                    COUNT(*) as count
-                FROM documents
-                GROUP BY month
-                ORDER BY month DESC
-                LIMIT 12
-            """)
-            stats['by_month'] = cursor.fetchall()
-
-            # Văn bản mới nhất
-            cursor.execute("""
-                SELECT d.id, d.file_name, d.created_at, v.so_ki_hieu
-                FROM documents d
-                LEFT JOIN document_versions v ON d.id = v.document_id
-                WHERE v.version_number = (
-                    SELECT MAX(version_number) 
-                    FROM document_versions 
-                    WHERE document_id = d.id
-                )
-                ORDER BY d.created_at DESC
-                LIMIT 5
-            """)
-            stats['recent_docs'] = cursor.fetchall()
-
-            return stats
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                stats = {}
+
+                # Đọc từ stats_rollup (số dòng = số bucket, không quét bảng văn bản)
+                cursor.execute("SELECT dimension, bucket, count FROM stats_rollup WHERE count > 0")
+                buckets = {}
+                for dimension, bucket, count in cursor.fetchall():
+                    buckets.setdefault(dimension, []).append((bucket, count))
+                by_count = lambda dimension: sorted(buckets.get(dimension, []), key=lambda item: (-item[1], item[0]))
+
+                # Tổng số văn bản
+                stats['total_documents'] = sum(count for _, count in buckets.get('total', []))
+
+                # Thống kê theo loại văn bản, độ khẩn, cơ quan ban hành, thẻ
+                stats['by_type'] = by_count('type')
+                stats['by_urgency'] = by_count('urgency')
+                stats['by_agency'] = by_count('agency')
+                stats['by_tag'] = by_count('tag')
+
+                # Thống kê theo thời gian (12 tháng gần nhất)
+                stats['by_month'] = sorted(buckets.get('month', []), reverse=True)[:12]
+
+                # Văn bản mới nhất
+                cursor.execute("""
+                    SELECT d.id, d.file_name, d.created_at, c.so_ki_hieu
+                    FROM documents d
+                    JOIN document_current c ON c.document_id = d.id
+                    ORDER BY d.created_at DESC
+                    LIMIT 5
+                """)
+                stats['recent_docs'] = cursor.fetchall()
+
+                # Thời gian xử lý theo giai đoạn (p50/p95)
+                stats['stage_timings'] = self.get_processing_metrics_summary()
+
+                return stats
 
         except Exception as e:
             logger.error(f"Error getting statistics: {str(e)}")
             return None
 
     def create_backup(self, doc_id, file_path, reason="Manual backup"):
-        """Create a backup of the document file"""
+        """Create a backup of the document file (lưu theo nội dung, nội dung trùng không chép lại)"""
         try:
             if not os.path.exists(file_path):
                 logger.warning(f"Cannot backup file that doesn't exist: {file_path}")
                 return None
                 
-            backup_filename = f"{Path(file_path).stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            backup_path = BACKUP_DIR / backup_filename
-            
-            # Copy file to backup
-            shutil.copy2(file_path, backup_path)
-            
-            # Register backup in database
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO document_backups (document_id, backup_path, reason) VALUES (?, ?, ?)",
-                (doc_id, str(backup_path), reason)
-            )
-            conn.commit()
+            content_hash = self._calculate_file_hash(file_path)
+            if not content_hash:
+                return None
+            suffix = Path(file_path).suffix
+            
+            def write(conn, path):
+                # GC (chạy trong writer) có thể đã xóa blob giữa lúc lưu và lúc ghi: báo để lưu lại
+                if not path.exists():
+                    return None
+                conn.execute(
+                    "INSERT OR IGNORE INTO backup_blobs (hash, blob_path, file_size) VALUES (?, ?, ?)",
+                    (content_hash, str(path), os.path.getsize(path))
+                )
+                conn.execute(
+                    "INSERT INTO document_backups (document_id, backup_path, reason, blob_hash, file_name) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, str(path), reason, content_hash, Path(file_path).name)
+                )
+                return str(path)
+                
+            # Chép/link vào kho ngoài writer thread; lệnh ghi chỉ đăng ký blob
+            for _ in range(BACKUP_STORE_ATTEMPTS):
+                blob_path, method = self.backup_store.store(file_path, content_hash, suffix)
+                backup_path = self.writer.execute(write, blob_path)
+                if backup_path:
+                    break
+            else:
+                raise IOError(f"Backup blob {content_hash} was removed while being stored")
                 
-            logger.info(f"Created backup of document {doc_id} at {backup_path}")
-            return str(backup_path)
+            logger.info(f"Created backup of document {doc_id} at {backup_path} ({method})")
+            return backup_path
             
         except Exception as e:
             logger.error(f"Error creating document backup: {str(e)}")
             return None
 
-    def load_suggestions(self):
-        """Load suggestions from database into cache"""
+    def apply_backup_retention(self, max_age_days: int = BACKUP_RETENTION_DAYS,
+                               keep_per_document: int = BACKUP_KEEP_PER_DOCUMENT) -> int:
+        """Xóa bản ghi sao lưu cũ hơn max_age_days, luôn giữ keep_per_document bản mới nhất
+        của mỗi văn bản (văn bản đã xóa tính theo tên file gốc). Trả về số bản ghi đã xóa;
+        file blob được giải phóng ở collect_backup_garbage().
+        """
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT field_name, value, frequency
-                FROM field_suggestions
-                ORDER BY frequency DESC, last_used DESC
-            ''')
+            def write(conn):
+                return conn.execute('''
+                    DELETE FROM document_backups WHERE id IN (
+                        SELECT id FROM (
+                            SELECT id, created_at, ROW_NUMBER() OVER (
+                                PARTITION BY COALESCE(CAST(document_id AS TEXT), 'deleted:' || COALESCE(file_name, backup_path))
+                                ORDER BY created_at DESC, id DESC
+                            ) AS position
+                            FROM document_backups
+                        )
+                        WHERE position > ? AND created_at < datetime('now', ?)
+                    )
+                ''', (keep_per_document, f'-{int(max_age_days)} days')).rowcount
+            removed = self.writer.execute(write)
+            if removed:
+                logger.info(f"Backup retention removed {removed} backup records")
+            return removed
+        except Exception as e:
+            logger.error(f"Error applying backup retention: {str(e)}")
+            return 0
+
+    def collect_backup_garbage(self) -> Dict[str, int]:
+        """Dọn kho sao lưu, trả về {'blobs_removed', 'legacy_imported', 'bytes_reclaimed'}
+        
+        - Bản sao lưu kiểu cũ (file có timestamp trong backup/) được đưa vào kho; bản trùng
+          nội dung bị xóa.
+        - Blob không còn dòng document_backups nào tham chiếu (refcount <= 0) bị xóa.
+        - File lạ trong kho (không có trong backup_blobs, cũ hơn 1 giờ) bị xóa.
+        """
+        report = {'blobs_removed': 0, 'legacy_imported': 0, 'bytes_reclaimed': 0}
+        try:
+            report['bytes_reclaimed'] += self._import_legacy_backups(report)
+            
+            def write(conn):
+                # Xóa file trong cùng transaction với dòng backup_blobs để không tranh chấp với create_backup
+                reclaimed = 0
+                rows = conn.execute("SELECT hash, blob_path FROM backup_blobs WHERE refcount <= 0").fetchall()
+                for content_hash, blob_path in rows:
+                    reclaimed += self._remove_file(blob_path)
+                    conn.execute("DELETE FROM backup_blobs WHERE hash = ?", (content_hash,))
+                known = [row[0] for row in conn.execute("SELECT blob_path FROM backup_blobs").fetchall()]
+                strays = self.backup_store.stray_files(known)
+                for path in strays:
+                    reclaimed += self._remove_file(path)
+                return len(rows) + len(strays), reclaimed
+            removed, reclaimed = self.writer.execute(write)
+            report['blobs_removed'] += removed
+            report['bytes_reclaimed'] += reclaimed
+            logger.info(f"Backup garbage collection: {report}")
+        except Exception as e:
+            logger.error(f"Error collecting backup garbage: {str(e)}")
+        return report
+
+    def _import_legacy_backups(self, report: Dict[str, int]) -> int:
+        """Đưa các bản sao lưu chưa có blob_hash vào kho, trả về số byte giải phóng"""
+        with self.conn_pool.connection(readonly=True) as conn:
+            rows = conn.execute(
+                "SELECT id, backup_path FROM document_backups WHERE blob_hash IS NULL"
+            ).fetchall()
+        reclaimed = 0
+        for backup_id, backup_path in rows:
+            if not os.path.exists(backup_path):
+                continue
+            content_hash = self._calculate_file_hash(backup_path)
+            if not content_hash:
+                continue
+            size = os.path.getsize(backup_path)
+            blob_path, method = self.backup_store.adopt(backup_path, content_hash, Path(backup_path).suffix)
+            
+            def write(conn):
+                conn.execute(
+                    "INSERT OR IGNORE INTO backup_blobs (hash, blob_path, file_size) VALUES (?, ?, ?)",
+                    (content_hash, str(blob_path), size)
+                )
+                conn.execute(
+                    "UPDATE document_backups SET blob_hash = ?, backup_path = ?, "
+                    "file_name = COALESCE(file_name, ?) WHERE id = ?",
+                    (content_hash, str(blob_path), Path(backup_path).name, backup_id)
+                )
+            self.writer.execute(write)
+            report['legacy_imported'] += 1
             
-            for field, value, freq in cursor.fetchall():
-                if field not in self.suggestions_cache:
-                    self.suggestions_cache[field] = []
-                self.suggestions_cache[field].append({
-                    'value': value,
-                    'frequency': freq
-                })
-                
+            # Nội dung đã có trong kho: file cũ là bản trùng
+            if method == 'existing':
+                reclaimed += self._remove_file(backup_path)
+        return reclaimed
+
+    def get_latest_backup_path(self, doc_id: int) -> Optional[str]:
+        """Đường dẫn bản sao lưu mới nhất còn tồn tại của văn bản"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT backup_path FROM document_backups
+                    WHERE document_id = ?
+                    ORDER BY created_at DESC, id DESC
+                ''', (doc_id,))
+                for (backup_path,) in cursor.fetchall():
+                    if os.path.exists(backup_path):
+                        return backup_path
+                return None
         except Exception as e:
-            logger.error(f"Error loading suggestions: {str(e)}")
+            logger.error(f"Error getting latest backup: {str(e)}")
+            return None
+
+    @staticmethod
+    def _remove_file(path) -> int:
+        """Xóa file, trả về số byte thực sự giải phóng (0 nếu còn hardlink khác hoặc lỗi)"""
+        try:
+            info = os.stat(path)
+            os.remove(path)
+            return info.st_size if info.st_nlink <= 1 else 0
+        except OSError:
+            return 0
+
+    def backup_to(self, dest_path, progress_callback=None, pages=DB_BACKUP_PAGES_PER_STEP,
+                  pause=DB_BACKUP_STEP_PAUSE) -> bool:
+        """Sao lưu trực tuyến database ra dest_path bằng sqlite3 backup API
+        
+        Chép từng bước pages trang từ một kết nối chỉ đọc giữ nguyên read transaction, nên bản
+        sao là snapshot nhất quán (kể cả phần còn trong WAL) mà writer vẫn ghi bình thường.
+        progress_callback(done, total) trả về False để hủy. Trả về False nếu bị hủy.
+        """
+        dest_path = Path(dest_path)
+        temp_path = dest_path.with_name(dest_path.name + '.part')
+        canceled = False
+        
+        def progress(status, remaining, total):
+            nonlocal canceled
+            if progress_callback and progress_callback(total - remaining, total) is False:
+                canceled = True
+                raise InterruptedError("Database backup canceled")
+            if remaining and pause:
+                time.sleep(pause)
+                
+        source = self.conn_pool._connect(readonly=True)
+        source.isolation_level = None
+        target = None
+        try:
+            if temp_path.exists():
+                temp_path.unlink()
+            source.execute("BEGIN")
+            source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()  # Mở snapshot đọc
+            target = sqlite3.connect(str(temp_path))
+            try:
+                source.backup(target, pages=max(1, pages), progress=progress)
+            except Exception:
+                if canceled:
+                    return False
+                raise
+            target.close()
+            target = None
+            os.replace(temp_path, dest_path)
+            return True
+        finally:
+            if target is not None:
+                target.close()
+            source.close()
+            if temp_path.exists():
+                try:
+                    temp_path.unlink()
+                except OSError:
+                    pass
 
-    def get_suggestions(self, field_name: str, prefix: str = "") -> List[str]:
-        """Get suggestions for a field, optionally filtered by prefix"""
-        if field_name not in self.suggestions_cache:
+    def get_database_snapshots(self) -> List[Path]:
+        """Các bản sao lưu tự động, mới nhất trước"""
+        if not DB_BACKUP_DIR.exists():
             return []
+        return sorted(DB_BACKUP_DIR.glob('documents_auto_*.db'), reverse=True)
+
+    def changed_since(self, timestamp: float) -> bool:
+        """Database (file chính hoặc WAL) có được ghi sau thời điểm timestamp không"""
+        for path in (Path(self.db_path), Path(str(self.db_path) + '-wal')):
+            try:
+                if path.stat().st_mtime > timestamp:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def create_database_snapshot(self, progress_callback=None, force=False,
+                                 min_interval=DB_BACKUP_INTERVAL, keep=DB_BACKUP_KEEP) -> Optional[Path]:
+        """Sao lưu tự động vào DB_BACKUP_DIR theo lịch
+        
+        Bỏ qua (trả về None) khi bản mới nhất chưa quá min_interval giây hoặc database không
+        thay đổi kể từ bản đó, trừ khi force. Chỉ giữ keep bản mới nhất.
+        """
+        snapshots = self.get_database_snapshots()
+        if snapshots and not force:
+            last_time = snapshots[0].stat().st_mtime
+            if time.time() - last_time < min_interval or not self.changed_since(last_time):
+                return None
+                
+        DB_BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+        dest_path = DB_BACKUP_DIR / f"documents_auto_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+        if not self.backup_to(dest_path, progress_callback):
+            return None
             
-        suggestions = self.suggestions_cache[field_name]
-        if prefix:
-            suggestions = [s for s in suggestions 
-                         if s['value'].lower().startswith(prefix.lower())]
-            
-        return [s['value'] for s in sorted(
-            suggestions, 
-            key=lambda x: x['frequency'], 
-            reverse=True
-        )]
+        for old_path in self.get_database_snapshots()[max(1, keep):]:
+            try:
+                old_path.unlink()
+            except OSError as e:
+                logger.error(f"Error removing old database backup {old_path}: {str(e)}")
+        logger.info(f"Database snapshot created: {dest_path}")
+        return dest_path
+
+    def get_size_info(self) -> Dict[str, int]:
+        """Kích thước file database/WAL, số trang và trang trống"""
+        with self.conn_pool.connection(readonly=True) as conn:
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        wal_path = Path(str(self.db_path) + '-wal')
+        return {
+            'db_bytes': os.path.getsize(self.db_path),
+            'wal_bytes': wal_path.stat().st_size if wal_path.exists() else 0,
+            'page_size': page_size,
+            'page_count': page_count,
+            'free_pages': free_pages,
+            'auto_vacuum': auto_vacuum,
+        }
+
+    def run_maintenance(self, analyze: bool = None, cancel_check=None) -> Dict[str, Any]:
+        """Bảo trì database qua writer thread: ANALYZE/PRAGMA optimize, trả trang trống,
+        wal_checkpoint(TRUNCATE). Ghi log kích thước trước/sau và thời gian từng bước.
+
+        analyze=None: ANALYZE khi lần trước đã quá DB_ANALYZE_INTERVAL. Database chưa ở chế độ
+        incremental chỉ VACUUM đầy đủ (một lần, chuyển sang incremental) khi trang trống vượt
+        DB_VACUUM_MIN_FREE_RATIO. cancel_check() trả True để dừng giữa các bước vacuum.
+        """
+        before = self.get_size_info()
+        steps = {}
+        
+        def timed(name, func):
+            start = time.perf_counter()
+            result = self.writer.submit_unbatched(func).result()
+            steps[name] = (time.perf_counter() - start) * 1000.0
+            return result
+            
+        def run_analyze(conn):
+            conn.execute(f"PRAGMA analysis_limit = {int(DB_ANALYSIS_LIMIT)}")
+            conn.execute("ANALYZE")
+            
+        def vacuum_step(conn):
+            conn.execute(f"PRAGMA incremental_vacuum({int(DB_VACUUM_STEP_PAGES)})").fetchall()
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+            
+        def full_vacuum(conn):
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            
+        if analyze is None:
+            analyze = time.time() - self.last_analyze >= DB_ANALYZE_INTERVAL
+        if analyze:
+            timed('analyze', run_analyze)
+            self.last_analyze = time.time()
+        timed('optimize', lambda conn: conn.execute("PRAGMA optimize").fetchall())
+        
+        if before['auto_vacuum'] == 2:
+            # Mỗi bước là một lệnh riêng nên lệnh ghi khác chen vào được giữa các bước
+            start = time.perf_counter()
+            remaining = before['free_pages']
+            while remaining > 0 and not (cancel_check and cancel_check()):
+                remaining = self.writer.submit_unbatched(vacuum_step).result()
+            steps['incremental_vacuum'] = (time.perf_counter() - start) * 1000.0
+        elif before['page_count'] and before['free_pages'] / before['page_count'] >= DB_VACUUM_MIN_FREE_RATIO:
+            timed('vacuum', full_vacuum)
+            
+        checkpoint = timed('wal_checkpoint', lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+        after = self.get_size_info()
+        
+        report = {
+            'before': before,
+            'after': after,
+            'steps_ms': {name: round(ms, 1) for name, ms in steps.items()},
+            'checkpoint_busy': bool(checkpoint[0]),
+            'bytes_reclaimed': (before['db_bytes'] + before['wal_bytes']) - (after['db_bytes'] + after['wal_bytes']),
+        }
+        logger.info(
+            f"Database maintenance: db {before['db_bytes']} -> {after['db_bytes']} bytes, "
+            f"wal {before['wal_bytes']} -> {after['wal_bytes']} bytes, "
+            f"free pages {before['free_pages']} -> {after['free_pages']}, "
+            f"steps {report['steps_ms']} ms, checkpoint busy: {report['checkpoint_busy']}"
+        )
+        return report
+
+    def load_suggestions(self):
+        """Load suggestions from database into the in-memory index"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT field_name, value, frequency
+                    FROM field_suggestions
+                ''')
+                self.suggestion_index.load(cursor.fetchall())
+                
+        except Exception as e:
+            logger.error(f"Error loading suggestions: {str(e)}")
+
+    def get_suggestions(self, field_name: str, prefix: str = "", limit: int = None) -> List[str]:
+        """Get suggestions for a field, optionally filtered by prefix (không phân biệt dấu)"""
+        return self.suggestion_index.complete(field_name, prefix, limit)
+
+    def search_suggestions(self, field_name: str, text: str, limit: int = SUGGESTION_LIMIT) -> List[str]:
+        """Gợi ý khớp tiền tố trước, sau đó các gợi ý chứa text ở giữa"""
+        prefixed = self.suggestion_index.complete(field_name, text, limit)
+        if len(prefixed) >= limit or not text:
+            return prefixed
+        seen = set(prefixed)
+        contained = [value for value in self.suggestion_index.search(field_name, text, limit + len(prefixed))
+                     if value not in seen]
+        return prefixed + contained[:limit - len(prefixed)]
+
+    def add_suggestion_listener(self, callback):
+        """Đăng ký callback(field_name, value, frequency) khi gợi ý được thêm/tăng tần suất"""
+        if callback not in self.suggestion_listeners:
+            self.suggestion_listeners.append(callback)
+
+    def remove_suggestion_listener(self, callback):
+        if callback in self.suggestion_listeners:
+            self.suggestion_listeners.remove(callback)
 
     def add_suggestion(self, field_name: str, value: str):
-        """Add or update a suggestion in the database"""
+        """Add or update a suggestion (chỉ mục cập nhật ngay, database ghi dồn theo lô)
+        
+        Tần suất được đệm trong bộ nhớ và ghi bằng một UPSERT executemany khi đủ
+        SUGGESTION_FLUSH_MAX_PENDING lượt, khi lượt cũ nhất quá SUGGESTION_FLUSH_INTERVAL,
+        khi gọi flush_suggestions() hoặc close(). Crash chỉ mất tối đa chừng đó lượt tăng.
+        """
         if not value or not value.strip():
             return
             
         value = value.strip()
+        with self.pending_lock:
+            self.pending_suggestions[(field_name, value)] += 1
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            pending = sum(self.pending_suggestions.values())
+            age_ms = (time.monotonic() - self.pending_since) * 1000
+        self._cache_suggestion(field_name, value)
+        
+        if pending >= SUGGESTION_FLUSH_MAX_PENDING or age_ms >= SUGGESTION_FLUSH_INTERVAL:
+            self.flush_suggestions()
+
+    def flush_suggestions(self) -> int:
+        """Ghi các lượt tăng tần suất đang đệm trong một transaction, trả về số dòng đã ghi"""
+        with self.pending_lock:
+            if not self.pending_suggestions:
+                return 0
+            pending, self.pending_suggestions = self.pending_suggestions, Counter()
+            self.pending_since = None
             
         try:
-            conn = self.conn_pool.get_connection()
-            with conn:  # Auto commit/rollback
-                cursor = conn.cursor()
-                
-                # Check if suggestion exists
-                cursor.execute('''
-                    SELECT id, frequency FROM field_suggestions
-                    WHERE field_name = ? AND value = ?
-                ''', (field_name, value))
-                
-                result = cursor.fetchone()
-                if result:
-                    cursor.execute('''
-                        UPDATE field_suggestions
-                        SET frequency = frequency + 1,
-                            last_used = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                    ''', (result[0],))
-                else:
-                    cursor.execute('''
-                        INSERT INTO field_suggestions (field_name, value)
-                        VALUES (?, ?)
-                    ''', (field_name, value))
-                    
-            # Update cache
-            if field_name not in self.suggestions_cache:
-                self.suggestions_cache[field_name] = []
-                
-            # Find suggestion in cache
-            found = False
-            for suggestion in self.suggestions_cache[field_name]:
-                if suggestion['value'] == value:
-                    suggestion['frequency'] += 1
-                    found = True
-                    break
-                    
-            # Add to cache if not found
-            if not found:
-                self.suggestions_cache[field_name].append({
-                    'value': value,
-                    'frequency': 1
-                })
-                
+            rows = [(field, value, count) for (field, value), count in pending.items()]
+            self.writer.execute(lambda conn: conn.executemany(self.SUGGESTION_UPSERT_SQL, rows))
+            return len(pending)
         except Exception as e:
-            logger.error(f"Error adding suggestion: {str(e)}")
+            logger.error(f"Error flushing suggestions: {str(e)}")
+            # Trả lại bộ đệm để lần flush sau ghi tiếp
+            with self.pending_lock:
+                self.pending_suggestions.update(pending)
+                if self.pending_since is None:
+                    self.pending_since = time.monotonic()
+            return 0
 
-    def add_document(self, file_path: str, ocr_results: Dict[str, Any], page_count: int = None) -> int:
-        """Create a new document in the database"""
+    SUGGESTION_UPSERT_SQL = '''
+        INSERT INTO field_suggestions (field_name, value, frequency)
+        VALUES (?, ?, ?)
+        ON CONFLICT(field_name, value) DO UPDATE SET
+            frequency = frequency + excluded.frequency,
+            last_used = CURRENT_TIMESTAMP
+    '''
+
+    def _cache_suggestion(self, field_name: str, value: str, count: int = 1):
+        """Cập nhật chỉ mục gợi ý sau khi đã ghi vào database và báo cho listener"""
+        frequency = self.suggestion_index.add(field_name, value, count)
+        for callback in list(self.suggestion_listeners):
+            try:
+                callback(field_name, value, frequency)
+            except Exception as e:
+                logger.error(f"Error in suggestion listener: {str(e)}")
+
+    @staticmethod
+    def _ocr_version_values(ocr_results: Dict[str, Any]) -> Tuple:
+        """Các trường phiên bản 1 (theo thứ tự cột document_versions) từ kết quả OCR"""
+        return (
+            ocr_results.get('CQBH_tren', ''),
+            ocr_results.get('CQBH_duoi', ''),
+            ocr_results.get('So_Ki_Hieu', ''),
+            ocr_results.get('Loai_VB', ''),
+            ocr_results.get('ND_Chinh', ''),
+            ocr_results.get('Ngay_BH', ''),
+            ocr_results.get('Noi_Nhan', ''),
+            ocr_results.get('Chuc_Vu', ''),
+            ocr_results.get('Chu_Ky', ''),
+            ocr_results.get('Do_Khan', 'Không'),
+        )
+
+    @staticmethod
+    def _ocr_suggestion_values(ocr_results: Dict[str, Any]) -> Dict[str, str]:
+        """Các trường OCR được đưa vào gợi ý nhập liệu"""
+        return {
+            'so_ki_hieu': ocr_results.get('So_Ki_Hieu', ''),
+            'loai_vb': ocr_results.get('Loai_VB', ''),
+            'chuc_vu': ocr_results.get('Chuc_Vu', ''),
+            'cqbh_tren': ocr_results.get('CQBH_tren', ''),
+            'cqbh_duoi': ocr_results.get('CQBH_duoi', ''),
+            'do_khan': ocr_results.get('Do_Khan', 'Không')
+        }
+
+    @staticmethod
+    def _pdf_page_count(file_path: str) -> Optional[int]:
+        """Đếm số trang PDF khi OCR không trả về page_count"""
+        if Path(file_path).suffix.lower() != '.pdf':
+            return None
+        try:
+            # Sử dụng pdf2image để đếm số trang
+            from pdf2image.pdf2image import pdfinfo_from_path
+            info = pdfinfo_from_path(file_path)
+            return info["Pages"]
+        except:
+            return None
+
+    def add_document(self, file_path: str, ocr_results: Dict[str, Any], page_count: int = None,
+                     recorder: 'SpanRecorder' = None) -> int:
+        """Create a new document in the database (metrics của recorder ghi cùng transaction)"""
+        stage_start = time.perf_counter()
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"File not found: {file_path}")
                 
-            # Calculate file hash for duplicate detection
-            file_hash = self._calculate_file_hash(file_path)
-            file_size = os.path.getsize(file_path)
-            
-            # Check if this document already exists
-            existing_id = self._check_duplicate_document(file_path, file_hash)
-            if existing_id:
-                logger.info(f"Document already exists with ID {existing_id}")
-                return existing_id
-            
-            if page_count is None and Path(file_path).suffix.lower() == '.pdf':
-                try:
-                    # Sử dụng pdf2image để đếm số trang
-                    from pdf2image.pdf2image import pdfinfo_from_path
-                    info = pdfinfo_from_path(file_path)
-                    page_count = info["Pages"]
-                except:
-                    page_count = None
+            if page_count is None:
+                page_count = self._pdf_page_count(file_path)
                     
-            # Insert document
-            conn = self.conn_pool.get_connection()
-            with conn:
+            # Kiểm tra trùng và insert trong cùng transaction ghi (không có khe giữa kiểm tra và ghi)
+            def write(conn, quick_hash, file_hash, file_size):
                 cursor = conn.cursor()
+                found = self._find_existing_documents(
+                    cursor, [file_path], [(quick_hash, file_hash)] if quick_hash else []
+                )
+                existing_id = found.get(file_path) or (file_hash and found.get(file_hash))
+                if existing_id:
+                    return existing_id, False
+                if not file_hash and quick_hash in found:
+                    return None  # Cần full_hash để xác nhận, băm ngoài transaction rồi chạy lại
+                    
                 cursor.execute('''
-                    INSERT INTO documents (file_path, file_name, file_hash, file_size, page_count)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (file_path, Path(file_path).name, file_hash, file_size, page_count))
+                    INSERT INTO documents (file_path, file_name, file_hash, quick_hash, file_size, page_count)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (file_path, Path(file_path).name, file_hash, quick_hash, file_size, page_count))
                 
                 doc_id = cursor.lastrowid
                 
@@ -1591,209 +3298,601 @@ class DocumentDatabase:
                         so_ki_hieu, loai_vb, nd_chinh, ngay_bh,
                         noi_nhan, chuc_vu, chu_ky, do_khan, modified_by
                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    doc_id, 1,
-                    ocr_results.get('CQBH_tren', ''),
-                    ocr_results.get('CQBH_duoi', ''),
-                    ocr_results.get('So_Ki_Hieu', ''),
-                    ocr_results.get('Loai_VB', ''),
-                    ocr_results.get('ND_Chinh', ''),
-                    ocr_results.get('Ngay_BH', ''),
-                    ocr_results.get('Noi_Nhan', ''),
-                    ocr_results.get('Chuc_Vu', ''),
-                    ocr_results.get('Chu_Ky', ''),
-                    ocr_results.get('Do_Khan', 'Không'),
-                    'OCR System'
-                ))
+                ''', (doc_id, 1) + self._ocr_version_values(ocr_results) + ('OCR System',))
+                
+                self._refresh_document_current(cursor, doc_id)
+                
+                if recorder:
+                    recorder.record_since('db_write', stage_start)
+                    cursor.executemany(self.PROCESSING_METRICS_INSERT_SQL, self._metric_rows(doc_id, recorder))
+                return doc_id, True
+                
+            # Calculate file hash for duplicate detection
+            doc_id, created = self._write_with_fingerprints(
+                [file_path], lambda fingerprints: self.writer.execute(
+                    write, *self._ingest_fingerprint(fingerprints, file_path)))
+            if not created:
+                logger.info(f"Document already exists with ID {doc_id}")
+                return doc_id
             
             # Add suggestions for all fields
-            for field, value in {
-                'so_ki_hieu': ocr_results.get('So_Ki_Hieu', ''),
-                'loai_vb': ocr_results.get('Loai_VB', ''),
-                'chuc_vu': ocr_results.get('Chuc_Vu', ''),
-                'cqbh_tren': ocr_results.get('CQBH_tren', ''),
-                'cqbh_duoi': ocr_results.get('CQBH_duoi', ''),
-                'do_khan': ocr_results.get('Do_Khan', 'Không')
-            }.items():
+            for field, value in self._ocr_suggestion_values(ocr_results).items():
                 if value:
                     self.add_suggestion(field, value)
+            
             return doc_id
             
         except Exception as e:
             logger.error(f"Error adding document: {str(e)}")
             raise
     
-    def _calculate_file_hash(self, file_path: str) -> str:
-        """Calculate SHA-256 hash of a file for deduplication"""
-        import hashlib
+    def add_documents_bulk(self, items: List[Dict[str, Any]]) -> List[int]:
+        """Thêm nhiều văn bản (phiên bản 1, detections từng trang, gợi ý, metrics) trong một transaction
+        
+        Mỗi item: {'file_path', 'ocr_results', 'page_count' (tùy chọn),
+        'pages': [(page_number, detections, page_text, page_transform), ...] (tùy chọn),
+        'recorder': SpanRecorder (tùy chọn)}.
+        Trả về doc_id theo đúng thứ tự items; văn bản đã có (trùng đường dẫn/hash) trả về id cũ
+        và không ghi lại.
+        """
+        stage_start = time.perf_counter()
+        try:
+            # Đọc file/hash ngoài transaction để không giữ khóa ghi lâu (băm song song, có cache)
+            for item in items:
+                if not os.path.exists(item['file_path']):
+                    raise FileNotFoundError(f"File not found: {item['file_path']}")
+            page_counts = [
+                item['page_count'] if item.get('page_count') is not None else self._pdf_page_count(item['file_path'])
+                for item in items
+            ]
+            prepared = []
+            
+            doc_ids = []
+            new_doc_ids = []
+            seen = {}  # file_path/hash -> doc_id (trùng ngay trong lô)
+            versions = []
+            pages = []
+            recorders = []
+            suggestion_counts = Counter()
+            
+            def write(conn):
+                cursor = conn.cursor()
+                # Kiểm tra trùng cho cả lô bằng vài truy vấn IN thay vì hai truy vấn mỗi file
+                seen.update(self._find_existing_documents(
+                    cursor,
+                    [row[1] for row in prepared],
+                    [(row[3], row[2]) for row in prepared if row[3]]
+                ))
+                if any(not row[2] and row[3] in seen for row in prepared):
+                    seen.clear()
+                    return None  # Cần full_hash để xác nhận, băm ngoài transaction rồi chạy lại
+                for item, file_path, file_hash, quick_hash, file_size, page_count in prepared:
+                    existing_id = seen.get(file_path) or (file_hash and seen.get(file_hash))
+                    if existing_id:
+                        logger.info(f"Document already exists with ID {existing_id}")
+                        doc_ids.append(existing_id)
+                        continue
+                
+                    # Cần lastrowid nên documents chèn từng dòng (vẫn trong cùng transaction)
+                    cursor.execute('''
+                        INSERT INTO documents (file_path, file_name, file_hash, quick_hash, file_size, page_count)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (file_path, Path(file_path).name, file_hash, quick_hash, file_size, page_count))
+                    doc_id = cursor.lastrowid
+                    doc_ids.append(doc_id)
+                    new_doc_ids.append(doc_id)
+                    seen[file_path] = doc_id
+                    if file_hash:
+                        seen[file_hash] = doc_id
+                
+                    ocr_results = item.get('ocr_results') or {}
+                    versions.append((doc_id, 1) + self._ocr_version_values(ocr_results) + ('OCR System',))
+                    for field, value in self._ocr_suggestion_values(ocr_results).items():
+                        if value and value.strip():
+                            suggestion_counts[(field, value.strip())] += 1
+                
+                    for page_number, detections, page_text, page_transform in item.get('pages') or []:
+                        pages.append((doc_id, page_number) + DetectionCodec.encode(detections) +
+                                     (page_text, json.dumps(page_transform) if page_transform else None))
+                
+                    if item.get('recorder'):
+                        recorders.append((doc_id, item['recorder']))
+                
+                cursor.executemany('''
+                    INSERT INTO document_versions (
+                        document_id, version_number, cqbh_tren, cqbh_duoi,
+                        so_ki_hieu, loai_vb, nd_chinh, ngay_bh,
+                        noi_nhan, chuc_vu, chu_ky, do_khan, modified_by
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', versions)
+                self._refresh_document_current(cursor, doc_ids=new_doc_ids)
+                cursor.executemany(self.PAGE_DETECTIONS_UPSERT_SQL, pages)
+                cursor.executemany(self.SUGGESTION_UPSERT_SQL,
+                                   [(field, value, count) for (field, value), count in suggestion_counts.items()])
+                
+                # Thời gian ghi chia đều cho các văn bản trong lô
+                db_write_ms = (time.perf_counter() - stage_start) * 1000.0 / max(1, len(new_doc_ids))
+                metrics = []
+                for doc_id, recorder in recorders:
+                    recorder.record('db_write', db_write_ms)
+                    metrics.extend(self._metric_rows(doc_id, recorder))
+                cursor.executemany(self.PROCESSING_METRICS_INSERT_SQL, metrics)
+                return True
+                
+            def attempt(fingerprints):
+                prepared.clear()
+                for item, page_count in zip(items, page_counts):
+                    file_path = item['file_path']
+                    quick_hash, file_hash, file_size = self._ingest_fingerprint(fingerprints, file_path)
+                    prepared.append((item, file_path, file_hash, quick_hash, file_size, page_count))
+                return self.writer.execute(write)
+            self._write_with_fingerprints([item['file_path'] for item in items], attempt)
+            for (field, value), count in suggestion_counts.items():
+                self._cache_suggestion(field, value, count)
+            
+            logger.info(f"Bulk added {len(new_doc_ids)} documents, {len(pages)} pages "
+                        f"in {(time.perf_counter() - stage_start) * 1000:.0f} ms")
+            return doc_ids
+            
+        except Exception as e:
+            logger.error(f"Error bulk adding documents: {str(e)}")
+            raise
+    
+    PROCESSING_METRICS_INSERT_SQL = '''
+        INSERT INTO processing_metrics (document_id, page_number, stage, duration_ms)
+        VALUES (?, ?, ?, ?)
+    '''
+
+    @staticmethod
+    def _metric_rows(doc_id: int, recorder: 'SpanRecorder') -> List[Tuple[int, Optional[int], str, float]]:
+        """Dòng processing_metrics (cấp văn bản và cấp trang) từ thời gian của recorder"""
+        return [
+            (doc_id, page_number, stage, duration_ms)
+            for (stage, page_number), duration_ms in recorder.totals().items()
+        ]
+    
+    def get_processing_metrics_summary(self) -> List[Tuple[str, int, float, float]]:
+        """Tính p50/p95 (ms) cho từng giai đoạn xử lý"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT stage, duration_ms
+                    FROM processing_metrics
+                    ORDER BY stage, duration_ms
+                ''')
+            
+                by_stage = {}
+                for stage, duration_ms in cursor.fetchall():
+                    by_stage.setdefault(stage, []).append(duration_ms)
+            
+                def percentile(values, pct):
+                    # Nearest-rank trên danh sách đã sắp xếp
+                    rank = -(-pct * len(values) // 100)
+                    return values[max(0, rank - 1)]
+            
+                return [
+                    (stage, len(values), percentile(values, 50), percentile(values, 95))
+                    for stage, values in sorted(by_stage.items())
+                ]
+        except Exception as e:
+            logger.error(f"Error getting processing metrics: {str(e)}")
+            return []
+    
+    def _write_with_fingerprints(self, file_paths: List[str], attempt: Callable, max_attempts: int = 3):
+        """Lấy dấu vân tay (ingest_fingerprints) rồi gọi attempt(fingerprints) để ghi
         
+        attempt trả về None khi trong transaction gặp văn bản cùng quick_hash mà file chưa có
+        full_hash (văn bản trùng vừa được thêm sau lúc lấy dấu vân tay): lấy lại dấu vân tay,
+        lúc này ứng viên đã commit nên file được băm toàn bộ, rồi ghi lại.
+        """
+        for _ in range(max_attempts):
+            result = attempt(self.ingest_fingerprints(file_paths))
+            if result is not None:
+                return result
+        raise RuntimeError(f"Duplicate check did not settle after {max_attempts} attempts")
+
+    @staticmethod
+    def _ingest_fingerprint(fingerprints: Dict[str, Tuple[str, str, int]], file_path: str) -> Tuple:
+        """Dấu vân tay của file khi thêm văn bản; file không đọc được vẫn thêm, chỉ kiểm tra trùng theo đường dẫn"""
+        fingerprint = fingerprints.get(file_path)
+        if fingerprint is None:
+            logger.error(f"Cannot read {file_path} for hashing, duplicate check uses the file path only")
+            return None, "", None
+        return fingerprint
+
+    def _calculate_file_hash(self, file_path: str) -> str:
+        """Calculate SHA-256 hash of a file for deduplication (dùng cache, "" nếu không đọc được)"""
+        fingerprint = self.file_fingerprints([file_path]).get(file_path)
+        return fingerprint[1] if fingerprint else ""
+
+    def file_fingerprints(self, file_paths: List[str], workers: int = FILE_HASH_WORKERS,
+                          full: bool = True) -> Dict[str, Tuple[str, Optional[str], int]]:
+        """Dấu vân tay hai tầng của các file: {file_path: (quick_hash, full_hash, file_size)}
+        
+        quick_hash (kích thước + SHA-256 của 1 MB đầu và cuối) dùng để tìm ứng viên trùng,
+        full_hash (SHA-256 toàn file) để xác nhận. Kết quả cache theo (đường dẫn, kích thước,
+        mtime) trong file_hash_cache; file chưa có trong cache được băm song song.
+        full=False: file chưa có trong cache chỉ tính quick_hash (full_hash None, không ghi cache).
+        File không đọc được bị bỏ khỏi kết quả.
+        """
+        stats = {}
+        for file_path in dict.fromkeys(file_paths):
+            try:
+                info = os.stat(file_path)
+                stats[file_path] = (info.st_size, info.st_mtime_ns)
+            except OSError as e:
+                logger.error(f"Error calculating file hash: {str(e)}")
+                
+        result = self._cached_fingerprints(stats)
+        pending = [file_path for file_path in stats if file_path not in result]
+        if not pending:
+            return result
+            
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as executor:
+            if not full:
+                for file_path, quick_hash in zip(pending, executor.map(self.quick_fingerprint, pending)):
+                    if quick_hash is not None:
+                        result[file_path] = (quick_hash, None, stats[file_path][0])
+                return result
+            hashed = dict(zip(pending, executor.map(self._hash_file, pending)))
+        rows = []
+        for file_path, hashes in hashed.items():
+            if hashes is None:
+                continue
+            size, mtime_ns = stats[file_path]
+            result[file_path] = hashes + (size,)
+            rows.append((file_path, size, mtime_ns) + hashes)
+            
+        if rows:
+            # Cache không cần chờ commit
+            future = self.writer.submit(lambda conn: conn.executemany(self.FILE_HASH_CACHE_UPSERT_SQL, rows))
+            future.add_done_callback(lambda f: self._log_write_error(f, "Error caching file hashes"))
+        return result
+
+    FILE_HASH_CACHE_UPSERT_SQL = '''
+        INSERT INTO file_hash_cache (file_path, file_size, file_mtime_ns, quick_hash, full_hash)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(file_path) DO UPDATE SET
+            file_size = excluded.file_size,
+            file_mtime_ns = excluded.file_mtime_ns,
+            quick_hash = excluded.quick_hash,
+            full_hash = excluded.full_hash
+    '''
+
+    def _cached_fingerprints(self, stats: Dict[str, Tuple[int, int]],
+                             chunk_size: int = 500) -> Dict[str, Tuple[str, str, int]]:
+        """Các file có hash trong cache còn khớp kích thước và mtime"""
+        found = {}
+        try:
+            paths = list(stats)
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                for i in range(0, len(paths), chunk_size):
+                    chunk = paths[i:i + chunk_size]
+                    cursor.execute(
+                        f"SELECT file_path, file_size, file_mtime_ns, quick_hash, full_hash FROM file_hash_cache "
+                        f"WHERE file_path IN ({', '.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    for file_path, size, mtime_ns, quick_hash, full_hash in cursor.fetchall():
+                        if stats[file_path] == (size, mtime_ns):
+                            found[file_path] = (quick_hash, full_hash, size)
+        except Exception as e:
+            logger.error(f"Error reading file hash cache: {str(e)}")
+        return found
+
+    @staticmethod
+    def _hash_file(file_path: str) -> Optional[Tuple[str, str]]:
+        """(quick_hash, full_hash) của một file, đọc file một lần bằng bộ đệm lớn"""
         try:
-            sha256_hash = hashlib.sha256()
+            full = hashlib.sha256()
             with open(file_path, "rb") as f:
-                # Read the file in chunks to handle large files efficiently
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            return sha256_hash.hexdigest()
+                size = os.fstat(f.fileno()).st_size
+                head = f.read(QUICK_FINGERPRINT_BYTES)
+                full.update(head)
+                
+                # hashlib nhả GIL khi băm khối lớn nên nhiều file băm song song được
+                buffer = bytearray(FILE_HASH_BUFFER_SIZE)
+                view = memoryview(buffer)
+                tail = b""
+                while True:
+                    read = f.readinto(buffer)
+                    if not read:
+                        break
+                    full.update(view[:read])
+                    if read >= QUICK_FINGERPRINT_BYTES:
+                        tail = bytes(view[read - QUICK_FINGERPRINT_BYTES:read])
+                    else:
+                        tail = (tail + bytes(view[:read]))[-QUICK_FINGERPRINT_BYTES:]
+            return DocumentDatabase._quick_hash(size, head, tail), full.hexdigest()
         except Exception as e:
             logger.error(f"Error calculating file hash: {str(e)}")
-            return ""
-            
-    def _check_duplicate_document(self, file_path: str, file_hash: str) -> Optional[int]:
-        """Check if document already exists by path or hash"""
-        if not file_hash:
             return None
-            
+
+    @staticmethod
+    def _quick_hash(size: int, head: bytes, tail: bytes) -> str:
+        """Dấu vân tay nhanh: kích thước + SHA-256 của phần đầu và phần cuối file"""
+        quick = hashlib.sha256(head)
+        quick.update(tail)
+        return f"{size}:{quick.hexdigest()}"
+
+    @staticmethod
+    def quick_fingerprint(file_path: str) -> Optional[str]:
+        """Tính riêng dấu vân tay nhanh (chỉ đọc tối đa 2 x QUICK_FINGERPRINT_BYTES), None nếu lỗi"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            
-            # First check by file path
+            with open(file_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                head = f.read(QUICK_FINGERPRINT_BYTES)
+                tail = b""
+                if size > QUICK_FINGERPRINT_BYTES:
+                    f.seek(max(QUICK_FINGERPRINT_BYTES, size - QUICK_FINGERPRINT_BYTES))
+                    tail = f.read(QUICK_FINGERPRINT_BYTES)
+            return DocumentDatabase._quick_hash(size, head, tail)
+        except Exception as e:
+            logger.error(f"Error calculating file hash: {str(e)}")
+            return None
+
+    def ingest_fingerprints(self, file_paths: List[str]) -> Dict[str, Tuple[str, Optional[str], int]]:
+        """Dấu vân tay khi thêm văn bản: quick_hash cho mọi file, full_hash chỉ khi có ứng viên trùng
+        
+        Ứng viên là văn bản cùng quick_hash, văn bản cũ chưa có quick_hash cùng kích thước, hoặc
+        file khác trong lô cùng quick_hash. File không có ứng viên được thêm với full_hash NULL;
+        khi sau này có file trùng quick_hash, full_hash của văn bản đó được băm bổ sung từ file gốc.
+        """
+        result = self.file_fingerprints(file_paths, full=False)
+        pending = {path: fingerprint for path, fingerprint in result.items() if fingerprint[1] is None}
+        if not pending:
+            return result
+            
+        in_batch = Counter(quick_hash for quick_hash, _, _ in result.values())
+        with self.conn_pool.connection(readonly=True) as conn:
+            quick_hashes, sizes, unhashed = self._duplicate_candidates(conn.cursor(), list(pending.values()))
+        need = [path for path, (quick_hash, _, size) in pending.items()
+                if quick_hash in quick_hashes or size in sizes or in_batch[quick_hash] > 1]
+        if need:
+            result.update(self.file_fingerprints(need))
+            self._backfill_document_hashes([row for row in unhashed if row[2] in quick_hashes])
+        return result
+
+    def _duplicate_candidates(self, cursor, fingerprints: List[Tuple[str, Optional[str], int]],
+                              chunk_size: int = 500) -> Tuple[set, set, List[Tuple[int, str, str]]]:
+        """Ứng viên trùng theo quick_hash/kích thước (chưa đọc toàn file)
+        
+        Trả về (các quick_hash có văn bản trùng, các kích thước có văn bản cũ chưa có quick_hash,
+        [(doc_id, file_path, quick_hash)] văn bản ứng viên chưa có full_hash).
+        """
+        quick_hashes, sizes, unhashed = set(), set(), []
+        values = list(dict.fromkeys(quick_hash for quick_hash, _, _ in fingerprints))
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
             cursor.execute(
-                "SELECT id FROM documents WHERE file_path = ? LIMIT 1",
-                (file_path,)
+                f"SELECT id, file_path, quick_hash, file_hash FROM documents "
+                f"WHERE quick_hash IN ({', '.join('?' * len(chunk))})",
+                chunk
             )
-            result = cursor.fetchone()
-            if result:
-                return result[0]
-                
-            # Then check by hash if provided
+            for doc_id, file_path, quick_hash, file_hash in cursor.fetchall():
+                quick_hashes.add(quick_hash)
+                if not file_hash:
+                    unhashed.append((doc_id, file_path, quick_hash))
+                    
+        # Văn bản trước khi có quick_hash: lọc theo kích thước (không rõ kích thước thì coi mọi file là ứng viên)
+        values = list(dict.fromkeys(size for _, _, size in fingerprints))
+        cursor.execute("SELECT 1 FROM documents WHERE quick_hash IS NULL AND file_size IS NULL LIMIT 1")
+        if cursor.fetchone():
+            return quick_hashes, set(values), unhashed
+        for i in range(0, len(values), chunk_size):
+            chunk = values[i:i + chunk_size]
             cursor.execute(
-                "SELECT id FROM documents WHERE file_hash = ? LIMIT 1",
-                (file_hash,)
+                f"SELECT DISTINCT file_size FROM documents "
+                f"WHERE quick_hash IS NULL AND file_size IN ({', '.join('?' * len(chunk))})",
+                chunk
             )
-            result = cursor.fetchone()
-            if result:
-                return result[0]
-                
-            return None
-        except Exception as e:
-            logger.error(f"Error checking for duplicate document: {str(e)}")
-            return None
+            sizes.update(size for size, in cursor.fetchall())
+        return quick_hashes, sizes, unhashed
 
-    def add_page_detections(self, doc_id: int, page_number: int, detections: List[Dict], page_text: str = None):
+    def _backfill_document_hashes(self, rows: List[Tuple[int, str, str]]):
+        """Băm bổ sung full_hash cho văn bản ứng viên từ file gốc (bỏ qua nếu file đã đổi/mất)"""
+        if not rows:
+            return
+        fingerprints = self.file_fingerprints([file_path for _, file_path, _ in rows])
+        updates = [
+            (fingerprints[file_path][1], doc_id)
+            for doc_id, file_path, quick_hash in rows
+            if file_path in fingerprints and fingerprints[file_path][0] == quick_hash
+        ]
+        if updates:
+            self.writer.execute(lambda conn: conn.executemany(
+                "UPDATE documents SET file_hash = ? WHERE id = ? AND (file_hash IS NULL OR file_hash = '')",
+                updates
+            ))
+            
+    PAGE_DETECTIONS_UPSERT_SQL = '''
+        INSERT INTO page_detections (document_id, page_number, detection_blob, detection_text,
+                                     page_text, page_transform)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(document_id, page_number) DO UPDATE SET
+            detection_blob = excluded.detection_blob,
+            detection_text = excluded.detection_text,
+            detection_data = NULL,
+            page_text = excluded.page_text,
+            page_transform = excluded.page_transform
+    '''
+
+    def _find_existing_documents(self, cursor, file_paths: List[str], fingerprints: List[Tuple[str, str]],
+                                 chunk_size: int = 500) -> Dict[str, int]:
+        """Tìm văn bản đã có theo đường dẫn hoặc nội dung, trả về {file_path/full_hash/quick_hash: doc_id}
+        
+        fingerprints: [(quick_hash, full_hash)]. Ứng viên được lọc theo quick_hash (có index) rồi
+        xác nhận bằng full_hash; văn bản cũ chưa có quick_hash so trực tiếp theo full_hash.
+        File chưa băm toàn bộ (full_hash None) mà có văn bản cùng quick_hash thì trả về theo
+        khóa quick_hash: người gọi cần băm toàn file rồi kiểm tra lại.
+        """
+        found = {}
+        wanted = {full_hash for _, full_hash in fingerprints if full_hash}
+        unconfirmed = {quick for quick, full_hash in fingerprints if quick and not full_hash}
+        lookups = (
+            ("file_path", "file_path IN ({})", list(dict.fromkeys(file_paths))),
+            ("quick_hash, file_hash", "quick_hash IN ({})",
+             list(dict.fromkeys(quick for quick, _ in fingerprints if quick))),
+            ("file_hash", "quick_hash IS NULL AND file_hash IN ({})", sorted(wanted)),
+        )
+        for columns, condition, values in lookups:
+            for i in range(0, len(values), chunk_size):
+                chunk = values[i:i + chunk_size]
+                cursor.execute(
+                    f"SELECT {columns}, MIN(id) FROM documents "
+                    f"WHERE {condition.format(', '.join('?' * len(chunk)))} GROUP BY {columns}",
+                    chunk
+                )
+                for *keys, doc_id in cursor.fetchall():
+                    if columns == "file_path":
+                        found.setdefault(keys[0], doc_id)
+                        continue
+                    if keys[-1] in wanted:
+                        found.setdefault(keys[-1], doc_id)
+                    if len(keys) == 2 and keys[0] in unconfirmed:
+                        found.setdefault(keys[0], doc_id)
+        return found
+
+    def add_page_detections(self, doc_id: int, page_number: int, detections: List[Dict], page_text: str = None,
+                            page_transform: Dict = None):
         """Save detections for a specific page"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            
-            # Check if detections already exist for this page
-            cursor.execute(
-                "SELECT id FROM page_detections WHERE document_id = ? AND page_number = ?",
-                (doc_id, page_number)
-            )
-            
-            existing = cursor.fetchone()
-            if existing:
+            # Transform hướng/độ nghiêng của trang (tọa độ box tính trên trang đã hiệu chỉnh)
+            transform_json = json.dumps(page_transform) if page_transform else None
+            params = (doc_id, page_number) + DetectionCodec.encode(detections) + (page_text, transform_json)
+            self.writer.execute(lambda conn: conn.execute(self.PAGE_DETECTIONS_UPSERT_SQL, params))
+        except Exception as e:
+            logger.error(f"Error adding page detections: {str(e)}")
+            raise
+
+    def get_page_transform(self, doc_id: int, page_number: int) -> Optional[Dict]:
+        """Lấy transform hướng/độ nghiêng đã lưu của một trang"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
                 cursor.execute(
-                    "UPDATE page_detections SET detection_data = ?, page_text = ? WHERE id = ?",
-                    (json.dumps(detections), page_text, existing[0])
-                )
-            else:
-                cursor.execute('''
-                    INSERT INTO page_detections (document_id, page_number, detection_data, page_text)
-                    VALUES (?, ?, ?, ?)
-                ''', (doc_id, page_number, json.dumps(detections), page_text))
-                
-            conn.commit()
+                    "SELECT page_transform FROM page_detections WHERE document_id = ? AND page_number = ?",
+                    (doc_id, page_number)
+                )
+                result = cursor.fetchone()
+                if result and result[0]:
+                    return json.loads(result[0])
+                return None
         except Exception as e:
-            logger.error(f"Error adding page detections: {str(e)}")
-            raise
+            logger.error(f"Error getting page transform: {str(e)}")
+            return None
 
     def get_document_detections(self, doc_id: int, page_number: int = None) -> Union[List[Dict], Dict[int, List[Dict]]]:
         """Get detections for a document page or all pages"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
             
-            if page_number is not None:
+                if page_number is not None:
+                    cursor.execute('''
+                        SELECT detection_blob, detection_text
+                        FROM page_detections
+                        WHERE document_id = ? AND page_number = ?
+                    ''', (doc_id, page_number))
+                
+                    result = cursor.fetchone()
+                    if result and result[0]:
+                        return DetectionCodec.decode(result[0], result[1])
+                    return []
+                else:
+                    cursor.execute('''
+                        SELECT page_number, detection_blob, detection_text
+                        FROM page_detections
+                        WHERE document_id = ?
+                        ORDER BY page_number
+                    ''', (doc_id,))
+                
+                    results = {}
+                    for page_num, detection_blob, detection_text in cursor.fetchall():
+                        if detection_blob:
+                            results[page_num] = DetectionCodec.decode(detection_blob, detection_text)
+                    return results
+                
+        except Exception as e:
+            logger.error(f"Error getting document detections: {str(e)}")
+            return [] if page_number is not None else {}
+
+    def get_detection_arrays(self, doc_id: int, page_number: int) -> Optional[Dict[str, np.ndarray]]:
+        """Mảng NumPy boxes/confidence/class_id của một trang (không đọc text), None nếu chưa có"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
                 cursor.execute('''
-                    SELECT detection_data
-                    FROM page_detections
+                    SELECT detection_blob FROM page_detections
                     WHERE document_id = ? AND page_number = ?
                 ''', (doc_id, page_number))
-                
                 result = cursor.fetchone()
                 if result and result[0]:
-                    try:
-                        # Set higher recursion limit temporarily
-                        current_limit = sys.getrecursionlimit()
-                        sys.setrecursionlimit(10000)
-                        decoded = json.loads(result[0])
-                        sys.setrecursionlimit(current_limit)
-                        return decoded
-                    except json.JSONDecodeError:
-                        return []
-                return []
-            else:
-                cursor.execute('''
-                    SELECT page_number, detection_data
-                    FROM page_detections
-                    WHERE document_id = ?
-                    ORDER BY page_number
-                ''', (doc_id,))
-                
-                results = {}
-                for page_num, detection_data in cursor.fetchall():
-                    if detection_data:
-                        try:
-                            results[page_num] = json.loads(detection_data)
-                        except json.JSONDecodeError:
-                            results[page_num] = []
-                return results
-                
+                    return DetectionCodec.decode_arrays(result[0])
+                return None
         except Exception as e:
-            print(f"Error getting document detections: {str(e)}")  # Use print instead of logger
-            return [] if page_number is not None else {}
+            logger.error(f"Error getting detection arrays: {str(e)}")
+            return None
+
+    def get_detection_boxes(self, doc_id: int, page_number: int) -> np.ndarray:
+        """Boxes float32 [N, 4] của một trang, dùng trực tiếp cho PDFViewer.set_detection_boxes"""
+        arrays = self.get_detection_arrays(doc_id, page_number)
+        return arrays['boxes'] if arrays else np.zeros((0, 4), dtype=np.float32)
 
     def delete_document(self, doc_id: int, keep_file: bool = False):
         """Delete document and all related data"""
         try:
-            conn = self.conn_pool.get_connection()
-            with conn:
+            # Backup file before deleting (băm/chép file ngoài writer thread, không giữ khóa ghi)
+            with self.conn_pool.connection(readonly=True) as conn:
+                row = conn.execute('SELECT file_path FROM documents WHERE id = ?', (doc_id,)).fetchone()
+            backup_source = row[0] if row else None
+            if backup_source and os.path.exists(backup_source):
+                self.create_backup(doc_id, backup_source, reason="Pre-deletion backup")
+                
+            def write(conn):
                 cursor = conn.cursor()
                 
-                # Backup file path before deleting
+                # Đọc lại đường dẫn trong transaction (có thể đã đổi sau khi sao lưu)
                 cursor.execute('SELECT file_path FROM documents WHERE id = ?', (doc_id,))
                 file_path_result = cursor.fetchone()
                 file_path = file_path_result[0] if file_path_result else None
                 
-                # Create backup if file exists
-                if file_path and os.path.exists(file_path):
-                    self.create_backup(doc_id, file_path, reason="Pre-deletion backup")
-                
                 # Delete related records in correct order
                 # 1. Delete page detections
                 cursor.execute('DELETE FROM page_detections WHERE document_id = ?', (doc_id,))
                 
                 # 2. Delete document tags
                 cursor.execute('DELETE FROM document_tags WHERE document_id = ?', (doc_id,))
+                cursor.execute('DELETE FROM processing_metrics WHERE document_id = ?', (doc_id,))
                 
                 # 3. Delete document versions
+                cursor.execute('DELETE FROM document_current WHERE document_id = ?', (doc_id,))
                 cursor.execute('DELETE FROM document_versions WHERE document_id = ?', (doc_id,))
                 
-                # 4. Delete from document backups
-                cursor.execute('DELETE FROM document_backups WHERE document_id = ?', (doc_id,))
+                # 4. Giữ bản sao lưu (kể cả bản vừa tạo) sau khi xóa văn bản, hết hạn theo retention
+                cursor.execute('UPDATE document_backups SET document_id = NULL WHERE document_id = ?', (doc_id,))
+                cursor.execute('DELETE FROM file_status WHERE document_id = ?', (doc_id,))
                 
                 # 5. Finally delete the document
                 cursor.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+                return file_path
                 
-                # Commit the transaction
-                conn.commit()
-                
-                # Delete file if it exists and not keeping
-                if not keep_file and file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Deleted file: {file_path}")
-                    except Exception as e:
-                        logger.warning(f"Cannot delete file: {file_path}. Error: {str(e)}")
-                        
-                return True
+            file_path = self.writer.execute(write)
+            
+            # Delete file if it exists and not keeping (sau khi đã commit)
+            if not keep_file and file_path and os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                    logger.info(f"Deleted file: {file_path}")
+                except Exception as e:
+                    logger.warning(f"Cannot delete file: {file_path}. Error: {str(e)}")
+                    
+            return True
                 
         except Exception as e:
             logger.error(f"Error deleting document: {str(e)}")
-            if conn:
-                conn.rollback()
             raise
 
     def _parse_vietnamese_date(self, date_string):
@@ -1847,329 +3946,398 @@ class DocumentDatabase:
             except ImportError:
                 raise ImportError("Thư viện 'openpyxl' chưa được cài đặt.")
                     
-            conn = self.conn_pool.get_connection()
-            # Base query với các cột được sắp xếp hợp lý
-            query = '''
-                SELECT 
-                    d.id as "ID",
-                    d.file_name as "Tên File",
-                    d.created_at as "Ngày Tạo",
-                    v.cqbh_tren as "CQBH Trên",
-                    v.cqbh_duoi as "CQBH Dưới",
-                    v.so_ki_hieu as "Số Ký Hiệu",
-                    v.loai_vb as "Loại Văn Bản",
-                    v.nd_chinh as "Nội Dung Chính",
-                    v.ngay_bh as "Ngày Ban Hành",
-                    v.noi_nhan as "Nơi Nhận",
-                    v.chuc_vu as "Chức Vụ",
-                    v.chu_ky as "Chữ Ký",
-                    v.do_khan as "Độ Khẩn"
-                FROM documents d
-                LEFT JOIN document_versions v ON d.id = v.document_id
-                WHERE v.version_number = (
-                    SELECT MAX(version_number)
-                    FROM document_versions
-                    WHERE document_id = d.id
-                )
-            '''
-
-            # Xử lý filter criteria nếu có
-            params = []
-            if filter_criteria:
-                conditions = []
-                for field, value in filter_criteria.items():
-                    if value:
-                        if field == 'id':
-                            conditions.append("d.id = ?")
-                            params.append(value)
-                        elif field == 'file_name':
-                            conditions.append("d.file_name LIKE ?")
-                            params.append(f'%{value}%')
-                        elif field == 'date_from':
-                            conditions.append("d.created_at >= ?")
-                            params.append(value)
-                        elif field == 'date_to':
-                            conditions.append("d.created_at <= ?")
-                            params.append(value)
-                        elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
-                                    'do_khan', 'ngay_bh', 'chuc_vu']:
-                            conditions.append(f"v.{field} LIKE ?")
-                            params.append(f'%{value}%')
-                        elif field == 'nd_chinh':
-                            conditions.append("v.nd_chinh LIKE ?")
-                            params.append(f'%{value}%')
-                
-                if conditions:
-                    query += " AND " + " AND ".join(conditions)
-            
-            query += " ORDER BY d.created_at DESC"
-            
-            # Thực thi query
-            if params:
-                df = pd.read_sql_query(query, conn, params=params)
-            else:
-                df = pd.read_sql_query(query, conn)
-            
-            # Xử lý datetime columns
-            datetime_columns = ['Ngày Tạo', 'Ngày Ban Hành']
-            for col in datetime_columns:
-                if col in df.columns:
-                    # Áp dụng hàm parse cho từng giá trị trong cột
-                    df[col] = df[col].apply(self._parse_vietnamese_date)
-
-            # Export to Excel với formatting tối ưu
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='Documents')
-                
-                workbook = writer.book
-                worksheet = writer.sheets['Documents']
-                
-                # Định nghĩa styles
-                header_style = styles.NamedStyle(name='header_style')
-                header_style.font = styles.Font(bold=True, size=11)
-                header_style.fill = styles.PatternFill(start_color='E0E0E0', end_color='E0E0E0', fill_type='solid')
-                header_style.alignment = styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
-                header_style.border = styles.Border(
-                    left=styles.Side(style='thin'),
-                    right=styles.Side(style='thin'),
-                    top=styles.Side(style='thin'),
-                    bottom=styles.Side(style='thin')
-                )
+            with self.conn_pool.connection(readonly=True) as conn:
+                # Base query với các cột được sắp xếp hợp lý
+                query = '''
+                    SELECT 
+                        d.id as "ID",
+                        d.file_name as "Tên File",
+                        d.created_at as "Ngày Tạo",
+                        v.cqbh_tren as "CQBH Trên",
+                        v.cqbh_duoi as "CQBH Dưới",
+                        v.so_ki_hieu as "Số Ký Hiệu",
+                        v.loai_vb as "Loại Văn Bản",
+                        v.nd_chinh as "Nội Dung Chính",
+                        v.ngay_bh as "Ngày Ban Hành",
+                        v.noi_nhan as "Nơi Nhận",
+                        v.chuc_vu as "Chức Vụ",
+                        v.chu_ky as "Chữ Ký",
+                        v.do_khan as "Độ Khẩn"
+                    FROM documents d
+                    JOIN document_current v ON v.document_id = d.id
+                    WHERE 1 = 1
+                '''
+
+                # Xử lý filter criteria nếu có
+                params = []
+                if filter_criteria:
+                    conditions = []
+                    for field, value in filter_criteria.items():
+                        if value:
+                            if field == 'id':
+                                conditions.append("d.id = ?")
+                                params.append(value)
+                            elif field == 'file_name':
+                                conditions.append("d.file_name LIKE ?")
+                                params.append(f'%{value}%')
+                            elif field == 'date_from':
+                                conditions.append("d.created_at >= ?")
+                                params.append(value)
+                            elif field == 'date_to':
+                                conditions.append("d.created_at <= ?")
+                                params.append(value)
+                            elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
+                                        'do_khan', 'ngay_bh', 'chuc_vu']:
+                                conditions.append(f"v.{field} LIKE ?")
+                                params.append(f'%{value}%')
+                            elif field == 'nd_chinh':
+                                conditions.append("v.nd_chinh LIKE ?")
+                                params.append(f'%{value}%')
+                
+                    if conditions:
+                        query += " AND " + " AND ".join(conditions)
+            
+                query += " ORDER BY d.created_at DESC"
+            
+                # Thực thi query
+                if params:
+                    df = pd.read_sql_query(query, conn, params=params)
+                else:
+                    df = pd.read_sql_query(query, conn)
+            
+                # Xử lý datetime columns
+                datetime_columns = ['Ngày Tạo', 'Ngày Ban Hành']
+                for col in datetime_columns:
+                    if col in df.columns:
+                        # Áp dụng hàm parse cho từng giá trị trong cột
+                        df[col] = df[col].apply(self._parse_vietnamese_date)
+
+                # Export to Excel với formatting tối ưu
+                with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+                    df.to_excel(writer, index=False, sheet_name='Documents')
+                
+                    workbook = writer.book
+                    worksheet = writer.sheets['Documents']
+                
+                    # Định nghĩa styles
+                    header_style = styles.NamedStyle(name='header_style')
+                    header_style.font = styles.Font(bold=True, size=11)
+                    header_style.fill = styles.PatternFill(start_color='E0E0E0', end_color='E0E0E0', fill_type='solid')
+                    header_style.alignment = styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
+                    header_style.border = styles.Border(
+                        left=styles.Side(style='thin'),
+                        right=styles.Side(style='thin'),
+                        top=styles.Side(style='thin'),
+                        bottom=styles.Side(style='thin')
+                    )
 
-                # Style cho dữ liệu
-                data_style = styles.NamedStyle(name='data_style')
-                data_style.font = styles.Font(size=10)
-                data_style.alignment = styles.Alignment(vertical='center', wrap_text=True)
-                data_style.border = styles.Border(
-                    left=styles.Side(style='thin'),
-                    right=styles.Side(style='thin'),
-                    top=styles.Side(style='thin'),
-                    bottom=styles.Side(style='thin')
-                )
+                    # Style cho dữ liệu
+                    data_style = styles.NamedStyle(name='data_style')
+                    data_style.font = styles.Font(size=10)
+                    data_style.alignment = styles.Alignment(vertical='center', wrap_text=True)
+                    data_style.border = styles.Border(
+                        left=styles.Side(style='thin'),
+                        right=styles.Side(style='thin'),
+                        top=styles.Side(style='thin'),
+                        bottom=styles.Side(style='thin')
+                    )
 
-                # Cấu hình độ rộng và style cho từng cột
-                column_widths = {
-                    'ID': 8,
-                    'Tên File': 25,
-                    'Ngày Tạo': 12,
-                    'CQBH Trên': 25,
-                    'CQBH Dưới': 25,
-                    'Số Ký Hiệu': 20,
-                    'Loại Văn Bản': 15,
-                    'Nội Dung Chính': 40,
-                    'Ngày Ban Hành': 15,
-                    'Nơi Nhận': 50,
-                    'Chức Vụ': 20,
-                    'Chữ Ký': 20,
-                    'Độ Khẩn': 12
-                }
+                    # Cấu hình độ rộng và style cho từng cột
+                    column_widths = {
+                        'ID': 8,
+                        'Tên File': 25,
+                        'Ngày Tạo': 12,
+                        'CQBH Trên': 25,
+                        'CQBH Dưới': 25,
+                        'Số Ký Hiệu': 20,
+                        'Loại Văn Bản': 15,
+                        'Nội Dung Chính': 40,
+                        'Ngày Ban Hành': 15,
+                        'Nơi Nhận': 50,
+                        'Chức Vụ': 20,
+                        'Chữ Ký': 20,
+                        'Độ Khẩn': 12
+                    }
 
-                # Áp dụng style và độ rộng cho các cột
-                for idx, column in enumerate(df.columns, 1):
-                    col_letter = get_column_letter(idx)
+                    # Áp dụng style và độ rộng cho các cột
+                    for idx, column in enumerate(df.columns, 1):
+                        col_letter = get_column_letter(idx)
                     
-                    # Áp dụng style cho header
-                    cell = worksheet.cell(row=1, column=idx)
-                    cell.style = header_style
+                        # Áp dụng style cho header
+                        cell = worksheet.cell(row=1, column=idx)
+                        cell.style = header_style
                     
-                    # Set độ rộng cột
-                    width = column_widths.get(column, 15)  # Default width là 15 nếu không được định nghĩa
-                    worksheet.column_dimensions[col_letter].width = width
+                        # Set độ rộng cột
+                        width = column_widths.get(column, 15)  # Default width là 15 nếu không được định nghĩa
+                        worksheet.column_dimensions[col_letter].width = width
                     
-                    # Áp dụng style cho tất cả cells trong cột
-                    for row in range(2, worksheet.max_row + 1):
-                        cell = worksheet.cell(row=row, column=idx)
-                        cell.style = data_style
+                        # Áp dụng style cho tất cả cells trong cột
+                        for row in range(2, worksheet.max_row + 1):
+                            cell = worksheet.cell(row=row, column=idx)
+                            cell.style = data_style
                         
-                        # Căn giữa cho một số cột cụ thể
-                        if column in ['ID', 'Ngày Tạo', 'Ngày Ban Hành', 'Độ Khẩn']:
-                            cell.alignment = styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
+                            # Căn giữa cho một số cột cụ thể
+                            if column in ['ID', 'Ngày Tạo', 'Ngày Ban Hành', 'Độ Khẩn']:
+                                cell.alignment = styles.Alignment(horizontal='center', vertical='center', wrap_text=True)
                         
-                        # Căn trái cho các cột còn lại
-                        else:
-                            cell.alignment = styles.Alignment(horizontal='left', vertical='center', wrap_text=True)
-
-                # Set độ cao cho header
-                worksheet.row_dimensions[1].height = 35
-
-                # Set độ cao cho data rows
-                for row in range(2, worksheet.max_row + 1):
-                    # Tính toán độ cao dựa trên nội dung
-                    max_length = 0
-                    for cell in worksheet[row]:
-                        if cell.value:
-                            lines = str(cell.value).count('\n') + 1
-                            max_length = max(max_length, lines)
+                            # Căn trái cho các cột còn lại
+                            else:
+                                cell.alignment = styles.Alignment(horizontal='left', vertical='center', wrap_text=True)
+
+                    # Set độ cao cho header
+                    worksheet.row_dimensions[1].height = 35
+
+                    # Set độ cao cho data rows
+                    for row in range(2, worksheet.max_row + 1):
+                        # Tính toán độ cao dựa trên nội dung
+                        max_length = 0
+                        for cell in worksheet[row]:
+                            if cell.value:
+                                lines = str(cell.value).count('\n') + 1
+                                max_length = max(max_length, lines)
                     
-                    # Set độ cao tối thiểu 20, và thêm 15 cho mỗi dòng nếu có nhiều dòng
-                    row_height = max(20, min(15 * max_length, 100))  # giới hạn độ cao tối đa là 100
-                    worksheet.row_dimensions[row].height = row_height
+                        # Set độ cao tối thiểu 20, và thêm 15 cho mỗi dòng nếu có nhiều dòng
+                        row_height = max(20, min(15 * max_length, 100))  # giới hạn độ cao tối đa là 100
+                        worksheet.row_dimensions[row].height = row_height
 
-                # Freeze panes
-                worksheet.freeze_panes = 'A2'
+                    # Freeze panes
+                    worksheet.freeze_panes = 'A2'
                 
-                # Auto-filter
-                worksheet.auto_filter.ref = worksheet.dimensions
+                    # Auto-filter
+                    worksheet.auto_filter.ref = worksheet.dimensions
 
-            logger.info(f"Successfully exported data to {output_path}")
-            return True
+                logger.info(f"Successfully exported data to {output_path}")
+                return True
                 
         except Exception as e:
             logger.error(f"Error exporting to Excel: {str(e)}")
             raise
 
+    # Cột sắp xếp được phép (tránh ghép chuỗi tùy ý vào ORDER BY); COALESCE để keyset không gặp NULL
+    DOCUMENT_SORT_COLUMNS = {
+        'id': "d.id",
+        'created_at': "d.created_at",
+        'file_name': "d.file_name",
+        'page_count': "COALESCE(d.page_count, 0)",
+        'version_count': "COALESCE(c.version_count, 0)",
+        'last_modified': "COALESCE(c.modified_at, '')",
+        'so_ki_hieu': "COALESCE(c.so_ki_hieu, '')",
+        'loai_vb': "COALESCE(c.loai_vb, '')",
+        'do_khan': "COALESCE(c.do_khan, '')",
+    }
+
+    DOCUMENT_LIST_SELECT = '''
+        SELECT 
+            d.id, 
+            d.file_path,
+            d.file_name,
+            d.created_at,
+            d.page_count,
+            COALESCE(c.version_count, 0) as version_count,
+            c.cqbh_tren,
+            c.cqbh_duoi,
+            c.so_ki_hieu,
+            c.loai_vb,
+            c.do_khan,
+            c.modified_by,
+            c.modified_at as last_modified
+    '''
+
+    def _build_document_query(self, filter_criteria: Dict = None, sort_by: str = 'created_at',
+                              sort_desc: bool = True) -> Dict[str, Any]:
+        """Dựng phần FROM/WHERE/ORDER dùng chung cho danh sách đầy đủ và phân trang"""
+        ctes = []
+        cte_params = []
+        joins = " FROM documents d LEFT JOIN document_current c ON c.document_id = d.id"
+        conditions = []
+        params = []
+        
+        for field, value in (filter_criteria or {}).items():
+            if not value:
+                continue
+            if field == 'file_name':
+                conditions.append("d.file_name LIKE ?")
+                params.append(f'%{value}%')
+            elif field == 'text' and self.fts_enabled:
+                # Tìm qua chỉ mục FTS5, xếp hạng BM25 (số âm, càng nhỏ càng liên quan)
+                match = self._fts_match_query(value)
+                if not match:
+                    continue
+                # Tập kết quả nhỏ dẫn truy vấn: join từ hits sang documents theo khóa chính
+                ctes.append('''
+                    hits AS (
+                        SELECT document_id, MIN(score) AS score FROM (
+                            SELECT rowid AS document_id, rank AS score
+                            FROM documents_fts WHERE documents_fts MATCH ?
+                            UNION ALL
+                            SELECT p.document_id, 0.5 * f.score
+                            FROM (
+                                SELECT rowid AS page_id, rank AS score
+                                FROM pages_fts WHERE pages_fts MATCH ?
+                            ) f
+                            JOIN page_detections p ON p.id = f.page_id
+                        )
+                        GROUP BY document_id
+                    )''')
+                cte_params.extend([match, match])
+                joins += " JOIN hits h ON h.document_id = d.id"
+            elif field == 'text':
+                conditions.append('''
+                    (
+                        c.cqbh_tren LIKE ? OR
+                        c.cqbh_duoi LIKE ? OR
+                        c.so_ki_hieu LIKE ? OR
+                        c.loai_vb LIKE ? OR
+                        c.nd_chinh LIKE ? OR
+                        c.ngay_bh LIKE ? OR
+                        c.noi_nhan LIKE ? OR 
+                        c.chuc_vu LIKE ? OR
+                        c.chu_ky LIKE ? OR
+                        c.do_khan LIKE ?
+                    )
+                ''')
+                params.extend([f'%{value}%'] * 10)  # One for each field
+            elif field == 'date_from':
+                conditions.append("d.created_at >= ?")
+                params.append(value)
+            elif field == 'date_to':
+                conditions.append("d.created_at <= ?")
+                params.append(value)
+            elif field == 'do_khan':
+                conditions.append("c.do_khan = ?")
+                params.append(value)
+            elif field == 'tag':
+                conditions.append("d.id IN (SELECT document_id FROM document_tags WHERE tag_name = ?)")
+                params.append(value)
+            elif field == 'so_ki_hieu':
+                conditions.append("c.so_ki_hieu LIKE ?")
+                params.append(f'%{value}%')
+            elif field == 'id':
+                conditions.append("d.id = ?")
+                params.append(value)
+        
+        # Sắp xếp theo độ liên quan chỉ có nghĩa khi có điều kiện tìm FTS
+        if sort_by == 'relevance':
+            if ctes:
+                sort_expr, sort_desc = "h.score", False
+            else:
+                sort_expr, sort_desc = self.DOCUMENT_SORT_COLUMNS['created_at'], True
+        else:
+            sort_expr = self.DOCUMENT_SORT_COLUMNS.get(sort_by, self.DOCUMENT_SORT_COLUMNS['created_at'])
+        
+        return {
+            'with': ("WITH " + ",".join(ctes)) if ctes else "",
+            'from': joins,
+            'conditions': conditions,
+            'params': cte_params + params,
+            'sort_expr': sort_expr,
+            'sort_desc': sort_desc,
+        }
+
+    def get_documents_page(self, filter_criteria: Dict = None, sort_by: str = 'created_at',
+                           sort_desc: bool = True, after: Tuple = None, limit: int = 200,
+                           with_total: bool = None) -> Dict[str, Any]:
+        """Lấy một trang văn bản theo keyset (giá trị cột sắp xếp, id)
+        
+        after: cursor trả về từ trang trước (None = trang đầu).
+        Trả về {'rows', 'next_cursor', 'total'}; total chỉ đếm ở trang đầu (hoặc khi with_total=True).
+        """
+        try:
+            parts = self._build_document_query(filter_criteria, sort_by, sort_desc)
+            direction = 'DESC' if parts['sort_desc'] else 'ASC'
+            sort_expr = parts['sort_expr']
+            
+            conditions = list(parts['conditions'])
+            params = list(parts['params'])
+            if after is not None:
+                # So sánh row value (SQLite >= 3.15) để tiếp tục sau dòng cuối của trang trước
+                conditions.append(f"({sort_expr}, d.id) {'<' if parts['sort_desc'] else '>'} (?, ?)")
+                params.extend(after)
+            
+            query = f"{parts['with']} {self.DOCUMENT_LIST_SELECT}, {sort_expr} AS sort_key {parts['from']}"
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            query += f" ORDER BY {sort_expr} {direction}, d.id {direction} LIMIT ?"
+            params.append(limit)
+            
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                fetched = cursor.fetchall()
+            
+                # Bỏ cột sort_key khỏi dòng trả về để giữ nguyên thứ tự cột như get_all_documents
+                rows = [tuple(row)[:-1] for row in fetched]
+                next_cursor = (fetched[-1][-1], fetched[-1][0]) if len(fetched) == limit else None
+            
+                total = None
+                if with_total or (with_total is None and after is None):
+                    count_query = f"{parts['with']} SELECT COUNT(*) {parts['from']}"
+                    if parts['conditions']:
+                        count_query += " WHERE " + " AND ".join(parts['conditions'])
+                    cursor.execute(count_query, parts['params'])
+                    total = cursor.fetchone()[0]
+            
+                return {'rows': rows, 'next_cursor': next_cursor, 'total': total}
+        except Exception as e:
+            logger.error(f"Error fetching document page: {str(e)}")
+            return {'rows': [], 'next_cursor': None, 'total': 0}
+
     def get_all_documents(self, filter_criteria: Dict = None, sort_by: str = 'created_at', sort_desc: bool = True):
         """Get all documents with optional filtering and sorting"""
         try:
-            conn = self.conn_pool.get_connection()
-            query = '''
-                SELECT 
-                    d.id, 
-                    d.file_path,
-                    d.file_name,
-                    d.created_at,
-                    d.page_count,
-                    (SELECT COUNT(v.id) FROM document_versions v WHERE v.document_id = d.id) as version_count,
-                    (SELECT cqbh_tren FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as cqbh_tren,
-                    (SELECT cqbh_duoi FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as cqbh_duoi,
-                    (SELECT so_ki_hieu FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as so_ki_hieu,
-                    (SELECT loai_vb FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as loai_vb,
-                    (SELECT do_khan FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as do_khan,
-                    (SELECT modified_by FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as modified_by,
-                    (SELECT created_at FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as last_modified
-                FROM documents d
-            '''
-            
-            # Add filter conditions if provided
-            params = []
-            if filter_criteria:
-                conditions = []
-                for field, value in filter_criteria.items():
-                    if value:
-                        if field == 'file_name':
-                            conditions.append(f"d.file_name LIKE ?")
-                            params.append(f'%{value}%')
-                        elif field == 'text':
-                            text_condition = '''
-                                EXISTS (
-                                    SELECT 1 FROM document_versions v 
-                                    WHERE v.document_id = d.id 
-                                    AND (
-                                        v.cqbh_tren LIKE ? OR
-                                        v.cqbh_duoi LIKE ? OR
-                                        v.so_ki_hieu LIKE ? OR
-                                        v.loai_vb LIKE ? OR
-                                        v.nd_chinh LIKE ? OR
-                                        v.ngay_bh LIKE ? OR
-                                        v.noi_nhan LIKE ? OR 
-                                        v.chuc_vu LIKE ? OR
-                                        v.chu_ky LIKE ? OR
-                                        v.do_khan LIKE ?
-                                    )
-                                )
-                            '''
-                            conditions.append(text_condition)
-                            params.extend([f'%{value}%'] * 10)  # One for each field
-                        elif field == 'date_from':
-                            conditions.append(f"d.created_at >= ?")
-                            params.append(value)
-                        elif field == 'date_to':
-                            conditions.append(f"d.created_at <= ?")
-                            params.append(value)
-                        elif field == 'do_khan':
-                            conditions.append('''
-                                EXISTS (
-                                    SELECT 1 FROM document_versions v
-                                    WHERE v.document_id = d.id
-                                    AND v.version_number = (
-                                        SELECT MAX(version_number) FROM document_versions
-                                        WHERE document_id = d.id
-                                    )
-                                    AND v.do_khan = ?
-                                )
-                            ''')
-                            params.append(value)
-                
-                if conditions:
-                    query += " WHERE " + " AND ".join(conditions)
-            
-            # Add sorting
-            sort_column = sort_by
-            if sort_by == 'so_ki_hieu':
-                sort_column = "(SELECT so_ki_hieu FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1)"
-            elif sort_by == 'do_khan':
-                sort_column = "(SELECT do_khan FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1)"
-                
-            query += f" ORDER BY {sort_column} {'DESC' if sort_desc else 'ASC'}"
-            
-            # Execute query
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-                
-            return cursor.fetchall()
+            parts = self._build_document_query(filter_criteria, sort_by, sort_desc)
+            direction = 'DESC' if parts['sort_desc'] else 'ASC'
+            query = f"{parts['with']} {self.DOCUMENT_LIST_SELECT} {parts['from']}"
+            if parts['conditions']:
+                query += " WHERE " + " AND ".join(parts['conditions'])
+            query += f" ORDER BY {parts['sort_expr']} {direction}, d.id {direction}"
+            
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, parts['params'])
+                return cursor.fetchall()
                 
         except Exception as e:
             logger.error(f"Error fetching documents: {str(e)}")
             return []
 
     def get_document_version(self, doc_id, version_number):
-        """Get a specific version of a document"""
+        """Get a specific version of a document (dựng lại từ snapshot gần nhất và các delta)"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM document_versions
-                WHERE document_id = ? AND version_number = ?
-            ''', (doc_id, version_number))
-            return cursor.fetchone()
+            with self.conn_pool.connection(readonly=True) as conn:
+                versions = self._read_versions(conn.cursor(), doc_id, version_number)
+                if versions and versions[-1][2] == version_number:
+                    return versions[-1]
+                return None
         except Exception as e:
             logger.error(f"Error getting document version: {str(e)}")
             return None
 
     def get_latest_version(self, doc_id):
-        """Get the most recent version of a document"""
+        """Get the most recent version of a document (đọc từ document_current)"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM document_versions
-                WHERE document_id = ?
-                ORDER BY version_number DESC
-                LIMIT 1
-            ''', (doc_id,))
-            return cursor.fetchone()
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT version_id, document_id, version_number, {', '.join(self.VERSION_ROW_COLUMNS[3:13])},
+                           modified_by, modified_at, do_mat
+                    FROM document_current
+                    WHERE document_id = ? AND version_id IS NOT NULL
+                ''', (doc_id,))
+                row = cursor.fetchone()
+                if row:
+                    return tuple(row)
+                versions = self._read_versions(cursor, doc_id)
+                return versions[-1] if versions else None
         except Exception as e:
             logger.error(f"Error getting latest version: {str(e)}")
             return None
         
     def get_document_versions(self, doc_id):
-        """Get all versions of a document"""
+        """Get all versions of a document (mới nhất trước)"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM document_versions
-                WHERE document_id = ?
-                ORDER BY version_number DESC
-            ''', (doc_id,))
-            return cursor.fetchall()
+            with self.conn_pool.connection(readonly=True) as conn:
+                return self._read_versions(conn.cursor(), doc_id)[::-1]
         except Exception as e:
             logger.error(f"Error getting document versions: {str(e)}")
             return []
@@ -2177,13 +4345,13 @@ class DocumentDatabase:
     def get_document_info(self, doc_id):
         """Get basic document information"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM documents
-                WHERE id = ?
-            ''', (doc_id,))
-            return cursor.fetchone()
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM documents
+                    WHERE id = ?
+                ''', (doc_id,))
+                return cursor.fetchone()
         except Exception as e:
             logger.error(f"Error getting document info: {str(e)}")
             return None
@@ -2191,49 +4359,57 @@ class DocumentDatabase:
     def create_new_version(self, doc_id: int, updates: Dict[str, str], modified_by: str = "User"):
         """Create a new version of a document"""
         try:
-            # Đầu tiên kiểm tra xem document có tồn tại không
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM documents WHERE id = ?', (doc_id,))
-            if not cursor.fetchone():
-                raise ValueError(f"Document with ID {doc_id} does not exist")
+            def write(conn):
+                # Đầu tiên kiểm tra xem document có tồn tại không
+                cursor = conn.cursor()
+                cursor.execute('SELECT id FROM documents WHERE id = ?', (doc_id,))
+                if not cursor.fetchone():
+                    raise ValueError(f"Document with ID {doc_id} does not exist")
 
-            with conn:
-                # Get current version number
+                # Get current version number và snapshot gần nhất
                 cursor.execute('''
-                    SELECT MAX(version_number)
+                    SELECT MAX(version_number), MAX(CASE WHEN changed_mask IS NULL THEN version_number END)
                     FROM document_versions
                     WHERE document_id = ?
                 ''', (doc_id,))
                 
-                current_version = cursor.fetchone()[0] or 0
-                new_version = current_version + 1
-
-                # Chuẩn bị dữ liệu cho version mới
-                version_data = (
-                    doc_id,
-                    new_version,
-                    updates.get('cqbh_tren', ''),
-                    updates.get('cqbh_duoi', ''),
-                    updates.get('so_ki_hieu', ''),
-                    updates.get('loai_vb', ''),
-                    updates.get('nd_chinh', ''),
-                    updates.get('ngay_bh', ''),
-                    updates.get('noi_nhan', ''),
-                    updates.get('chuc_vu', ''),
-                    updates.get('chu_ky', ''),
-                    updates.get('do_khan', 'Không'),
-                    modified_by
-                )
+                current_version, snapshot_version = cursor.fetchone()
+                new_version = (current_version or 0) + 1
+                
+                # Giá trị hiện tại (đầy đủ) để chỉ lưu các trường thay đổi
+                cursor.execute(f'''
+                    SELECT {', '.join(self.VERSION_DELTA_FIELDS)} FROM document_current
+                    WHERE document_id = ? AND version_number = ?
+                ''', (doc_id, current_version))
+                previous = cursor.fetchone()
+                previous = dict(zip(self.VERSION_DELTA_FIELDS, previous)) if previous else None
+
+                # Chuẩn bị dữ liệu cho version mới (độ mật giữ nguyên nếu không được sửa)
+                values = {field: updates.get(field, '') for field in self.VERSION_DELTA_FIELDS}
+                values['do_khan'] = updates.get('do_khan', 'Không')
+                values['do_mat'] = updates.get('do_mat', previous['do_mat'] if previous else None)
+                
+                changed_mask = None
+                if (previous is not None and snapshot_version is not None
+                        and new_version - snapshot_version < self.version_snapshot_interval):
+                    changed_mask = sum(1 << i for i, field in enumerate(self.VERSION_DELTA_FIELDS)
+                                       if values[field] != previous[field])
+                    if changed_mask == (1 << len(self.VERSION_DELTA_FIELDS)) - 1:
+                        changed_mask = None  # Đổi mọi trường: lưu luôn snapshot
+                if changed_mask is not None:
+                    values = {field: values[field] if changed_mask & (1 << i) else None
+                              for i, field in enumerate(self.VERSION_DELTA_FIELDS)}
+                    
+                version_data = ((doc_id, new_version) + tuple(values[field] for field in self.VERSION_DELTA_FIELDS)
+                                + (modified_by, changed_mask))
                 
                 # Insert new version with error handling
                 try:
-                    cursor.execute('''
+                    cursor.execute(f'''
                         INSERT INTO document_versions (
-                            document_id, version_number, cqbh_tren, cqbh_duoi,
-                            so_ki_hieu, loai_vb, nd_chinh, ngay_bh,
-                            noi_nhan, chuc_vu, chu_ky, do_khan, modified_by
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                            document_id, version_number, {', '.join(self.VERSION_DELTA_FIELDS)},
+                            modified_by, changed_mask
+                        ) VALUES (?, ?, {', '.join('?' * len(self.VERSION_DELTA_FIELDS))}, ?, ?)
                     ''', version_data)
 
                     # Update last_modified in documents table
@@ -2242,72 +4418,218 @@ class DocumentDatabase:
                         SET last_modified = CURRENT_TIMESTAMP
                         WHERE id = ?
                     ''', (doc_id,))
-
-                    conn.commit()
-                    
-                    # Add suggestions for fields
-                    for field in ['so_ki_hieu', 'loai_vb', 'chuc_vu', 'cqbh_tren', 'cqbh_duoi', 'do_khan']:
-                        if field in updates and updates[field].strip():
-                            self.add_suggestion(field, updates[field].strip())
                     
+                    self._refresh_document_current(cursor, doc_id)
                     return new_version
 
                 except sqlite3.IntegrityError as e:
-                    conn.rollback()
                     logger.error(f"Database integrity error: {str(e)}")
                     raise
-                except Exception as e:
-                    conn.rollback()
-                    logger.error(f"Error creating new version: {str(e)}")
-                    raise
+                    
+            new_version = self.writer.execute(write)
+            
+            # Add suggestions for fields
+            for field in ['so_ki_hieu', 'loai_vb', 'chuc_vu', 'cqbh_tren', 'cqbh_duoi', 'do_khan']:
+                if field in updates and updates[field].strip():
+                    self.add_suggestion(field, updates[field].strip())
+            
+            self._notify_document_changed(doc_id, new_version)
+            return new_version
                     
         except Exception as e:
             logger.error(f"Error creating new version: {str(e)}")
             raise
 
-    def search_documents(self, query: str, search_type: str = "all"):
-        """Search documents based on query and search type"""
+    def add_change_listener(self, callback):
+        """Đăng ký callback(doc_id, version_number) khi văn bản có phiên bản mới"""
+        if callback not in self.change_listeners:
+            self.change_listeners.append(callback)
+
+    def remove_change_listener(self, callback):
+        if callback in self.change_listeners:
+            self.change_listeners.remove(callback)
+
+    def _notify_document_changed(self, doc_id: int, version_number: int):
+        """Gọi các listener sau khi transaction đã commit; lỗi listener không ảnh hưởng việc lưu"""
+        for callback in list(self.change_listeners):
+            try:
+                callback(doc_id, version_number)
+            except Exception as e:
+                logger.error(f"Error in document change listener: {str(e)}")
+
+    @staticmethod
+    def search_filter_criteria(query: str, search_type: str = "all") -> Tuple[Dict, str]:
+        """Chuyển từ khóa + loại tìm kiếm thành (filter_criteria, sort_by)"""
         if not query:
-            return self.get_all_documents()
-            
-        filter_criteria = {}
+            return {}, 'created_at'
         if search_type == "file_name":
-            filter_criteria['file_name'] = query
-        elif search_type == "content":
-            filter_criteria['text'] = query
-        elif search_type == "so_ki_hieu":
-            filter_criteria['text'] = query  # We'll filter in memory
-        elif search_type == "do_khan":
-            filter_criteria['do_khan'] = query
-        else:  # "all"
-            filter_criteria['text'] = query
-            
-        documents = self.get_all_documents(filter_criteria)
-        
-        # Additional filtering for so_ki_hieu if needed
+            return {'file_name': query}, 'created_at'
         if search_type == "so_ki_hieu":
-            documents = [doc for doc in documents if query.lower() in (doc[8] or '').lower()]
-            
-        return documents
-        
-    def verify_file_paths(self):
-        """Check and identify missing file paths"""
+            return {'so_ki_hieu': query}, 'created_at'
+        if search_type == "do_khan":
+            return {'do_khan': query}, 'created_at'
+        # "content" / "all": xếp hạng BM25
+        return {'text': query}, 'relevance'
+
+    def search_documents(self, query: str, search_type: str = "all"):
+        """Search documents based on query and search type"""
+        filter_criteria, sort_by = self.search_filter_criteria(query, search_type)
+        return self.get_all_documents(filter_criteria, sort_by=sort_by)
+
+    @staticmethod
+    def _fold_for_snippet(text: str) -> str:
+        """Gộp dấu/hoa thường từng ký tự (giữ nguyên độ dài để vị trí khớp với text gốc)"""
+        return ''.join(
+            'd' if c in 'đĐ' else (unicodedata.normalize('NFD', c)[0].lower()[:1] or c)
+            for c in text
+        )
+
+    @classmethod
+    def _page_snippet(cls, text: str, query: str, size: int = 12) -> str:
+        """Đoạn trích size từ quanh lần khớp đầu tiên, từ khớp đặt trong [ ] (giống snippet() của FTS5)"""
+        text = text or ''
+        words = list(re.finditer(r'\w+', cls._fold_for_snippet(text)))
+        if not words:
+            return ''
+        terms = re.findall(r'\w+', cls._fold_for_snippet(query or ''))
+        
+        def matches(word):
+            return any(word == term or (i == len(terms) - 1 and word.startswith(term))
+                       for i, term in enumerate(terms))
+        
+        hits = [i for i, m in enumerate(words) if matches(m.group())]
+        start = max(0, min(hits[0] - size // 4, len(words) - size)) if hits else 0
+        end = min(len(words), start + size)
+        hit_set = set(hits)
+        
+        parts = []
+        pos = words[start].start()
+        for i in range(start, end):
+            m = words[i]
+            parts.append(text[pos:m.start()])
+            word = text[m.start():m.end()]
+            parts.append(f'[{word}]' if i in hit_set else word)
+            pos = m.end()
+        return ('...' if start > 0 else '') + ''.join(parts) + ('...' if end < len(words) else '')
+
+    def get_document_row(self, doc_id: int):
+        """Một dòng danh sách (cùng cột với get_all_documents) của văn bản, None nếu không còn"""
+        rows = self.get_all_documents({'id': doc_id})
+        return rows[0] if rows else None
+        
+    def search_page_text(self, query: str, limit: int = 100) -> List[Tuple[int, int, str]]:
+        """Tìm trong nội dung toàn trang, trả về [(document_id, page_number, snippet)]"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, file_path FROM documents')
-            documents = cursor.fetchall()
-            
-            missing_files = []
-            for doc_id, file_path in documents:
-                if not os.path.exists(file_path):
-                    missing_files.append((doc_id, file_path))
-                    
-            return missing_files
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                if self.fts_enabled:
+                    match = self._fts_match_query(query)
+                    if not match:
+                        return []
+                    cursor.execute('''
+                        SELECT p.document_id, p.page_number, p.page_text
+                        FROM pages_fts
+                        JOIN page_detections p ON p.id = pages_fts.rowid
+                        WHERE pages_fts MATCH ?
+                        ORDER BY rank
+                        LIMIT ?
+                    ''', (match, limit))
+                    return [(doc_id, page_number, self._page_snippet(page_text, query))
+                            for doc_id, page_number, page_text in cursor.fetchall()]
+                else:
+                    cursor.execute('''
+                        SELECT document_id, page_number, substr(page_text, 1, 200)
+                        FROM page_detections
+                        WHERE page_text LIKE ?
+                        LIMIT ?
+                    ''', (f'%{query}%', limit))
+                return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"Error searching page text: {str(e)}")
+            return []
+
+    FILE_STATUS_UPSERT_SQL = '''
+        INSERT INTO file_status (document_id, file_path, file_size, file_mtime, file_exists, last_verified)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(document_id) DO UPDATE SET
+            file_path = excluded.file_path,
+            file_size = excluded.file_size,
+            file_mtime = excluded.file_mtime,
+            file_exists = excluded.file_exists,
+            last_verified = excluded.last_verified
+    '''
+
+    def verify_file_paths(self, max_age: float = FILE_VERIFY_MAX_AGE, progress_callback=None,
+                          workers: int = FILE_VERIFY_WORKERS):
+        """Check and identify missing file paths
+        
+        Chỉ stat lại văn bản chưa có trong file_status, đã đổi đường dẫn, đang thiếu file hoặc
+        kiểm tra cách đây quá max_age giây. Stat chạy song song, kết quả ghi theo lô
+        FILE_VERIFY_BATCH; progress_callback(done, total) trả về False để dừng giữa chừng.
+        Trả về [(doc_id, file_path)] các file không tồn tại.
+        """
+        try:
+            stale = self.get_stale_file_checks(max_age)
+            if stale:
+                with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                    for i in range(0, len(stale), FILE_VERIFY_BATCH):
+                        rows = list(executor.map(self._stat_file, stale[i:i + FILE_VERIFY_BATCH]))
+                        self.writer.execute(lambda conn: conn.executemany(self.FILE_STATUS_UPSERT_SQL, rows))
+                        done = min(i + FILE_VERIFY_BATCH, len(stale))
+                        if progress_callback and progress_callback(done, len(stale)) is False:
+                            break
+            return self.get_missing_files()
         except Exception as e:
             logger.error(f"Error verifying file paths: {str(e)}")
             return []
 
+    @staticmethod
+    def _stat_file(entry: Tuple[int, str]) -> Tuple:
+        """Một dòng file_status cho (doc_id, file_path); lỗi truy cập coi như file thiếu"""
+        doc_id, file_path = entry
+        try:
+            info = os.stat(file_path)
+            return (doc_id, file_path, info.st_size, info.st_mtime, 1, time.time())
+        except (OSError, ValueError):
+            return (doc_id, file_path, None, None, 0, time.time())
+
+    def get_stale_file_checks(self, max_age: float = FILE_VERIFY_MAX_AGE) -> List[Tuple[int, str]]:
+        """Văn bản cần stat lại file (chưa kiểm tra, đổi đường dẫn, đang thiếu, hoặc quá cũ)"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT d.id, d.file_path
+                    FROM documents d
+                    LEFT JOIN file_status f ON f.document_id = d.id
+                    WHERE f.document_id IS NULL
+                       OR f.file_path != d.file_path
+                       OR f.file_exists = 0
+                       OR f.last_verified < ?
+                    ORDER BY d.id
+                ''', (time.time() - max_age,))
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting stale file checks: {str(e)}")
+            return []
+
+    def get_missing_files(self) -> List[Tuple[int, str]]:
+        """Các văn bản có file không tồn tại theo lần kiểm tra gần nhất"""
+        try:
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT d.id, d.file_path
+                    FROM documents d
+                    JOIN file_status f ON f.document_id = d.id AND f.file_path = d.file_path
+                    WHERE f.file_exists = 0
+                    ORDER BY d.id
+                ''')
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting missing files: {str(e)}")
+            return []
+
     def update_file_path(self, doc_id: int, new_path: str):
         """Update file path for a document"""
         try:
@@ -2315,8 +4637,9 @@ class DocumentDatabase:
                 raise FileNotFoundError(f"New file path does not exist: {new_path}")
                 
             # Calculate new hash and size
-            file_hash = self._calculate_file_hash(new_path)
-            file_size = os.path.getsize(new_path)
+            quick_hash, file_hash, file_size = self.file_fingerprints([new_path]).get(new_path, (None, "", None))
+            if file_size is None:
+                file_size = os.path.getsize(new_path)
             
             # Update page count if PDF
             page_count = None
@@ -2327,21 +4650,27 @@ class DocumentDatabase:
                 except:
                     pass
                     
-            conn = self.conn_pool.get_connection()
-            with conn:
+            status = self._stat_file((doc_id, new_path))
+            
+            def write(conn):
                 cursor = conn.cursor()
                 if page_count is not None:
                     cursor.execute(
-                        'UPDATE documents SET file_path = ?, file_hash = ?, file_size = ?, page_count = ? WHERE id = ?',
-                        (new_path, file_hash, file_size, page_count, doc_id)
+                        'UPDATE documents SET file_path = ?, file_hash = ?, quick_hash = ?, file_size = ?, page_count = ? '
+                        'WHERE id = ?',
+                        (new_path, file_hash, quick_hash, file_size, page_count, doc_id)
                     )
                 else:
                     cursor.execute(
-                        'UPDATE documents SET file_path = ?, file_hash = ?, file_size = ? WHERE id = ?',
-                        (new_path, file_hash, file_size, doc_id)
+                        'UPDATE documents SET file_path = ?, file_hash = ?, quick_hash = ?, file_size = ? WHERE id = ?',
+                        (new_path, file_hash, quick_hash, file_size, doc_id)
                     )
+                updated = cursor.rowcount > 0
+                if updated:
+                    cursor.execute(self.FILE_STATUS_UPSERT_SQL, status)
+                return updated
                 
-                return cursor.rowcount > 0
+            return self.writer.execute(write)
         except Exception as e:
             logger.error(f"Error updating file path: {str(e)}")
             raise
@@ -2349,14 +4678,10 @@ class DocumentDatabase:
     def add_tag(self, doc_id: int, tag_name: str):
         """Add a tag to a document"""
         try:
-            conn = self.conn_pool.get_connection()
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'INSERT OR IGNORE INTO document_tags (document_id, tag_name) VALUES (?, ?)',
-                    (doc_id, tag_name)
-                )
-                return cursor.rowcount > 0
+            return self.writer.execute(lambda conn: conn.execute(
+                'INSERT OR IGNORE INTO document_tags (document_id, tag_name) VALUES (?, ?)',
+                (doc_id, tag_name)
+            ).rowcount > 0)
         except Exception as e:
             logger.error(f"Error adding tag: {str(e)}")
             return False
@@ -2364,14 +4689,10 @@ class DocumentDatabase:
     def remove_tag(self, doc_id: int, tag_name: str):
         """Remove a tag from a document"""
         try:
-            conn = self.conn_pool.get_connection()
-            with conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    'DELETE FROM document_tags WHERE document_id = ? AND tag_name = ?',
-                    (doc_id, tag_name)
-                )
-                return cursor.rowcount > 0
+            return self.writer.execute(lambda conn: conn.execute(
+                'DELETE FROM document_tags WHERE document_id = ? AND tag_name = ?',
+                (doc_id, tag_name)
+            ).rowcount > 0)
         except Exception as e:
             logger.error(f"Error removing tag: {str(e)}")
             return False
@@ -2379,13 +4700,13 @@ class DocumentDatabase:
     def get_document_tags(self, doc_id: int):
         """Get all tags for a document"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT tag_name FROM document_tags WHERE document_id = ? ORDER BY tag_name',
-                (doc_id,)
-            )
-            return [row[0] for row in cursor.fetchall()]
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT tag_name FROM document_tags WHERE document_id = ? ORDER BY tag_name',
+                    (doc_id,)
+                )
+                return [row[0] for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error getting document tags: {str(e)}")
             return []
@@ -2393,74 +4714,51 @@ class DocumentDatabase:
     def get_all_tags(self):
         """Get all unique tags in the system"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT DISTINCT tag_name FROM document_tags ORDER BY tag_name'
-            )
-            return [row[0] for row in cursor.fetchall()]
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT DISTINCT tag_name FROM document_tags ORDER BY tag_name'
+                )
+                return [row[0] for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error getting all tags: {str(e)}")
             return []
 
     def get_documents_by_tag(self, tag_name: str):
         """Get all documents with a specific tag"""
+        return self.get_all_documents({'tag': tag_name})
+            
+    def set_page_count(self, doc_id: int, page_count: int):
+        """Cập nhật số trang khi đọc được từ file PDF"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            query = '''
-                SELECT 
-                    d.id, 
-                    d.file_path,
-                    d.file_name,
-                    d.created_at,
-                    d.page_count,
-                    (SELECT COUNT(v.id) FROM document_versions v WHERE v.document_id = d.id) as version_count,
-                    (SELECT cqbh_tren FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as cqbh_tren,
-                    (SELECT cqbh_duoi FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as cqbh_duoi,
-                    (SELECT so_ki_hieu FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as so_ki_hieu,
-                    (SELECT loai_vb FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as loai_vb,
-                    (SELECT do_khan FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as do_khan,
-                    (SELECT modified_by FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as modified_by,
-                    (SELECT created_at FROM document_versions 
-                     WHERE document_id = d.id 
-                     ORDER BY version_number DESC LIMIT 1) as last_modified
-                FROM documents d
-                JOIN document_tags t ON d.id = t.document_id
-                WHERE t.tag_name = ?
-                ORDER BY d.created_at DESC
-            '''
-            cursor.execute(query, (tag_name,))
-            return cursor.fetchall()
+            future = self.writer.submit(
+                lambda conn: conn.execute('UPDATE documents SET page_count = ? WHERE id = ?', (page_count, doc_id))
+            )
+            future.add_done_callback(lambda f: self._log_write_error(f, "Error updating page count"))
         except Exception as e:
-            logger.error(f"Error getting documents by tag: {str(e)}")
-            return []
-            
+            logger.error(f"Error updating page count: {str(e)}")
+
     def get_document_count(self):
         """Get total number of documents"""
         try:
-            conn = self.conn_pool.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM documents')
-            return cursor.fetchone()[0]
+            with self.conn_pool.connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM documents')
+                return cursor.fetchone()[0]
         except Exception as e:
             logger.error(f"Error getting document count: {str(e)}")
             return 0
             
+    @staticmethod
+    def _log_write_error(future, message):
+        """Done-callback cho lệnh ghi không chờ kết quả"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"{message}: {str(future.exception())}")
+            
     def close(self):
-        """Close all database connections"""
+        """Ghi nốt hàng đợi ghi rồi đóng mọi kết nối (gọi lại lệnh ghi sau đó sẽ mở lại writer)"""
+        self.flush_suggestions()
+        self.writer.stop()
         self.conn_pool.close_all()
 
 # #############################
@@ -2646,6 +4944,60 @@ class DocumentDatabase:
 #         except Exception as e:
 #             QMessageBox.critical(self, "Lỗi", f"Lỗi khi xuất báo cáo: {str(e)}")
 
+#############################
+#   Processing Metrics      #
+#############################
+class SpanRecorder:
+    """Lightweight recorder for per-stage processing timings"""
+
+    def __init__(self, page_number=None):
+        # Mỗi span: (stage, page_number, duration_ms)
+        self.page_number = page_number
+        self.spans = []
+
+    def span(self, stage, page_number=None):
+        """Context manager đo thời gian một giai đoạn"""
+        return _Span(self, stage, self.page_number if page_number is None else page_number)
+
+    def record(self, stage, duration_ms, page_number=None):
+        """Ghi nhận thời gian (ms) của một giai đoạn"""
+        if page_number is None:
+            page_number = self.page_number
+        self.spans.append((stage, page_number, float(duration_ms)))
+
+    def record_since(self, stage, start_time, page_number=None):
+        """Ghi nhận thời gian tính từ mốc time.perf_counter()"""
+        self.record(stage, (time.perf_counter() - start_time) * 1000.0, page_number)
+
+    def extend(self, spans):
+        """Gộp các span nhận từ worker process"""
+        self.spans.extend(spans or [])
+
+    def totals(self):
+        """Tổng thời gian theo (stage, page_number)"""
+        totals = {}
+        for stage, page_number, duration_ms in self.spans:
+            key = (stage, page_number)
+            totals[key] = totals.get(key, 0.0) + duration_ms
+        return totals
+
+class _Span:
+    """Span đơn lẻ dùng với câu lệnh with"""
+
+    def __init__(self, recorder, stage, page_number):
+        self.recorder = recorder
+        self.stage = stage
+        self.page_number = page_number
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.recorder.record_since(self.stage, self.start, self.page_number)
+        return False
+
 #############################
 #    Document OCR Class     #
 #############################
@@ -2660,6 +5012,7 @@ class DocumentOCR:
         
         # Khởi tạo EasyOCR reader (sẽ được khởi tạo lại trong mỗi worker process)
         self.ocr_reader = None
+        self.reader_lock = threading.Lock()
         
         # Thư mục lưu ảnh
         self.image_save_dir = Path(OUTPUT_DIR) / 'ocr_images'
@@ -2766,35 +5119,162 @@ class DocumentOCR:
                 # Ngưỡng hóa Otsu
                 _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         else:
-            # Tiền xử lý mặc định khi không biết loại văn bản
-            # Loại bỏ nhiễu nhẹ
-            gray = cv2.GaussianBlur(gray, (3, 3), 0)
-            # Cải thiện độ tương phản
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-            gray = clahe.apply(gray)
-            # Ngưỡng hóa Otsu
-            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-        
-        # Thêm biên trắng xung quanh (giúp cải thiện OCR)
-        binary = cv2.copyMakeBorder(binary, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+            # Tiền xử lý mặc định khi không biết loại văn bản
+            # Loại bỏ nhiễu nhẹ
+            gray = cv2.GaussianBlur(gray, (3, 3), 0)
+            # Cải thiện độ tương phản
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+            gray = clahe.apply(gray)
+            # Ngưỡng hóa Otsu
+            _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        
+        # Thêm biên trắng xung quanh (giúp cải thiện OCR)
+        binary = cv2.copyMakeBorder(binary, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+        
+        return binary
+
+    # EasyOCR reader theo bộ ngôn ngữ và YOLO model, dùng lại trong cùng một process
+    _readers = {}
+    _models = {}
+
+    @staticmethod
+    def _get_cached_model(model_path):
+        """Lấy YOLO model đã nạp (mỗi process một lần)"""
+        if model_path not in DocumentOCR._models:
+            DocumentOCR._models[model_path] = YOLO(model_path)
+        return DocumentOCR._models[model_path]
+
+    @staticmethod
+    def _get_cached_reader(languages):
+        """Lấy EasyOCR reader đã khởi tạo cho bộ ngôn ngữ (mỗi process một lần)"""
+        key = tuple(languages)
+        if key not in DocumentOCR._readers:
+            DocumentOCR._readers[key] = easyocr.Reader(list(languages), gpu=False, verbose=False)
+        return DocumentOCR._readers[key]
+
+    @staticmethod
+    def _weighted_confidence(parts):
+        """Độ tin cậy trung bình có trọng số theo độ dài text [(text, conf), ...]"""
+        total_chars = sum(len(text) for text, _ in parts)
+        if not total_chars:
+            return 0.0
+        return sum(len(text) * conf for text, conf in parts) / total_chars
+
+    @staticmethod
+    def _group_lines(results, line_height=20):
+        """Nhóm kết quả EasyOCR theo dòng (trên xuống dưới, trái sang phải)"""
+        # Sắp xếp kết quả theo tọa độ y (từ trên xuống dưới)
+        sorted_results = sorted(results, key=lambda x: (x[0][0][1] + x[0][2][1])/2)
+        
+        lines = []
+        current_line = []
+        
+        for detection in sorted_results:
+            if not current_line:
+                current_line.append(detection)
+            else:
+                y_current = (detection[0][0][1] + detection[0][2][1])/2
+                y_prev = (current_line[-1][0][0][1] + current_line[-1][0][2][1])/2
+                
+                if abs(y_current - y_prev) < line_height:
+                    current_line.append(detection)
+                else:
+                    # Sắp xếp từ trái sang phải trong một dòng
+                    current_line = sorted(current_line, key=lambda x: x[0][0][0])
+                    lines.append(current_line)
+                    current_line = [detection]
+        
+        if current_line:
+            current_line = sorted(current_line, key=lambda x: x[0][0][0])
+            lines.append(current_line)
+        
+        return lines
+
+    @staticmethod
+    def _format_region_text(line_texts, class_id=None):
+        """Định dạng text theo loại vùng từ danh sách các dòng"""
+        if class_id == 7:  # Noi_Nhan
+            # Tạo văn bản theo định dạng Nơi nhận
+            text = "\n".join(line_texts)
+            
+            # Định dạng lại để dễ đọc
+            if text and not text.startswith("Nơi nhận:") and not text.startswith("Nơi nhận") and not text.startswith("-"):
+                text = "Nơi nhận:\n" + text
+                
+            # Thêm dấu gạch đầu dòng nếu cần
+            lines = text.split('\n')
+            formatted_lines = []
+            for i, line in enumerate(lines):
+                if i == 0 and (line.startswith("Nơi nhận:") or line.startswith("Nơi nhận")):
+                    formatted_lines.append(line)
+                elif not line.strip().startswith("-") and not line.strip().startswith("•") and i > 0 and line.strip():
+                    formatted_lines.append("- " + line.strip())
+                else:
+                    formatted_lines.append(line)
+            
+            text = "\n".join(formatted_lines)
+        elif class_id == 6:  # Ngày BH
+            # Ghép tất cả các phát hiện thành một dòng
+            text = " ".join(line_texts)
+            
+            # Chuẩn hóa dấu ngày tháng
+            text = text.replace('/', '-').replace('.', '-')
+            # Sửa các số hay nhận nhầm
+            text = text.replace('l', '1').replace('O', '0').replace('o', '0')
+            
+            # Định dạng lại ngày tháng nếu có thể
+            date_pattern = r'(\d{1,2})[-./](\d{1,2})[-./](\d{2,4})'
+            match = re.search(date_pattern, text)
+            if match:
+                day, month, year = match.groups()
+                # Đảm bảo định dạng DD-MM-YYYY
+                if len(year) == 2:
+                    year = '20' + year  # Giả sử năm hiện tại là thế kỷ 21
+                text = f"ngày {day} tháng {month} năm {year}"
+        elif class_id == 8:  # Số ký hiệu
+            # Ghép tất cả các phát hiện từ các dòng
+            text = " ".join(line_texts)
+            
+            # Chuẩn hóa dấu gạch ngang
+            text = text.replace('—', '-').replace('–', '-').replace('_', '-')
+            # Loại bỏ các ký tự không cần thiết và giữ lại những ký tự quan trọng
+            text = ''.join(c for c in text if c.isalnum() or c in "/-_.,: ")
+            # Sửa các số hay nhận nhầm
+            text = text.replace('l', '1').replace('O', '0').replace('o', '0')
+        else:
+            # ND_Chinh, CQBH (1-2 dòng) và các loại khác - giữ nguyên các dòng
+            text = "\n".join(line_texts)
         
-        return binary
+        # Hậu xử lý cho text tiếng Việt
+        return text.strip()
 
     @staticmethod
     def _ocr_region(image: Image, config_params=None) -> str:
         """Extract text from image region using EasyOCR"""
+        text, _ = DocumentOCR._ocr_region_with_confidence(image, config_params)
+        return text
+
+    @staticmethod
+    def _ocr_region_with_confidence(image: Image, config_params=None) -> Tuple[str, float]:
+        """Extract text and recognition confidence (0-1) from image region using EasyOCR"""
         try:
             # Xác định loại class từ tham số (nếu có)
             class_id = None
             if config_params and 'class_id' in config_params:
                 class_id = config_params['class_id']
             
+            # Bộ ghi thời gian (nếu được truyền vào)
+            recorder = config_params.get('recorder') if config_params else None
+            
             # Chuyển đổi thành đối tượng PIL Image nếu cần
             if not isinstance(image, Image.Image):
                 image = Image.fromarray(image)
             
             # Tiền xử lý ảnh
+            stage_start = time.perf_counter()
             processed_img = DocumentOCR.preprocess_image_for_document(image, class_id)
+            if recorder:
+                recorder.record_since('preprocess', stage_start)
             
             # Chọn ngôn ngữ OCR cho từng loại class
             languages = ['vi']
@@ -2805,8 +5285,11 @@ class DocumentOCR:
             import logging
             logging.getLogger('easyocr.easyocr').setLevel(logging.ERROR)
             
-            # Khởi tạo EasyOCR reader với tùy chọn tắt cảnh báo GPU
-            reader = easyocr.Reader(languages, gpu=False, verbose=False)
+            # EasyOCR reader được cache theo bộ ngôn ngữ, chỉ khởi tạo lần đầu trong process
+            stage_start = time.perf_counter()
+            reader = DocumentOCR._get_cached_reader(languages)
+            if recorder:
+                recorder.record_since('model_load', stage_start)
             
             # Chuyển đổi sang numpy array
             if isinstance(processed_img, Image.Image):
@@ -2815,145 +5298,136 @@ class DocumentOCR:
                 img_array = processed_img
                 
             # Thực hiện OCR
+            stage_start = time.perf_counter()
             results = reader.readtext(img_array)
-            
-            # Áp dụng xử lý theo dòng cho mọi loại class để cải thiện kết quả
-            # Sắp xếp kết quả theo tọa độ y (từ trên xuống dưới)
-            sorted_results = sorted(results, key=lambda x: (x[0][0][1] + x[0][2][1])/2)
+            if recorder:
+                recorder.record_since('recognition', stage_start)
             
             # Nhóm các kết quả theo dòng
-            line_height = 20  # Độ cao dòng ước tính
-            lines = []
-            current_line = []
-            
-            for detection in sorted_results:
-                if not current_line:
-                    current_line.append(detection)
-                else:
-                    y_current = (detection[0][0][1] + detection[0][2][1])/2
-                    y_prev = (current_line[-1][0][0][1] + current_line[-1][0][2][1])/2
-                    
-                    if abs(y_current - y_prev) < line_height:
-                        current_line.append(detection)
-                    else:
-                        # Sắp xếp từ trái sang phải trong một dòng
-                        current_line = sorted(current_line, key=lambda x: x[0][0][0])
-                        lines.append(current_line)
-                        current_line = [detection]
-            
-            if current_line:
-                current_line = sorted(current_line, key=lambda x: x[0][0][0])
-                lines.append(current_line)
-            
-            # Xử lý đặc biệt cho từng loại class
-            if class_id == 7:  # Noi_Nhan
-                # Tạo văn bản theo định dạng Nơi nhận
-                text_lines = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    text_lines.append(line_text)
-                
-                text = "\n".join(text_lines)
-                
-                # Định dạng lại để dễ đọc
-                if text and not text.startswith("Nơi nhận:") and not text.startswith("Nơi nhận") and not text.startswith("-"):
-                    text = "Nơi nhận:\n" + text
-                    
-                # Thêm dấu gạch đầu dòng nếu cần
-                lines = text.split('\n')
-                formatted_lines = []
-                for i, line in enumerate(lines):
-                    if i == 0 and (line.startswith("Nơi nhận:") or line.startswith("Nơi nhận")):
-                        formatted_lines.append(line)
-                    elif not line.strip().startswith("-") and not line.strip().startswith("•") and i > 0 and line.strip():
-                        formatted_lines.append("- " + line.strip())
-                    else:
-                        formatted_lines.append(line)
-                
-                text = "\n".join(formatted_lines)
-            elif class_id == 5:  # ND_Chinh - Nội dung chính
-                # Tạo văn bản theo định dạng đoạn văn
-                text_lines = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    text_lines.append(line_text)
-                
-                text = "\n".join(text_lines)
-            elif class_id == 0:  # CQBH - Cơ quan ban hành
-                # CQBH thường có 1-2 dòng
-                text_lines = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    text_lines.append(line_text)
-                
-                text = "\n".join(text_lines)
-            elif class_id == 6:  # Ngày BH
-                # Ghép tất cả các phát hiện thành một dòng
-                all_text = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    all_text.append(line_text)
-                
-                text = " ".join(all_text)
-                
-                # Chuẩn hóa dấu ngày tháng
-                text = text.replace('/', '-').replace('.', '-')
-                # Sửa các số hay nhận nhầm
-                text = text.replace('l', '1').replace('O', '0').replace('o', '0')
-                
-                # Định dạng lại ngày tháng nếu có thể
-                date_pattern = r'(\d{1,2})[-./](\d{1,2})[-./](\d{2,4})'
-                match = re.search(date_pattern, text)
-                if match:
-                    day, month, year = match.groups()
-                    # Đảm bảo định dạng DD-MM-YYYY
-                    if len(year) == 2:
-                        year = '20' + year  # Giả sử năm hiện tại là thế kỷ 21
-                    text = f"ngày {day} tháng {month} năm {year}"
-            elif class_id == 8:  # Số ký hiệu
-                # Ghép tất cả các phát hiện từ các dòng
-                text_parts = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    text_parts.append(line_text)
-                
-                text = " ".join(text_parts)
-                
-                # Chuẩn hóa dấu gạch ngang
-                text = text.replace('—', '-').replace('–', '-').replace('_', '-')
-                # Loại bỏ các ký tự không cần thiết và giữ lại những ký tự quan trọng
-                text = ''.join(c for c in text if c.isalnum() or c in "/-_.,: ")
-                # Sửa các số hay nhận nhầm
-                text = text.replace('l', '1').replace('O', '0').replace('o', '0')
-            else:
-                # Các trường hợp khác - ghép các dòng lại
-                all_lines = []
-                for line in lines:
-                    line_text = " ".join([detection[1] for detection in line])
-                    all_lines.append(line_text)
-                
-                text = "\n".join(all_lines)
+            lines = DocumentOCR._group_lines(results)
+            line_texts = [" ".join([detection[1] for detection in line]) for line in lines]
             
-            # Hậu xử lý cho text tiếng Việt
-            text = text.strip()
+            # Độ tin cậy của vùng: trung bình theo độ dài các đoạn text
+            confidence = DocumentOCR._weighted_confidence(
+                [(detection[1], float(detection[2])) for line in lines for detection in line]
+            )
             
-            return text
+            return DocumentOCR._format_region_text(line_texts, class_id), confidence
             
         except Exception as e:
             logger.error(f"OCR error: {str(e)}")
-            return ""
+            return "", 0.0
+
+    @staticmethod
+    def _ocr_full_page(img) -> str:
+        """OCR toàn trang, trả về text theo dòng"""
+        reader = DocumentOCR._get_cached_reader(['vi'])
+        gray = cv2.cvtColor(np.array(img.convert('RGB')), cv2.COLOR_RGB2GRAY)
+        lines = DocumentOCR._group_lines(reader.readtext(gray))
+        return '\n'.join(' '.join(detection[1] for detection in line) for line in lines)
+
+    @staticmethod
+    def _usable_text_layer(text: str) -> bool:
+        """Lớp text của PDF đủ nội dung để dùng thay OCR"""
+        return sum(ch.isalnum() for ch in text or '') >= PAGE_TEXT_MIN_CHARS
+
+    @staticmethod
+    def _tesseract_psm_config(class_id):
+        """Cấu hình Tesseract phù hợp với loại vùng"""
+        custom_config = '--oem 1 --dpi 300 -l vie '
+        if class_id in [1, 2, 3, 6, 8]:  # Chữ ký, Chức vụ, Độ khẩn, Ngày BH, Số KH
+            custom_config += '--psm 7'  # Treat the image as a single text line
+        elif class_id == 7:  # Nơi nhận
+            custom_config += '--psm 4'  # Assume a single column of text
+        else:
+            custom_config += '--psm 6'  # Assume a single uniform block of text
+        return custom_config
+
+    @staticmethod
+    def _tesseract_lines(image, config):
+        """OCR bằng Tesseract, trả về (các dòng text, độ tin cậy 0-1)"""
+        data = pytesseract.image_to_data(
+            np.array(image), config=config, output_type=pytesseract.Output.DICT
+        )
+        
+        lines = {}
+        parts = []
+        for i, word in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            if conf < 0 or not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            lines.setdefault(key, []).append(word)
+            parts.append((word, conf / 100.0))
+        
+        line_texts = [" ".join(words) for _, words in sorted(lines.items())]
+        return line_texts, DocumentOCR._weighted_confidence(parts)
+
+    @staticmethod
+    def _render_region_high_dpi(pdf_doc, page_num, box, page_transform):
+        """Render lại vùng từ PDF ở DPI cao, hiệu chỉnh hướng/độ nghiêng như trang"""
+        # Box tính trên trang đã hiệu chỉnh -> tọa độ raster gốc -> điểm PDF
+        if not DocumentOCR.is_identity_transform(page_transform):
+            box = DocumentOCR.map_box(box, page_transform['matrix'], inverse=True)
+        render_scale = page_transform.get('render_scale', OCR_RENDER_SCALE) if page_transform else OCR_RENDER_SCALE
+        
+        page = pdf_doc[page_num]
+        clip = fitz.Rect(*[v / render_scale for v in box[:4]])
+        if page.rotation:
+            clip = clip * page.derotation_matrix
+        
+        pix = page.get_pixmap(matrix=fitz.Matrix(REOCR_RENDER_SCALE, REOCR_RENDER_SCALE), clip=clip)
+        region = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        
+        # Xoay vùng giống như trang (xoay theo chiều kim đồng hồ rồi chỉnh nghiêng)
+        if page_transform and page_transform.get('rotation'):
+            region = region.rotate(-page_transform['rotation'], expand=True)
+        if page_transform and page_transform.get('skew'):
+            region = region.rotate(page_transform['skew'], expand=True, fillcolor=(255, 255, 255))
+        return region
+
+    @staticmethod
+    def _reocr_region(region, class_id, recorder=None):
+        """Đường xử lý tốn kém cho vùng khó: khử nhiễu, DPI cao, thêm engine Tesseract"""
+        gray = np.array(region.convert('L'))
+        denoised = Image.fromarray(cv2.fastNlMeansDenoising(gray, None, 10, 7, 21))
+        
+        candidates = []
+        text, confidence = DocumentOCR._ocr_region_with_confidence(
+            denoised, {'class_id': class_id, 'recorder': recorder}
+        )
+        if text:
+            candidates.append((text, confidence, 'easyocr'))
+        
+        if DocumentOCR.tesseract_available():
+            try:
+                line_texts, confidence = DocumentOCR._tesseract_lines(
+                    denoised, DocumentOCR._tesseract_psm_config(class_id)
+                )
+                text = DocumentOCR._format_region_text(line_texts, class_id)
+                if text:
+                    candidates.append((text, confidence, 'tesseract'))
+            except Exception as e:
+                logger.warning(f"Tesseract re-OCR error: {str(e)}")
+        
+        return max(candidates, key=lambda c: c[1]) if candidates else None
 
     @staticmethod
     def _process_page_wrapper(args):
         """Wrapper function for multiprocessing"""
+        img, page_num, model_path, confidence_threshold, classes, save_dir, pdf_path, page_text = args
+        # Span recorder riêng cho mỗi trang, trả về cùng kết quả vì chạy trong process khác
+        recorder = SpanRecorder(page_number=page_num)
+        results = {}
+        page_detections = []
+        page_transform = None
+        text_source = 'pdf' if page_text else None
+        pdf_doc = None  # Chỉ mở PDF khi có vùng cần OCR lại
         try:
-            img, page_num, model_path, confidence_threshold, classes, save_dir = args
-            
-            # Initialize YOLO model in worker process
-            model = YOLO(model_path)
-            
-            # Khởi tạo EasyOCR reader cho worker process
-            reader = easyocr.Reader(['vi'], gpu=False)
+            # YOLO model được cache trong worker process
+            stage_start = time.perf_counter()
+            model = DocumentOCR._get_cached_model(model_path)
+            recorder.record_since('model_load', stage_start)
             
             # Lưu ảnh trang gốc nếu có thư mục lưu
             if save_dir:
@@ -2961,11 +5435,24 @@ class DocumentOCR:
                 img_filename = f"page_{page_num}_original.png"
                 img.save(original_dir / img_filename)
             
+            # Hiệu chỉnh hướng/độ nghiêng một lần cho cả trang, mọi vùng cắt dùng ảnh đã hiệu chỉnh
+            with recorder.span('page_geometry'):
+                page_transform = DocumentOCR.analyze_page_geometry(img)
+                img = DocumentOCR.apply_page_transform(img, page_transform)
+            
+            # PDF scan không có lớp text: OCR toàn trang trên ảnh đã hiệu chỉnh
+            if not page_text:
+                with recorder.span('page_text_ocr'):
+                    try:
+                        page_text = DocumentOCR._ocr_full_page(img)
+                        text_source = 'ocr'
+                    except Exception as e:
+                        logger.warning(f"Full page OCR failed on page {page_num}: {str(e)}")
+            
             # Detect regions
-            predictions = model(img)[0]
-            detections = predictions.boxes.data.cpu().numpy()
-            results = {}
-            page_detections = []
+            with recorder.span('yolo_detect'):
+                predictions = model(img)[0]
+                detections = predictions.boxes.data.cpu().numpy()
             
             for det in detections:
                 conf = det[4]
@@ -3006,31 +5493,47 @@ class DocumentOCR:
                     }
                     
                     # Tiền xử lý ảnh với tối ưu cho loại class
-                    processed_region = DocumentOCR.preprocess_image_for_document(region, class_id)
-                    processed_region_img = Image.fromarray(processed_region)
+                    with recorder.span('preprocess'):
+                        processed_region = DocumentOCR.preprocess_image_for_document(region, class_id)
+                        processed_region_img = Image.fromarray(processed_region)
                     
                     # Lưu ảnh đã xử lý
                     if save_dir:
                         processed_filename = f"page_{page_num}_{class_name}_{conf:.2f}_processed.png"
                         processed_region_img.save(Path(save_dir) / 'processed' / processed_filename)
                     
-                    # Thực hiện OCR với cấu hình tùy chỉnh tùy thuộc vào loại vùng
-                    custom_config = f'--oem 1 --dpi 300 '
-                    
-                    # Chọn PSM phù hợp với loại vùng
-                    if class_id in [1, 2, 3, 6, 8]:  # Chữ ký, Chức vụ, Độ khẩn, Ngày BH, Số KH
-                        custom_config += '--psm 7'  # Treat the image as a single text line
-                    elif class_id == 7:  # Nơi nhận
-                        custom_config += '--psm 4'  # Assume a single column of text
-                    else:
-                        custom_config += '--psm 6'  # Assume a single uniform block of text
-                    
-                    # Extract text from the region using OCR
-                    text = DocumentOCR._ocr_region(processed_region_img, {
+                    # Extract text from the region using OCR (lượt nhanh)
+                    text, ocr_confidence = DocumentOCR._ocr_region_with_confidence(processed_region_img, {
                         'lang': 'vie',
                         'class_id': class_id,
-                        'config': custom_config
+                        'config': DocumentOCR._tesseract_psm_config(class_id),
+                        'recorder': recorder
                     })
+                    ocr_pass = 'fast'
+                    ocr_engine = 'easyocr'
+                    
+                    # Chỉ vùng có độ tin cậy dưới ngưỡng của class mới chạy đường tốn kém
+                    threshold = REOCR_CONFIDENCE_THRESHOLDS.get(class_id, DEFAULT_REOCR_THRESHOLD)
+                    if ocr_confidence < threshold:
+                        with recorder.span('reocr'):
+                            try:
+                                padded_box = [x1_padded, y1_padded, x2_padded, y2_padded]
+                                if pdf_path and os.path.exists(pdf_path):
+                                    if pdf_doc is None:
+                                        pdf_doc = fitz.open(pdf_path)
+                                    hard_region = DocumentOCR._render_region_high_dpi(
+                                        pdf_doc, page_num, padded_box, page_transform
+                                    )
+                                else:
+                                    hard_region = region
+                                candidate = DocumentOCR._reocr_region(hard_region, class_id)
+                            except Exception as e:
+                                logger.warning(f"Re-OCR failed on page {page_num} ({class_name}): {str(e)}")
+                                candidate = None
+                        
+                        if candidate and candidate[1] > ocr_confidence:
+                            text, ocr_confidence, ocr_engine = candidate
+                            ocr_pass = 'reocr'
                     
                     # Save detection info
                     detection_info = {
@@ -3038,7 +5541,10 @@ class DocumentOCR:
                         'original_box': box,
                         'confidence': float(conf),
                         'class': class_name,
-                        'text': text
+                        'text': text,
+                        'ocr_confidence': round(float(ocr_confidence), 4),
+                        'ocr_pass': ocr_pass,
+                        'ocr_engine': ocr_engine
                     }
                     page_detections.append(detection_info)
                     
@@ -3055,13 +5561,166 @@ class DocumentOCR:
                         else:
                             results[class_name] = text.strip()
             
-            return page_num, results, page_detections
+            return page_num, results, page_detections, {'spans': recorder.spans, 'transform': page_transform,
+                                                        'page_text': page_text, 'text_source': text_source}
             
         except Exception as e:
             logger.error(f"Error processing document: {str(e)}")
             traceback.print_exc()
-            return results, []
+            return page_num, results, page_detections, {'spans': recorder.spans, 'transform': page_transform,
+                                                        'page_text': page_text, 'text_source': text_source}
+        
+        finally:
+            if pdf_doc is not None:
+                pdf_doc.close()
             
+    _tesseract_available = None
+
+    @classmethod
+    def tesseract_available(cls):
+        """Kiểm tra Tesseract một lần cho mỗi process"""
+        if cls._tesseract_available is None:
+            try:
+                pytesseract.get_tesseract_version()
+                cls._tesseract_available = True
+            except Exception:
+                cls._tesseract_available = False
+                logger.info("Tesseract không được cài đặt hoặc không tìm thấy trong PATH")
+        return cls._tesseract_available
+
+    @staticmethod
+    def _estimate_orientation(gray):
+        """Ước lượng góc xoay trang (0/90/180/270, chiều kim đồng hồ) bằng Tesseract OSD"""
+        if not DocumentOCR.tesseract_available():
+            return 0
+        try:
+            osd = pytesseract.image_to_osd(gray, config='--psm 0')
+            match = re.search(r'Rotate:\s*(\d+)', osd)
+            if match:
+                return int(match.group(1)) % 360
+        except Exception as e:
+            # OSD thất bại với trang ít chữ hoặc thiếu osd.traineddata
+            logger.debug(f"OSD failed: {str(e)}")
+        return 0
+
+    @staticmethod
+    def _estimate_skew_angle(binary, max_angle=PAGE_SKEW_MAX_ANGLE):
+        """Ước lượng góc nghiêng (độ) bằng projection profile theo hàng"""
+        height, width = binary.shape
+        center = (width / 2, height / 2)
+        
+        def profile_score(angle):
+            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+            rotated = cv2.warpAffine(binary, matrix, (width, height),
+                                     flags=cv2.INTER_NEAREST, borderValue=0)
+            row_sums = rotated.sum(axis=1, dtype=np.float64)
+            # Dòng chữ thẳng cho profile chênh lệch mạnh giữa dòng chữ và khoảng trắng
+            return float(np.sum(np.diff(row_sums) ** 2))
+        
+        # Dò thô bước 0.5 độ rồi tinh chỉnh bước 0.1 độ
+        coarse = max(np.arange(-max_angle, max_angle + 0.01, 0.5), key=profile_score)
+        fine = max(np.arange(coarse - 0.5, coarse + 0.51, 0.1), key=profile_score)
+        return float(fine)
+
+    @staticmethod
+    def _build_page_matrix(width, height, rotation, skew):
+        """Ma trận affine 3x3 từ ảnh gốc sang ảnh đã hiệu chỉnh"""
+        if rotation in (90, 270):
+            new_width, new_height = height, width
+        else:
+            new_width, new_height = width, height
+        
+        # Xoay theo hướng trang (chiều kim đồng hồ) và dời tâm vào khung mới
+        orientation = np.vstack([
+            cv2.getRotationMatrix2D((width / 2, height / 2), -rotation, 1.0), [0, 0, 1]
+        ])
+        orientation[0, 2] += new_width / 2 - width / 2
+        orientation[1, 2] += new_height / 2 - height / 2
+        
+        # Chỉnh nghiêng quanh tâm, giữ nguyên kích thước
+        deskew = np.vstack([
+            cv2.getRotationMatrix2D((new_width / 2, new_height / 2), skew, 1.0), [0, 0, 1]
+        ])
+        return deskew @ orientation, (new_width, new_height)
+
+    @staticmethod
+    def analyze_page_geometry(img):
+        """Ước lượng góc xoay và độ nghiêng của trang, trả về transform dạng dict"""
+        gray = np.array(img.convert('L'))
+        height, width = gray.shape
+        
+        # Phân tích trên ảnh thu nhỏ cho nhanh
+        scale = min(1.0, 1000.0 / max(height, width))
+        if scale < 1.0:
+            small = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        else:
+            small = gray
+        _, binary = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        
+        rotation = DocumentOCR._estimate_orientation(small)
+        if rotation:
+            binary = np.ascontiguousarray(np.rot90(binary, k=-(rotation // 90)))
+        
+        skew = DocumentOCR._estimate_skew_angle(binary)
+        if abs(skew) < PAGE_SKEW_MIN_ANGLE:
+            skew = 0.0
+        
+        matrix, (new_width, new_height) = DocumentOCR._build_page_matrix(width, height, rotation, skew)
+        return {
+            'rotation': rotation,
+            'skew': round(skew, 2),
+            'matrix': np.round(matrix[:2], 6).tolist(),
+            'size': [int(new_width), int(new_height)],
+            'source_size': [int(width), int(height)],
+            'render_scale': OCR_RENDER_SCALE
+        }
+
+    @staticmethod
+    def is_identity_transform(transform):
+        """Transform không xoay, không nghiêng"""
+        return not transform or (not transform.get('rotation') and not transform.get('skew'))
+
+    @staticmethod
+    def apply_page_transform(img, transform):
+        """Áp dụng transform lên ảnh trang (ảnh cùng tỷ lệ với transform)"""
+        if DocumentOCR.is_identity_transform(transform):
+            return img
+        matrix = np.array(transform['matrix'], dtype=np.float64)
+        width, height = transform['size']
+        corrected = cv2.warpAffine(np.array(img.convert('RGB')), matrix, (width, height),
+                                   flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+        return Image.fromarray(corrected)
+
+    @staticmethod
+    def scale_page_transform(transform, factor):
+        """Đổi transform sang ảnh render ở tỷ lệ khác (phần tuyến tính giữ nguyên)"""
+        return dict(
+            transform,
+            matrix=[[row[0], row[1], row[2] * factor] for row in transform['matrix']],
+            size=[int(round(v * factor)) for v in transform['size']],
+            source_size=[int(round(v * factor)) for v in transform['source_size']],
+            render_scale=transform.get('render_scale', OCR_RENDER_SCALE) * factor
+        )
+
+    @staticmethod
+    def map_box(box, matrix, inverse=False):
+        """Ánh xạ box [x1, y1, x2, y2] qua ma trận affine, trả về khung bao"""
+        full = np.vstack([np.array(matrix, dtype=np.float64), [0, 0, 1]])
+        if inverse:
+            full = np.linalg.inv(full)
+        x1, y1, x2, y2 = box[:4]
+        corners = np.array([[x1, x2, x1, x2], [y1, y1, y2, y2], [1, 1, 1, 1]], dtype=np.float64)
+        mapped = (full @ corners)[:2]
+        return [float(mapped[0].min()), float(mapped[1].min()),
+                float(mapped[0].max()), float(mapped[1].max())]
+
+    def get_reader(self):
+        """Lấy EasyOCR reader dùng chung (khởi tạo một lần)"""
+        with self.reader_lock:
+            if self.ocr_reader is None:
+                self.ocr_reader = easyocr.Reader(['vi'], gpu=False)
+            return self.ocr_reader
+
     def extract_text(self, image):
         """Extract text from a single image"""
         try:
@@ -3101,8 +5760,11 @@ class DocumentOCR:
             logger.error(f"Error extracting text: {str(e)}")
             return ""
             
-    def process_document(self, pdf_path, progress_callback=None):
+    def process_document(self, pdf_path, progress_callback=None, recorder=None):
         """Process a PDF document and extract text from detected regions"""
+        if recorder is None:
+            recorder = SpanRecorder()
+        document_start = time.perf_counter()
         try:
             if not os.path.exists(pdf_path):
                 logger.error(f"PDF file not found: {pdf_path}")
@@ -3140,15 +5802,22 @@ class DocumentOCR:
             try:
                 # Chuyển đổi các trang PDF thành ảnh
                 images = []
+                layer_texts = []
                 for i in range(total_pages):
                     # Cập nhật progress: 40% đầu tiên cho việc load PDF
                     if progress_callback:
                         progress_callback(int((i/total_pages) * 40), 100, f"Đang nạp trang {i+1}/{total_pages}...")
                         
-                    page = doc[i]
-                    pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                    with recorder.span('rasterize', page_number=i):
+                        page = doc[i]
+                        pix = page.get_pixmap(matrix=fitz.Matrix(OCR_RENDER_SCALE, OCR_RENDER_SCALE))
+                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
                     images.append(img)
+                    
+                    # Ưu tiên lớp text sẵn có của PDF, trang scan để trống và OCR sau
+                    with recorder.span('text_layer', page_number=i):
+                        layer_text = page.get_text("text").strip()
+                    layer_texts.append(layer_text if self._usable_text_layer(layer_text) else None)
                 
                 if progress_callback:
                     progress_callback(40, 100, "Đang xử lý các trang...")
@@ -3158,7 +5827,7 @@ class DocumentOCR:
                     # Tạo args cho xử lý song song
                     process_args = [
                         (images[i], i, self.model_path, self.confidence_threshold, self.classes, 
-                         str(self.image_save_dir) if self.image_save_dir else None)
+                         str(self.image_save_dir) if self.image_save_dir else None, pdf_path, layer_texts[i])
                         for i in range(total_pages)
                     ]
                     
@@ -3175,7 +5844,9 @@ class DocumentOCR:
                             process_results.append(result)
                         
                         # Xử lý kết quả từ các trang
-                        for page_num, page_results, page_detections in process_results:
+                        for page_num, page_results, page_detections, page_info in process_results:
+                            recorder.extend(page_info.pop('spans', None))
+                            
                             # Ghép kết quả
                             for key, value in page_results.items():
                                 if key == 'CQBH_tren' and not results['CQBH_tren']:
@@ -3185,7 +5856,7 @@ class DocumentOCR:
                                 elif key in results and not results[key]:
                                     results[key] = value
                             
-                            all_page_detections.append((page_num, page_detections))
+                            all_page_detections.append((page_num, page_detections, page_info))
                 else:
                     # Xử lý tuần tự
                     for i, img in enumerate(images):
@@ -3195,10 +5866,11 @@ class DocumentOCR:
                             progress_callback(progress, 100, 
                                             f"Đang OCR trang {i+1}/{total_pages}...")
                         
-                        page_num, page_results, page_detections = self._process_page_wrapper(
+                        page_num, page_results, page_detections, page_info = self._process_page_wrapper(
                             (img, i, self.model_path, self.confidence_threshold, self.classes, 
-                             str(self.image_save_dir) if self.image_save_dir else None)
+                             str(self.image_save_dir) if self.image_save_dir else None, pdf_path, layer_texts[i])
                         )
+                        recorder.extend(page_info.pop('spans', None))
                         
                         # Ghép kết quả
                         for key, value in page_results.items():
@@ -3209,7 +5881,7 @@ class DocumentOCR:
                             elif key in results and not results[key]:
                                 results[key] = value
                         
-                        all_page_detections.append((page_num, page_detections))
+                        all_page_detections.append((page_num, page_detections, page_info))
                 
                 # Cập nhật progress phần cuối
                 if progress_callback:
@@ -3218,6 +5890,9 @@ class DocumentOCR:
             finally:
                 # Khôi phục mức độ logging ban đầu
                 easyocr_logger.setLevel(original_level)
+                doc.close()
+            
+            recorder.record_since('total', document_start)
             
             # Cập nhật progress khi hoàn thành
             if progress_callback:
@@ -3233,6 +5908,52 @@ class DocumentOCR:
 #############################
 #    OCR Result Editor      #
 #############################
+class SuggestionSignals(QObject):
+    """Chuyển thông báo gợi ý mới từ DocumentDatabase về luồng giao diện"""
+    suggestion_added = pyqtSignal(str, str, int)  # field_name, value, frequency
+
+class SuggestionCompletionModel(QAbstractListModel):
+    """Model completer cho một trường, lọc bằng SuggestionIndex thay vì QCompleter
+    
+    Dùng chung cho mọi ô nhập của cùng trường; tự cập nhật khi có gợi ý mới khớp truy vấn.
+    """
+    
+    def __init__(self, db, field_name, limit=SUGGESTION_LIMIT, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.field_name = field_name
+        self.limit = limit
+        self.query = ""
+        self.values = db.search_suggestions(field_name, "", limit)
+        
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.values)
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.values):
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.values[index.row()]
+        return None
+        
+    def set_query(self, text):
+        """Lọc lại theo nội dung đang gõ"""
+        self.query = text or ""
+        values = self.db.search_suggestions(self.field_name, self.query, self.limit)
+        if values != self.values:
+            self.beginResetModel()
+            self.values = values
+            self.endResetModel()
+            
+    def suggestion_added(self, field_name, value, frequency):
+        """Chỉ lọc lại khi gợi ý mới thuộc trường này và khớp truy vấn hiện tại"""
+        if field_name != self.field_name:
+            return
+        folded_query = SuggestionIndex.fold(self.query)
+        if value in self.values or folded_query in SuggestionIndex.fold(value):
+            self.set_query(self.query)
+
+
 class OCRResultEditor(QWidget):
     """Editor for OCR results with autosuggestions"""
     
@@ -3246,6 +5967,8 @@ class OCRResultEditor(QWidget):
         self.full_cqbh_text = ""
         self.current_doc_data = None 
         self.is_loading = False
+        self.suggestion_models = {}  # field_id -> SuggestionCompletionModel (tạo một lần)
+        self.suggestion_signals = None
         self.setup_ui()
 
     def setup_ui(self):
@@ -3654,9 +6377,9 @@ class OCRResultEditor(QWidget):
                 raise ValueError(f"Document with ID {self.doc_id} not found")
                 
             data = self.get_current_data()
-            # Emit update signal
-            self.ocr_updated.emit(self.doc_id, data)
+            # Tắt nút lưu trước khi emit để editor được nạp lại bản vừa lưu
             self.save_btn.setEnabled(False)
+            self.ocr_updated.emit(self.doc_id, data)
             
         except Exception as e:
             logger.error(f"Error saving changes: {str(e)}")
@@ -3669,15 +6392,26 @@ class OCRResultEditor(QWidget):
             self.load_data(self.current_doc_data)
 
     def update_suggestions(self, db):
-        """Update suggestions for all fields from database"""
+        """Gắn completer dùng SuggestionIndex cho các ô nhập (chỉ lần đầu, sau đó model tự cập nhật)"""
+        if self.suggestion_models:
+            return
+            
         try:
+            self.suggestion_signals = SuggestionSignals(self)
+            db.add_suggestion_listener(self.suggestion_signals.suggestion_added.emit)
+            
             for field_id, editor in self.fields.items():
                 if isinstance(editor, QLineEdit):
-                    suggestions = db.get_suggestions(field_id)
-                    completer = QCompleter(suggestions)
+                    model = SuggestionCompletionModel(db, field_id, parent=self)
+                    self.suggestion_signals.suggestion_added.connect(model.suggestion_added)
+                    editor.textEdited.connect(model.set_query)
+                    
+                    # Model đã lọc sẵn (gộp dấu, chuỗi con) nên completer không lọc lại
+                    completer = QCompleter(model, editor)
                     completer.setCaseSensitivity(Qt.CaseInsensitive)
-                    completer.setFilterMode(Qt.MatchContains)
+                    completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
                     editor.setCompleter(completer)
+                    self.suggestion_models[field_id] = model
         except Exception as e:
             logger.error(f"Error updating suggestions: {str(e)}")
 
@@ -3912,6 +6646,7 @@ class OCRWorker(QThread):
         self.ocr_system = ocr_system
         self.file_path = file_path
         self.canceled = False
+        self.metrics = SpanRecorder()
 
     def run(self):
         try:
@@ -3926,7 +6661,8 @@ class OCRWorker(QThread):
                 
             results, all_page_detections = self.ocr_system.process_document(
                 self.file_path,
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                recorder=self.metrics
             )
             
             if not self.canceled:
@@ -3969,11 +6705,13 @@ class BatchProcessWorker(QThread):
                     
                 try:
                     self.progress.emit(i, total, f"Processing: {os.path.basename(file_path)}")
+                    metrics = SpanRecorder()
                     result, page_detections = self.ocr_system.process_document(
                         file_path,
-                        progress_callback=lambda curr, tot: not self.canceled
+                        progress_callback=lambda curr, tot, msg=None: not self.canceled,
+                        recorder=metrics
                     )
-                    results.append((file_path, result, page_detections))
+                    results.append((file_path, result, page_detections, metrics))
                 except Exception as e:
                     logger.error(f"Error processing {file_path}: {str(e)}")
                     
@@ -3992,6 +6730,94 @@ class BatchProcessWorker(QThread):
         """Cancel the batch process"""
         self.canceled = True
 
+class FileVerifyWorker(QThread):
+    """Worker thread kiểm tra file của các văn bản (chỉ các mục cache đã cũ)"""
+    progress = pyqtSignal(int, int, str)  # done, total, message
+    finished = pyqtSignal(list)  # missing_files
+    error = pyqtSignal(str)
+
+    def __init__(self, db, max_age=FILE_VERIFY_MAX_AGE):
+        super().__init__()
+        self.db = db
+        self.max_age = max_age
+        self.canceled = False
+
+    def run(self):
+        try:
+            def progress_callback(done, total):
+                self.progress.emit(done, total, f"Đã kiểm tra {done}/{total} tệp tin")
+                return not self.canceled
+                
+            missing_files = self.db.verify_file_paths(self.max_age, progress_callback=progress_callback)
+            if not self.canceled:
+                self.finished.emit(missing_files)
+        except Exception as e:
+            if not self.canceled:
+                logger.error(f"File verify error: {str(e)}")
+                self.error.emit(str(e))
+
+    def cancel(self):
+        """Dừng sau lô đang kiểm tra"""
+        self.canceled = True
+
+class DatabaseBackupWorker(QThread):
+    """Worker thread sao lưu database trực tuyến (dest_path=None: bản tự động theo lịch)"""
+    progress = pyqtSignal(int, int, str)  # done, total, message
+    finished = pyqtSignal(str)  # đường dẫn bản sao lưu, rỗng nếu bỏ qua/hủy
+    error = pyqtSignal(str)
+
+    def __init__(self, db, dest_path=None, force=False):
+        super().__init__()
+        self.db = db
+        self.dest_path = dest_path
+        self.force = force
+        self.canceled = False
+
+    def run(self):
+        try:
+            def progress_callback(done, total):
+                percent = done * 100 // total if total else 100
+                self.progress.emit(done, total, f"Đang sao lưu database... {percent}%")
+                return not self.canceled
+                
+            if self.dest_path:
+                ok = self.db.backup_to(self.dest_path, progress_callback)
+                result = str(self.dest_path) if ok else ""
+            else:
+                snapshot = self.db.create_database_snapshot(progress_callback, force=self.force)
+                result = str(snapshot) if snapshot else ""
+            self.finished.emit(result)
+        except Exception as e:
+            logger.error(f"Database backup error: {str(e)}")
+            self.error.emit(str(e))
+
+    def cancel(self):
+        """Dừng sau bước chép đang chạy"""
+        self.canceled = True
+
+class DatabaseMaintenanceWorker(QThread):
+    """Worker thread bảo trì database (ANALYZE, vacuum, checkpoint WAL)"""
+    finished = pyqtSignal(dict)  # báo cáo của DocumentDatabase.run_maintenance
+    error = pyqtSignal(str)
+
+    def __init__(self, db, analyze=None):
+        super().__init__()
+        self.db = db
+        self.analyze = analyze
+        self.canceled = False
+
+    def run(self):
+        try:
+            report = self.db.run_maintenance(self.analyze, cancel_check=lambda: self.canceled)
+            self.finished.emit(report)
+        except Exception as e:
+            logger.error(f"Database maintenance error: {str(e)}")
+            self.error.emit(str(e))
+
+    def cancel(self):
+        """Dừng sau bước vacuum đang chạy"""
+        self.canceled = True
+
 class FileRepairWorker(QThread):
     """Worker thread for repairing broken file paths"""
     progress = pyqtSignal(int, int, str)
@@ -4031,6 +6857,17 @@ class FileRepairWorker(QThread):
                     if self.db.update_file_path(doc_id, str(backup_path)):
                         fixed_files.append((doc_id, str(backup_path)))
                         continue
+                        
+                # 2b. Khôi phục từ kho sao lưu về vị trí cũ (không trỏ văn bản vào blob dùng chung)
+                blob_path = self.db.get_latest_backup_path(doc_id)
+                if blob_path and os.path.isdir(os.path.dirname(old_path)):
+                    try:
+                        shutil.copy2(blob_path, old_path)
+                        if self.db.update_file_path(doc_id, old_path):
+                            fixed_files.append((doc_id, old_path))
+                            continue
+                    except OSError as e:
+                        logger.warning(f"Cannot restore backup to {old_path}: {str(e)}")
                 
                 # 3. Ask user for file location
                 filename = Path(old_path).name
@@ -4074,8 +6911,348 @@ class FileRepairWorker(QThread):
         with self.wait_condition:
             self.wait_condition.notify()  # Wake up waiting thread
 
+class CustomBoxOCRSignals(QObject):
+    """Signals cho job OCR vùng tự vẽ"""
+    finished = pyqtSignal(int, int, int, str, str, float)  # job_id, doc_id, class_id, text, engine, score
+    failed = pyqtSignal(int, int, str)  # job_id, class_id, message
+
+class WordConversionSignals(QObject):
+    """Chuyển kết quả từ worker của WordConverterService về luồng giao diện"""
+    finished = pyqtSignal(int, str, str)  # batch_id, word_path, pdf_path ('' nếu lỗi)
+
+class DocumentChangeSignals(QObject):
+    """Chuyển thông báo thay đổi từ DocumentDatabase về luồng giao diện"""
+    document_changed = pyqtSignal(int, int)  # doc_id, version_number
+
+class CustomBoxOCRTask(QRunnable):
+    """OCR một vùng tự vẽ trên QThreadPool, chạy song song EasyOCR và Tesseract"""
+
+    def __init__(self, ocr_system, signals, job_id, doc_id, class_id, region, debug_info=None):
+        super().__init__()
+        self.ocr_system = ocr_system
+        self.signals = signals
+        self.job_id = job_id
+        self.doc_id = doc_id
+        self.class_id = class_id
+        self.region = region
+        self.debug_info = debug_info
+
+    def save_debug_images(self, debug_dir, timestamp):
+        """Lưu ảnh debug (trang gốc và khung vùng chọn)"""
+        page_image, rect, crop_coords = self.debug_info
+        page_image.save(str(debug_dir / f"original_full_page_{timestamp}.png"))
+        
+        debug_img = page_image.copy()
+        draw = ImageDraw.Draw(debug_img)
+        draw.rectangle(rect, outline="red", width=3)
+        debug_img.save(str(debug_dir / f"original_with_rect_{self.class_id}_{timestamp}.png"))
+        
+        debug_img_margin = page_image.copy()
+        draw_margin = ImageDraw.Draw(debug_img_margin)
+        draw_margin.rectangle(crop_coords, outline="blue", width=3)
+        debug_img_margin.save(str(debug_dir / f"original_with_margin_rect_{self.class_id}_{timestamp}.png"))
+
+    def run_easyocr(self, debug_dir, timestamp):
+        """EasyOCR với tiền xử lý theo loại vùng"""
+        processed_region = self.ocr_system.preprocess_image_for_document(self.region, self.class_id)
+        if not isinstance(processed_region, Image.Image):
+            processed_region = Image.fromarray(processed_region)
+        processed_region.save(str(debug_dir / f"processed_class_{self.class_id}_{timestamp}.png"))
+        
+        reader = self.ocr_system.get_reader()
+        with self.ocr_system.reader_lock:
+            results = reader.readtext(np.array(processed_region))
+        
+        if self.class_id == 7:  # Noi_Nhan - sắp xếp từ trên xuống dưới
+            results = sorted(results, key=lambda r: (r[0][0][1] + r[0][2][1]) / 2)
+        
+        parts = [(text, float(prob)) for _, text, prob in results if text.strip()]
+        return "\n".join(text for text, _ in parts), DocumentOCR._weighted_confidence(parts)
+
+    def run_tesseract(self, debug_dir, timestamp):
+        """Tesseract với ảnh tăng tương phản, điểm tin cậy từ image_to_data"""
+        gray_img = self.region.convert('L')
+        enhanced_img = ImageEnhance.Contrast(gray_img).enhance(2.0)
+        enhanced_img.save(str(debug_dir / f"tesseract_enhanced_{self.class_id}_{timestamp}.png"))
+        
+        # PSM 6 cho block text, PSM 4 cho single column
+        if self.class_id in [5, 7]:
+            custom_config = '--oem 1 --psm 6 -l vie'
+        else:
+            custom_config = '--oem 1 --psm 4 -l vie'
+        
+        line_texts, score = DocumentOCR._tesseract_lines(enhanced_img, custom_config)
+        return "\n".join(line_texts), score
+
+    def run_enhanced_easyocr(self, debug_dir, timestamp):
+        """Lần thử cuối: tăng tương phản và phóng to 2x"""
+        gray_img = self.region.convert('L')
+        enhanced_img = ImageEnhance.Contrast(gray_img).enhance(2.0)
+        scaled_img = enhanced_img.resize((enhanced_img.width * 2, enhanced_img.height * 2), Image.LANCZOS)
+        scaled_img.save(str(debug_dir / f"enhanced_class_{self.class_id}_{timestamp}.png"))
+        
+        reader = self.ocr_system.get_reader()
+        with self.ocr_system.reader_lock:
+            results = reader.readtext(np.array(scaled_img))
+        parts = [(text, float(prob)) for _, text, prob in results if text.strip()]
+        return "\n".join(text for text, _ in parts), DocumentOCR._weighted_confidence(parts)
+
+    def run(self):
+        try:
+            debug_dir = TEMP_DIR / "debug"
+            debug_dir.mkdir(exist_ok=True)
+            timestamp = int(time.time())
+            
+            if self.debug_info:
+                self.save_debug_images(debug_dir, timestamp)
+            self.region.save(str(debug_dir / f"region_class_{self.class_id}_{timestamp}.png"))
+            
+            engines = {'EasyOCR': self.run_easyocr}
+            if DocumentOCR.tesseract_available():
+                engines['Tesseract'] = self.run_tesseract
+            
+            # Chạy song song các engine, nhận ngay kết quả đủ tin cậy
+            best = ("", "", 0.0)
+            executor = ThreadPoolExecutor(max_workers=len(engines))
+            try:
+                futures = {
+                    executor.submit(func, debug_dir, timestamp): name
+                    for name, func in engines.items()
+                }
+                for future in as_completed(futures):
+                    engine = futures[future]
+                    try:
+                        text, score = future.result()
+                    except Exception as e:
+                        logger.warning(f"Lỗi {engine}: {str(e)}")
+                        continue
+                    
+                    text = text.strip()
+                    if text and (score, len(text)) > (best[2], len(best[0])):
+                        best = (text, engine, score)
+                    if best[0] and best[2] >= CUSTOM_BOX_ACCEPT_SCORE:
+                        break
+            finally:
+                executor.shutdown(wait=False)
+            
+            if not best[0]:
+                text, score = self.run_enhanced_easyocr(debug_dir, timestamp)
+                best = (text.strip(), 'EasyOCR+', score)
+            
+            if not best[0]:
+                self.signals.failed.emit(self.job_id, self.class_id, "Không thể trích xuất text từ vùng đã chọn")
+                return
+            
+            self.signals.finished.emit(self.job_id, self.doc_id, self.class_id, best[0], best[1], best[2])
+            
+        except Exception as e:
+            logger.error(f"Error processing custom box: {str(e)}")
+            traceback.print_exc()
+            self.signals.failed.emit(self.job_id, self.class_id, f"Lỗi xử lý OCR: {str(e)}")
+
+#############################
+#   Document List Models    #
+#############################
+def load_document_thumbnail(file_path, doc_id) -> QIcon:
+    """Load or generate thumbnail icon for a document"""
+    # Check for cached thumbnail
+    thumb_path = IMAGES_DIR / f"thumb_{doc_id}.jpg"
+    
+    if os.path.exists(thumb_path):
+        return QIcon(QPixmap(str(thumb_path)))
+        
+    # Generate thumbnail if file exists
+    if file_path and os.path.exists(file_path):
+        try:
+            # Open first page of PDF
+            with fitz.open(file_path) as pdf:
+                if len(pdf) > 0:
+                    page = pdf[0]
+                    # Render page to pixmap
+                    pix = page.get_pixmap(matrix=fitz.Matrix(0.2, 0.2))
+                    
+                    # Convert to QImage and save thumbnail
+                    img = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
+                    img.save(str(thumb_path), "JPG")
+                    return QIcon(QPixmap.fromImage(img))
+        except Exception as e:
+            logger.error(f"Error generating thumbnail: {str(e)}")
+            
+    # Use default icon if thumbnail generation failed
+    return QIcon.fromTheme("application-pdf")
+
+
+class DocumentTableModel(QAbstractTableModel):
+    """Danh sách văn bản nạp dần theo trang (keyset) từ DocumentDatabase"""
+    
+    # (tiêu đề, vị trí cột trong dòng get_all_documents, khóa sắp xếp SQL)
+    COLUMNS = [
+        ("ID", 0, 'id'),
+        ("Tên File", 2, 'file_name'),
+        ("Ngày tạo", 3, 'created_at'),
+        ("Phiên bản", 5, 'version_count'),
+        ("Số ký hiệu", 8, 'so_ki_hieu'),
+    ]
+    
+    def __init__(self, db, page_size=DOCUMENT_PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.page_size = page_size
+        self.filter_criteria = {}
+        self.sort_by = 'created_at'
+        self.sort_desc = True
+        self.rows = []
+        self.row_index = {}  # doc_id -> vị trí dòng
+        self.next_cursor = None
+        self.total = 0
+        
+    def reset_query(self, filter_criteria=None, sort_by=None, sort_desc=None):
+        """Chạy lại truy vấn từ trang đầu (bộ lọc/sắp xếp mới hoặc giữ nguyên)"""
+        if filter_criteria is not None:
+            self.filter_criteria = filter_criteria
+        if sort_by is not None:
+            self.sort_by = sort_by
+        if sort_desc is not None:
+            self.sort_desc = sort_desc
+            
+        self.beginResetModel()
+        page = self.db.get_documents_page(self.filter_criteria, self.sort_by, self.sort_desc,
+                                          limit=self.page_size)
+        self.rows = list(page['rows'])
+        self.next_cursor = page['next_cursor']
+        self.total = page['total'] or len(self.rows)
+        self._reindex()
+        self.endResetModel()
+        
+    def _reindex(self, start=0):
+        if start == 0:
+            self.row_index = {}
+        for i in range(start, len(self.rows)):
+            self.row_index[self.rows[i][0]] = i
+        
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+        
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+        
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.next_cursor is not None
+        
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.next_cursor is None:
+            return
+        page = self.db.get_documents_page(self.filter_criteria, self.sort_by, self.sort_desc,
+                                          after=self.next_cursor, limit=self.page_size)
+        rows = page['rows']
+        self.next_cursor = page['next_cursor']
+        if not rows:
+            return
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self.rows.extend(rows)
+        self._reindex(start)
+        self.endInsertRows()
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        doc = self.rows[index.row()]
+        _, position, _ = self.COLUMNS[index.column()]
+        
+        if role == Qt.DisplayRole:
+            value = doc[position]
+            return "" if value is None else str(value)
+        if role == Qt.UserRole:
+            return doc[0]
+        if role == Qt.ToolTipRole and position == 2:
+            return doc[1]  # Full path as tooltip
+        if role == Qt.TextAlignmentRole and position == 5:
+            return Qt.AlignCenter
+        return None
+        
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section][0]
+        return None
+        
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sắp xếp bằng SQL rồi nạp lại từ trang đầu"""
+        self.reset_query(sort_by=self.COLUMNS[column][2], sort_desc=(order == Qt.DescendingOrder))
+        
+    def document_id(self, row):
+        return self.rows[row][0] if 0 <= row < len(self.rows) else None
+        
+    def document_row(self, row):
+        return self.rows[row] if 0 <= row < len(self.rows) else None
+        
+    def row_of(self, doc_id):
+        return self.row_index.get(doc_id)
+        
+    def refresh_document(self, doc_id):
+        """Cập nhật đúng một dòng sau khi văn bản thay đổi; xóa dòng nếu văn bản không còn"""
+        row = self.row_index.get(doc_id)
+        if row is None:
+            return False
+        doc = self.db.get_document_row(doc_id)
+        if doc is None:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.rows[row]
+            self.total = max(0, self.total - 1)
+            self._reindex()
+            self.endRemoveRows()
+        else:
+            self.rows[row] = tuple(doc)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.COLUMNS) - 1))
+        return True
+
+
+class DocumentGalleryModel(QIdentityProxyModel):
+    """Chế độ thư viện dùng chung dữ liệu với DocumentTableModel, thumbnail nạp khi hiển thị"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.icons = {}  # doc_id -> QIcon, giữ tối đa THUMBNAIL_CACHE_SIZE
+        
+    def columnCount(self, parent=QModelIndex()):
+        return 1 if self.sourceModel() and not parent.isValid() else 0
+        
+    def data(self, index, role=Qt.DisplayRole):
+        source = self.sourceModel()
+        if not index.isValid() or source is None:
+            return None
+        doc = source.document_row(index.row())
+        if doc is None:
+            return None
+            
+        if role == Qt.DisplayRole:
+            doc_info = f"{doc[2]}\nID: {doc[0]}"
+            if doc[8]:  # So ky hieu
+                doc_info += f"\n{doc[8]}"
+            if doc[10]:  # Do khan
+                doc_info += f"\n{doc[10]}"
+            return doc_info
+        if role == Qt.DecorationRole:
+            icon = self.icons.get(doc[0])
+            if icon is None:
+                if len(self.icons) >= THUMBNAIL_CACHE_SIZE:
+                    self.icons.pop(next(iter(self.icons)))
+                icon = load_document_thumbnail(doc[1], doc[0])
+                self.icons[doc[0]] = icon
+            return icon
+        if role == Qt.UserRole:
+            return doc[0]
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if role == Qt.ToolTipRole:
+            return doc[1]
+        return None
+        
+    def invalidate_thumbnail(self, doc_id):
+        self.icons.pop(doc_id, None)
+
 #############################
-#      Main Window Class    #
+#       Main Window         #
 #############################
 class MainWindow(QMainWindow):
     """Main application window"""
@@ -4106,21 +7283,63 @@ class MainWindow(QMainWindow):
         self.theme_manager = ThemeManager()
         self.db = DocumentDatabase()
         
+        # Thay đổi văn bản -> chỉ cập nhật dòng/phiên bản/editor liên quan
+        self.document_signals = DocumentChangeSignals()
+        self.document_signals.document_changed.connect(self.document_changed)
+        self.db.add_change_listener(self.document_signals.document_changed.emit)
+        
         # Document tracking
         self.current_doc_id = None
         self.detections_by_page = {}
+        self.page_transforms = {}  # (doc_id, page) -> transform hướng/độ nghiêng
+        self.corrected_pages = {}  # (doc_id, page) -> ảnh trang đã hiệu chỉnh (tỷ lệ viewer)
         self.current_view_mode = "details" 
         
         # Worker threads
         self.ocr_worker = None
         self.batch_worker = None
         self.repair_worker = None
+        self.verify_worker = None
+        self.db_backup_worker = None
+        self.maintenance_worker = None
+        self.last_maintenance = 0.0
+        
+        # Thread pool cho OCR vùng tự vẽ
+        self.custom_box_pool = QThreadPool(self)
+        self.custom_box_pool.setMaxThreadCount(CUSTOM_BOX_MAX_THREADS)
+        self.custom_box_signals = CustomBoxOCRSignals()
+        self.custom_box_signals.finished.connect(self.custom_box_ocr_finished)
+        self.custom_box_signals.failed.connect(self.custom_box_ocr_failed)
+        self.custom_box_job_id = 0
+        self.custom_box_pending = 0
+        
+        # Dịch vụ chuyển đổi Word -> PDF (khởi tạo khi cần)
+        self.converter_service = None
+        self.word_signals = WordConversionSignals()
+        self.word_signals.finished.connect(self.word_file_converted)
+        self.word_batches = {}
+        self.word_batch_id = 0
+        
+        # Ghi dồn tần suất gợi ý xuống database
+        self.suggestion_flush_timer = QTimer(self)
+        self.suggestion_flush_timer.timeout.connect(lambda: self.db.flush_suggestions())
+        self.suggestion_flush_timer.start(SUGGESTION_FLUSH_INTERVAL)
         
         # Auto-save timer
         self.autosave_timer = QTimer(self)
         self.autosave_timer.timeout.connect(self.auto_save)
         self.autosave_timer.setInterval(AUTOSAVE_INTERVAL)
         
+        # Sao lưu database tự động theo lịch (chạy nền, bỏ qua nếu không có thay đổi)
+        self.db_backup_timer = QTimer(self)
+        self.db_backup_timer.timeout.connect(self.scheduled_database_backup)
+        self.db_backup_timer.start(DB_BACKUP_CHECK_INTERVAL)
+        
+        # Bảo trì database khi rảnh (không có lệnh ghi, không có worker đang chạy)
+        self.maintenance_timer = QTimer(self)
+        self.maintenance_timer.timeout.connect(self.maintenance_if_idle)
+        self.maintenance_timer.start(DB_MAINTENANCE_CHECK_INTERVAL)
+        
         # Khởi tạo OCR system chỉ với model YOLO
         FIXED_MODEL_PATH = r"D:\OCR_VanBang_Local_New\Code\models\best.pt"  
 
@@ -4177,9 +7396,24 @@ class MainWindow(QMainWindow):
         else:
             self.settings.remove("api_keys")
 
-    def check_file_paths(self):
-        """Check and potentially repair missing file paths"""
-        missing_files = self.db.verify_file_paths()
+    def check_file_paths(self, force=False):
+        """Kiểm tra đường dẫn tệp trong nền, hỏi sửa chữa khi có tệp bị thiếu
+        
+        force=True kiểm tra lại mọi tệp, bỏ qua kết quả đã cache.
+        """
+        if self.verify_worker and self.verify_worker.isRunning():
+            return
+            
+        self.verify_worker = FileVerifyWorker(self.db, max_age=0 if force else FILE_VERIFY_MAX_AGE)
+        self.verify_worker.progress.connect(
+            lambda done, total, message: self.statusBar().showMessage(message, 2000)
+        )
+        self.verify_worker.finished.connect(self.file_check_completed)
+        self.verify_worker.error.connect(self.show_error)
+        self.verify_worker.start()
+
+    def file_check_completed(self, missing_files):
+        """Kết quả kiểm tra tệp từ FileVerifyWorker"""
         if missing_files:
             reply = QMessageBox.question(
                 self,
@@ -4191,6 +7425,7 @@ class MainWindow(QMainWindow):
             
             if reply == QMessageBox.Yes:
                 self.repair_file_paths(missing_files)
+
     def repair_file_paths(self, missing_files):
         """Repair missing file paths"""
         if not missing_files:
@@ -4342,20 +7577,19 @@ class MainWindow(QMainWindow):
             }
         """)
 
-        # Document Table
-        self.doc_table = QTableWidget()
-        self.doc_table.setColumnCount(5)
-        self.doc_table.setHorizontalHeaderLabels([
-            "ID", "Tên File", "Ngày tạo", "Phiên bản", "Số ký hiệu"
-        ])
+        # Document Table (model/view, nạp dần theo trang)
+        self.doc_model = DocumentTableModel(self.db, parent=self)
+        self.doc_table = QTableView()
+        self.doc_table.setModel(self.doc_model)
         self.doc_table.horizontalHeader().setFixedHeight(25)
-        self.doc_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.doc_table.setSelectionMode(QTableWidget.SingleSelection)
+        self.doc_table.setSelectionBehavior(QTableView.SelectRows)
+        self.doc_table.setSelectionMode(QTableView.SingleSelection)
+        self.doc_table.horizontalHeader().setSortIndicator(2, Qt.DescendingOrder)  # Ngày tạo mới nhất
         self.doc_table.setSortingEnabled(True)
         self.doc_table.verticalHeader().setVisible(False)
-        self.doc_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.doc_table.setEditTriggers(QTableView.NoEditTriggers)
         self.doc_table.setAlternatingRowColors(True)
-        self.doc_table.itemClicked.connect(self.document_selected)
+        self.doc_table.clicked.connect(self.document_selected)
         self.doc_table.setContextMenuPolicy(Qt.CustomContextMenu)
         self.doc_table.customContextMenuRequested.connect(self.show_document_context_menu)
 
@@ -4366,16 +7600,19 @@ class MainWindow(QMainWindow):
         self.doc_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.ResizeToContents)  # Versions
         self.doc_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.ResizeToContents)  # Number
 
-        # Document Gallery
-        self.doc_gallery = QTableWidget()
+        # Document Gallery (cùng dữ liệu với bảng, thumbnail nạp khi hiển thị)
+        self.gallery_model = DocumentGalleryModel(self)
+        self.gallery_model.setSourceModel(self.doc_model)
+        self.doc_gallery = QListView()
+        self.doc_gallery.setModel(self.gallery_model)
+        self.doc_gallery.setViewMode(QListView.IconMode)
         self.doc_gallery.setIconSize(QSize(150, 200))
-        self.doc_gallery.setColumnCount(4)
-        self.doc_gallery.horizontalHeader().setVisible(False)
-        self.doc_gallery.verticalHeader().setVisible(False)
-        self.doc_gallery.setShowGrid(False)
-        for i in range(4):
-            self.doc_gallery.setColumnWidth(i, 175)
-        self.doc_gallery.itemClicked.connect(self.gallery_item_selected)
+        self.doc_gallery.setGridSize(QSize(175, 280))
+        self.doc_gallery.setResizeMode(QListView.Adjust)
+        self.doc_gallery.setMovement(QListView.Static)
+        self.doc_gallery.setUniformItemSizes(True)
+        self.doc_gallery.setWordWrap(True)
+        self.doc_gallery.clicked.connect(self.gallery_item_selected)
         self.doc_gallery.setContextMenuPolicy(Qt.CustomContextMenu)
         self.doc_gallery.customContextMenuRequested.connect(self.show_gallery_context_menu)
 
@@ -4642,9 +7879,19 @@ class MainWindow(QMainWindow):
         
         check_files_action = QAction("Kiểm tra tệp tin...", self)
         check_files_action.setStatusTip("Kiểm tra và sửa chữa đường dẫn tệp tin")
-        check_files_action.triggered.connect(self.check_file_paths)
+        check_files_action.triggered.connect(lambda: self.check_file_paths(force=True))
         tools_menu.addAction(check_files_action)
         
+        clean_backups_action = QAction("Dọn dẹp bản sao lưu...", self)
+        clean_backups_action.setStatusTip("Xóa bản sao lưu hết hạn và nội dung trùng lặp")
+        clean_backups_action.triggered.connect(self.clean_backups)
+        tools_menu.addAction(clean_backups_action)
+        
+        maintenance_action = QAction("Bảo trì database", self)
+        maintenance_action.setStatusTip("Cập nhật thống kê truy vấn, thu gọn database và WAL")
+        maintenance_action.triggered.connect(lambda: self.start_database_maintenance(analyze=True, show_report=True))
+        tools_menu.addAction(maintenance_action)
+        
         tools_menu.addSeparator()
         
         stats_action = QAction("Thống kê...", self)
@@ -4698,103 +7945,117 @@ class MainWindow(QMainWindow):
         QShortcut(QKeySequence("Ctrl+R"), self, self.pdf_viewer.rotate_right)
         QShortcut(QKeySequence("Ctrl+Shift+R"), self, self.pdf_viewer.rotate_left)
 
-    def convert_word_to_pdf(self, word_path):
-        """Convert Word document to PDF"""
+    def get_converter_service(self):
+        """Lấy dịch vụ chuyển đổi Word, tạo mới ở lần dùng đầu tiên"""
+        if self.converter_service is None:
+            factory = make_default_converter_factory(TEMP_DIR / 'word_converter')
+            self.converter_service = WordConverterService(
+                factory,
+                output_dir=TEMP_DIR,
+                cache_dir=TEMP_DIR / 'word_cache',
+                workers=WORD_CONVERTER_WORKERS
+            )
+        return self.converter_service
+
+    def convert_word_to_pdf(self, word_path, on_finished):
+        """Convert Word document to PDF, gọi on_finished(pdf_path hoặc None) khi xong"""
+        self.convert_word_files([word_path], lambda results: on_finished(results.get(word_path)))
+
+    def convert_word_files(self, word_paths, on_finished):
+        """Chuyển đổi song song nhiều file Word không chặn giao diện
+        
+        Kết quả về qua word_signals; khi cả lô xong gọi on_finished({word_path: pdf_path hoặc None}).
+        """
         try:
-            # Show progress
-            self.statusBar().showMessage(f"Converting {os.path.basename(word_path)} to PDF...", 0)
-            QApplication.processEvents()
-            
-            # Create output PDF path
-            file_base = os.path.splitext(os.path.basename(word_path))[0]
-            pdf_path = str(TEMP_DIR / f"{file_base}_{int(time.time())}.pdf")
-            
-            # Method 1: Using comtypes (Windows)
-            if sys.platform == 'win32':
-                try:
-                    import comtypes.client
-                    
-                    word = comtypes.client.CreateObject('Word.Application')
-                    word.Visible = False
-                    
-                    doc = word.Documents.Open(word_path)
-                    doc.SaveAs(pdf_path, FileFormat=17)  # 17 = PDF format
-                    doc.Close()
-                    word.Quit()
-                    
-                    self.statusBar().showMessage(f"Conversion completed: {os.path.basename(pdf_path)}", 3000)
-                    return pdf_path
-                except ImportError:
-                    logger.warning("comtypes not available, trying alternative method")
-                except Exception as e:
-                    logger.error(f"COM conversion failed: {str(e)}")
-            
-            # Method 2: Using LibreOffice (cross-platform)
-            try:
-                import subprocess
-                # Check if LibreOffice is available
-                if sys.platform == 'win32':
-                    # Windows: Look for LibreOffice in common installation paths
-                    libreoffice_paths = [
-                        r"C:\Program Files\LibreOffice\program\soffice.exe",
-                        r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
-                    ]
-                    soffice = next((path for path in libreoffice_paths if os.path.exists(path)), None)
-                else:
-                    # Linux/Mac: Use command available in PATH
-                    soffice = "soffice"
-                    
-                if soffice:
-                    cmd = [
-                        soffice,
-                        '--headless',
-                        '--convert-to', 'pdf',
-                        '--outdir', str(TEMP_DIR),
-                        word_path
-                    ]
-                    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    output, error = process.communicate()
-                    
-                    if process.returncode == 0:
-                        # LibreOffice places output in the outdir with original name but .pdf extension
-                        converted_path = os.path.join(TEMP_DIR, os.path.splitext(os.path.basename(word_path))[0] + '.pdf')
-                        if os.path.exists(converted_path):
-                            # Rename to our desired path to avoid conflicts
-                            os.rename(converted_path, pdf_path)
-                            self.statusBar().showMessage(f"Conversion completed: {os.path.basename(pdf_path)}", 3000)
-                            return pdf_path
-                    else:
-                        logger.error(f"LibreOffice conversion failed: {error.decode('utf-8')}")
-            except Exception as e:
-                logger.error(f"LibreOffice conversion failed: {str(e)}")
-                
-            # Method 3: Using python-docx2pdf (if available)
-            try:
-                from docx2pdf import convert
-                convert(word_path, pdf_path)
-                if os.path.exists(pdf_path):
-                    self.statusBar().showMessage(f"Conversion completed: {os.path.basename(pdf_path)}", 3000)
-                    return pdf_path
-            except ImportError:
-                logger.warning("docx2pdf not available, trying next method")
-            except Exception as e:
-                logger.error(f"docx2pdf conversion failed: {str(e)}")
-            
-            # If all conversions failed
+            service = self.get_converter_service()
+            self.word_batch_id += 1
+            batch_id = self.word_batch_id
+            futures = {}
+            for path in word_paths:
+                future = service.submit(path)
+                futures[future] = path
+                future.add_done_callback(
+                    lambda done, path=path: self._emit_word_converted(batch_id, path, done))
+        except Exception as e:
+            logger.error(f"Word to PDF conversion error: {str(e)}")
             QMessageBox.critical(
-                self, 
-                "Conversion Failed", 
-                f"Failed to convert {os.path.basename(word_path)} to PDF.\n\n"
+                self,
+                "Conversion Failed",
+                f"{str(e)}\n\n"
                 "Please ensure you have either Microsoft Word, LibreOffice, "
                 "or the docx2pdf Python package installed."
             )
-            self.statusBar().showMessage("Conversion failed", 3000)
-            return None
-            
+            on_finished({path: None for path in word_paths})
+            return
+
+        progress = None
+        if len(futures) > 1:
+            progress = ProgressDialog(len(futures), "Converting Word documents", self)
+            progress.canceled.connect(lambda: self.cancel_word_conversion(batch_id))
+            progress.show()
+        self.statusBar().showMessage(f"Converting {len(futures)} Word file(s) to PDF...", 0)
+        
+        self.word_batches[batch_id] = {
+            'paths': list(word_paths),
+            'futures': futures,
+            'results': {},
+            'progress': progress,
+            'on_finished': on_finished,
+        }
+
+    def _emit_word_converted(self, batch_id, path, future):
+        """Done-callback của Future (chạy trên thread worker), chuyển kết quả qua signal"""
+        if future.cancelled():
+            return
+        try:
+            pdf_path = future.result()
         except Exception as e:
-            logger.error(f"Word to PDF conversion error: {str(e)}")
-            QMessageBox.critical(self, "Conversion Error", str(e))
-            return None
+            logger.error(f"Word to PDF conversion failed for {path}: {str(e)}")
+            pdf_path = ''
+        self.word_signals.finished.emit(batch_id, path, pdf_path)
+
+    def word_file_converted(self, batch_id, path, pdf_path):
+        """Nhận kết quả một file trên luồng giao diện"""
+        batch = self.word_batches.get(batch_id)
+        if batch is None:
+            return  # Lô đã hủy
+        batch['results'][path] = pdf_path or None
+        done = len(batch['results'])
+        if batch['progress']:
+            batch['progress'].update_progress(done, message=f"Converted {done}/{len(batch['futures'])}")
+        if done >= len(batch['futures']):
+            self._finish_word_batch(batch_id)
+
+    def cancel_word_conversion(self, batch_id):
+        """Hủy các file chưa chuyển đổi của lô"""
+        batch = self.word_batches.get(batch_id)
+        if batch is None:
+            return
+        for future in batch['futures']:
+            future.cancel()
+        self._finish_word_batch(batch_id, canceled=True)
+
+    def _finish_word_batch(self, batch_id, canceled=False):
+        batch = self.word_batches.pop(batch_id)
+        results = {path: batch['results'].get(path) for path in batch['paths']}
+        if batch['progress']:
+            batch['progress'].close()
+
+        failed = [os.path.basename(path) for path, pdf in results.items() if not pdf]
+        if canceled:
+            self.statusBar().showMessage("Conversion canceled", 3000)
+        elif failed:
+            QMessageBox.critical(
+                self,
+                "Conversion Failed",
+                f"Failed to convert {', '.join(failed)} to PDF.\n\n"
+                "Please ensure you have either Microsoft Word, LibreOffice, "
+                "or the docx2pdf Python package installed."
+            )
+            self.statusBar().showMessage("Conversion failed", 3000)
+        else:
+            self.statusBar().showMessage(f"Conversion completed: {len(results) - len(failed)} file(s)", 3000)
+        batch['on_finished'](results)
 
     def show_statistics(self):
         """Hiển thị dialog thống kê"""
@@ -4833,13 +8094,12 @@ class MainWindow(QMainWindow):
         statusbar.addPermanentWidget(self.doc_info_label)
     def show_document_context_menu(self, position):
         """Show context menu for document table"""
-        item = self.doc_table.itemAt(position)
-        if item is None:
+        index = self.doc_table.indexAt(position)
+        if not index.isValid():
             return
             
-        row = item.row()
         try:
-            doc_id = int(self.doc_table.item(row, 0).text())
+            doc_id = self.doc_model.document_id(index.row())
             
             context_menu = QMenu(self)
             
@@ -4915,12 +8175,12 @@ class MainWindow(QMainWindow):
 
     def show_gallery_context_menu(self, position):
         """Show context menu for gallery view"""
-        item = self.doc_gallery.itemAt(position)
-        if item is None:
+        index = self.doc_gallery.indexAt(position)
+        if not index.isValid():
             return
             
         # Get document ID from item data
-        doc_id = item.data(Qt.UserRole)
+        doc_id = index.data(Qt.UserRole)
         if not doc_id:
             return
             
@@ -5096,15 +8356,17 @@ class MainWindow(QMainWindow):
         if file_path:
             # Check if file is Word document
             if file_path.lower().endswith(('.doc', '.docx')):
-                pdf_path = self.convert_word_to_pdf(file_path)
-                if not pdf_path:
-                    return
+                self.convert_word_to_pdf(file_path, self.preview_and_process_file)
             else:
-                pdf_path = file_path
-                
-            preview = PreviewDialog(pdf_path, self)
-            if preview.exec_() == QDialog.Accepted:
-                self.process_file(pdf_path)
+                self.preview_and_process_file(file_path)
+
+    def preview_and_process_file(self, pdf_path):
+        """Xem trước rồi xử lý một file PDF (bỏ qua nếu chuyển đổi thất bại)"""
+        if not pdf_path:
+            return
+        preview = PreviewDialog(pdf_path, self)
+        if preview.exec_() == QDialog.Accepted:
+            self.process_file(pdf_path)
 
     def add_files(self):
         """Add multiple document files"""
@@ -5113,18 +8375,25 @@ class MainWindow(QMainWindow):
             "Document Files (*.pdf *.doc *.docx);;PDF Files (*.pdf);;Word Files (*.doc *.docx)"
         )
         if file_paths:
-            # Convert Word documents to PDF first
-            pdf_paths = []
-            for file_path in file_paths:
-                if file_path.lower().endswith(('.doc', '.docx')):
-                    pdf_path = self.convert_word_to_pdf(file_path)
-                    if pdf_path:
-                        pdf_paths.append(pdf_path)
-                else:
-                    pdf_paths.append(file_path)
-                    
-            if pdf_paths:
-                self.process_files(pdf_paths)
+            # Convert Word documents to PDF first (song song qua dịch vụ chuyển đổi)
+            word_paths = [path for path in file_paths if path.lower().endswith(('.doc', '.docx'))]
+            if word_paths:
+                self.convert_word_files(word_paths, lambda converted: self.process_added_files(file_paths, converted))
+            else:
+                self.process_added_files(file_paths, {})
+
+    def process_added_files(self, file_paths, converted):
+        """Xử lý các file đã chọn, thay file Word bằng PDF đã chuyển đổi (bỏ file lỗi)"""
+        pdf_paths = []
+        for file_path in file_paths:
+            if file_path in converted:
+                if converted[file_path]:
+                    pdf_paths.append(converted[file_path])
+            else:
+                pdf_paths.append(file_path)
+                
+        if pdf_paths:
+            self.process_files(pdf_paths)
 
     def is_converted_pdf(self, pdf_path):
         """Check if a PDF was converted from Word (exists in temp folder)"""
@@ -5137,9 +8406,10 @@ class MainWindow(QMainWindow):
         progress.setWindowModality(Qt.ApplicationModal)
         
         self.ocr_worker = OCRWorker(self.ocr_system, file_path)
+        worker = self.ocr_worker
         self.ocr_worker.progress.connect(progress.update_progress)
         self.ocr_worker.finished.connect(lambda results, detections: 
-                                      self.ocr_completed(file_path, results, detections))
+                                      self.ocr_completed(file_path, results, detections, worker.metrics))
         self.ocr_worker.error.connect(self.show_error)
         
         # Connect cancel signal
@@ -5180,7 +8450,7 @@ class MainWindow(QMainWindow):
             if self.batch_worker.isRunning():
                 self.batch_worker.terminate()
 
-    def ocr_completed(self, file_path, results, detections):
+    def ocr_completed(self, file_path, results, detections, metrics=None):
         """Handle completion of OCR process for a single file"""
         try:
             # Kiểm tra xem file có phải là file tạm
@@ -5194,13 +8464,10 @@ class MainWindow(QMainWindow):
                 shutil.copy2(file_path, permanent_file_path)
                 logger.info(f"Created permanent copy: {permanent_file_path}")
             
-            # Add document to database với đường dẫn vĩnh viễn
-            doc_id = self.db.add_document(permanent_file_path, results)
-            
-            # Add detections for each page
-            for page_num, page_detections in detections:
-                if page_detections:
-                    self.db.add_page_detections(doc_id, page_num, page_detections)
+            # Add document, detections và metrics trong một transaction (đường dẫn vĩnh viễn)
+            doc_id = self.db.add_documents_bulk(
+                [self.document_bulk_item(permanent_file_path, results, detections, metrics)]
+            )[0]
             
             # Refresh document list and show the new document
             self.load_documents()
@@ -5227,44 +8494,60 @@ class MainWindow(QMainWindow):
             logger.error(f"Error in OCR completion: {str(e)}")
             QMessageBox.critical(self, "Error", f"Error saving results: {str(e)}")
 
+    @staticmethod
+    def document_bulk_item(file_path, results, detections, metrics=None):
+        """Item cho DocumentDatabase.add_documents_bulk từ kết quả OCR của một file"""
+        pages = []
+        for page_num, page_detections, page_info in detections:
+            page_transform = page_info.get('transform')
+            page_text = page_info.get('page_text')
+            if page_detections or page_text or not DocumentOCR.is_identity_transform(page_transform):
+                pages.append((page_num, page_detections, page_text, page_transform))
+        return {'file_path': file_path, 'ocr_results': results, 'pages': pages, 'recorder': metrics}
+
     def batch_completed(self, results):
         """Handle completion of batch OCR process"""
         try:
-            num_processed = 0
-            for file_path, result, detections in results:
+            items = []
+            temp_files = []
+            for file_path, result, detections, metrics in results:
                 try:
-                    # Kiểm tra xem file có phải là file tạm
-                    is_temp_file = self.is_converted_pdf(file_path)
-                    
                     # Nếu là file tạm, tạo bản sao vĩnh viễn
-                    if is_temp_file:
+                    if self.is_converted_pdf(file_path):
                         perm_filename = f"{Path(file_path).stem}_perm_{int(time.time())}.pdf"
                         permanent_file_path = str(OUTPUT_DIR / perm_filename)
                         shutil.copy2(file_path, permanent_file_path)
                         logger.info(f"Created permanent copy: {permanent_file_path}")
+                        temp_files.append(file_path)
                         file_path = permanent_file_path
                     
-                    # Add document to database
-                    doc_id = self.db.add_document(file_path, result)
-                    
-                    # Add detections for each page
-                    for page_num, page_detections in detections:
-                        if page_detections:
-                            self.db.add_page_detections(doc_id, page_num, page_detections)
-                    
-                    num_processed += 1
-                    
-                    # Clean up temporary converted PDF if needed
-                    if is_temp_file and os.path.exists(file_path):
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"Removed temporary PDF: {file_path}")
-                        except Exception as e:
-                            logger.warning(f"Could not remove temporary PDF: {str(e)}")
+                    items.append(self.document_bulk_item(file_path, result, detections, metrics))
                     
                 except Exception as e:
                     logger.error(f"Error processing {file_path}: {str(e)}")
             
+            # Toàn bộ lô ghi trong một transaction; lỗi thì ghi lại từng file để không mất cả lô
+            try:
+                num_processed = len(set(self.db.add_documents_bulk(items))) if items else 0
+            except Exception as e:
+                logger.error(f"Bulk insert failed, retrying per file: {str(e)}")
+                num_processed = 0
+                for item in items:
+                    try:
+                        self.db.add_documents_bulk([item])
+                        num_processed += 1
+                    except Exception as e:
+                        logger.error(f"Error processing {item['file_path']}: {str(e)}")
+            
+            # Clean up temporary converted PDFs
+            for temp_file in temp_files:
+                try:
+                    if os.path.exists(temp_file):
+                        os.remove(temp_file)
+                        logger.info(f"Removed temporary PDF: {temp_file}")
+                except Exception as e:
+                    logger.warning(f"Could not remove temporary PDF: {str(e)}")
+            
             # Refresh document list
             self.load_documents()
             
@@ -5286,141 +8569,21 @@ class MainWindow(QMainWindow):
         QMessageBox.critical(self, "Error", f"An error occurred: {error_msg}")
 
     def load_documents(self):
-        """Load all documents from database"""
+        """Load documents from database (trang đầu, phần còn lại nạp khi cuộn)"""
         try:
-            documents = self.db.get_all_documents()
-            self.update_document_table(documents)
-            self.update_document_gallery(documents)
+            self.doc_model.reset_query()
+            self.gallery_model.icons.clear()
             
             # Update document count
-            doc_count = len(documents)
-            self.doc_count_label.setText(f"Documents: {doc_count}")
+            self.doc_count_label.setText(f"Documents: {self.doc_model.total}")
             
         except Exception as e:
             logger.error(f"Error loading documents: {str(e)}")
             QMessageBox.critical(self, "Error", f"Error loading documents: {str(e)}")
 
-    def update_document_table(self, documents):
-        """Update document table with data"""
-        self.doc_table.setSortingEnabled(False)
-        self.doc_table.setRowCount(len(documents))
-        
-        for row, doc in enumerate(documents):
-            # ID
-            id_item = QTableWidgetItem(str(doc[0]))
-            id_item.setData(Qt.UserRole, doc[0])  # Store ID for reference
-            self.doc_table.setItem(row, 0, id_item)
-            
-            # Filename
-            filename_item = QTableWidgetItem(doc[2])
-            filename_item.setToolTip(doc[1])  # Full path as tooltip
-            self.doc_table.setItem(row, 1, filename_item)
-            
-            # Date created
-            date_item = QTableWidgetItem(str(doc[3]))
-            self.doc_table.setItem(row, 2, date_item)
-            
-            # Version count
-            version_item = QTableWidgetItem(str(doc[5]))
-            version_item.setTextAlignment(Qt.AlignCenter)
-            self.doc_table.setItem(row, 3, version_item)
-            
-            # Document number
-            number_item = QTableWidgetItem(str(doc[8] or ""))
-            self.doc_table.setItem(row, 4, number_item)
-            
-            # Document urgency
-            urgency_text = doc[10] or "Không"
-            urgency_item = QTableWidgetItem(urgency_text)
-            urgency_item.setTextAlignment(Qt.AlignCenter)
-            
-            # Color code urgency
-            if urgency_text == "Độ Mật":
-                urgency_item.setBackground(QColor(255, 200, 200))  # Light red
-            elif urgency_text == "Hỏa Tốc":
-                urgency_item.setBackground(QColor(255, 140, 0))  # Orange
-                urgency_item.setForeground(QColor(255, 255, 255))  # White text
-                
-            self.doc_table.setItem(row, 5, urgency_item)
-            
-            # Page count
-            page_count_item = QTableWidgetItem(str(doc[4] or ""))
-            page_count_item.setTextAlignment(Qt.AlignCenter)
-            self.doc_table.setItem(row, 6, page_count_item)
-            
-        self.doc_table.setSortingEnabled(True)
-    def update_document_gallery(self, documents):
-        """Update document gallery with thumbnails"""
-        self.doc_gallery.clear()
-        
-        # Calculate number of rows needed (with 4 columns)
-        num_rows = (len(documents) + 3) // 4
-        self.doc_gallery.setRowCount(num_rows)
-        
-        # Add documents to gallery
-        for i, doc in enumerate(documents):
-            # Calculate row and column
-            row = i // 4
-            col = i % 4
-            
-            # Create thumbnail item
-            item = QTableWidgetItem()
-            item.setData(Qt.UserRole, doc[0])  # Store document ID
-            
-            # Set item text (document info)
-            doc_info = f"{doc[2]}\nID: {doc[0]}"
-            if doc[8]:  # So ky hieu
-                doc_info += f"\n{doc[8]}"
-            if doc[10]:  # Do khan
-                doc_info += f"\n{doc[10]}"
-                
-            item.setText(doc_info)
-            item.setTextAlignment(Qt.AlignCenter)
-            
-            # Load thumbnail if available or generate
-            self.load_thumbnail_for_item(item, doc[1], doc[0])
-            
-            # Set item size
-            self.doc_gallery.setItem(row, col, item)
-            self.doc_gallery.setRowHeight(row, 200)
-            
-    def load_thumbnail_for_item(self, item, file_path, doc_id):
-        """Load or generate thumbnail for gallery item"""
-        # Check for cached thumbnail
-        thumb_path = IMAGES_DIR / f"thumb_{doc_id}.jpg"
-        
-        if os.path.exists(thumb_path):
-            # Load existing thumbnail
-            pixmap = QPixmap(str(thumb_path))
-            item.setIcon(QIcon(pixmap))
-            return
-            
-        # Generate thumbnail if file exists
-        if os.path.exists(file_path):
-            try:
-                # Open first page of PDF
-                with fitz.open(file_path) as pdf:
-                    if len(pdf) > 0:
-                        page = pdf[0]
-                        # Render page to pixmap
-                        pix = page.get_pixmap(matrix=fitz.Matrix(0.2, 0.2))
-                        
-                        # Convert to QImage and save thumbnail
-                        img = QImage(pix.samples, pix.width, pix.height, pix.stride, QImage.Format_RGB888)
-                        img.save(str(thumb_path), "JPG")
-                        
-                        # Set item icon
-                        item.setIcon(QIcon(QPixmap.fromImage(img)))
-                        return
-            except Exception as e:
-                logger.error(f"Error generating thumbnail: {str(e)}")
-                
-        # Use default icon if thumbnail generation failed
-        item.setIcon(QIcon.fromTheme("application-pdf"))
-
-    def gallery_item_selected(self, item):
+    def gallery_item_selected(self, index):
         """Handle selection in gallery view"""
-        doc_id = item.data(Qt.UserRole)
+        doc_id = index.data(Qt.UserRole)
         if doc_id:
             self.show_document(doc_id)
 
@@ -5436,6 +8599,9 @@ class MainWindow(QMainWindow):
                 return
                     
             # Store current document ID
+            if doc_id != self.current_doc_id:
+                self.page_transforms = {}
+                self.corrected_pages = {}
             self.current_doc_id = doc_id  # Đảm bảo lưu đúng ID hiện tại
             
             # Load document content in editor FIRST
@@ -5450,9 +8616,11 @@ class MainWindow(QMainWindow):
             # Update metadata display
             self.update_metadata_display(doc_info, doc_version)
             
-            # Load PDF file
+            # Load PDF file (giữ trang đã render nếu file không đổi)
             pdf_path = doc_info[1]
-            if os.path.exists(pdf_path):
+            if self.pdf_viewer.is_loaded(pdf_path):
+                self.load_page_detections(doc_id, self.pdf_viewer.current_page)
+            elif os.path.exists(pdf_path):
                 if self.pdf_viewer.load_pdf(pdf_path):
                     self.load_page_detections(doc_id, self.pdf_viewer.current_page)
                 else:
@@ -5476,24 +8644,36 @@ class MainWindow(QMainWindow):
             return
             
         try:
-            detections = self.db.get_document_detections(doc_id, page_num)
-            
-            if isinstance(detections, list):  # Ensure detections is a list
-                boxes = []
-                for d in detections:
-                    if isinstance(d, dict) and 'box' in d:
-                        box = d.get('box', [])
-                        if len(box) >= 4:
-                            boxes.append(box)
-                
-                self.pdf_viewer.set_detection_boxes(boxes)
-            else:
-                self.pdf_viewer.set_detection_boxes([])
+            # Chỉ đọc mảng box từ blob, không giải mã text
+            boxes = self.db.get_detection_boxes(doc_id, page_num)
+            page_transform = self.get_page_transform(doc_id, page_num)
+            self.pdf_viewer.set_detection_boxes(boxes, page_transform)
                 
         except Exception as e:
             print(f"Error loading page detections: {str(e)}")  
             self.pdf_viewer.set_detection_boxes([])
 
+    def get_page_transform(self, doc_id, page_num):
+        """Lấy transform hướng/độ nghiêng của trang (có cache)"""
+        key = (doc_id, page_num)
+        if key not in self.page_transforms:
+            self.page_transforms[key] = self.db.get_page_transform(doc_id, page_num)
+        return self.page_transforms[key]
+
+    def get_corrected_page(self, page_num, page_image):
+        """Ảnh trang đã hiệu chỉnh theo transform lưu khi OCR, cùng tỷ lệ với viewer"""
+        page_transform = self.get_page_transform(self.current_doc_id, page_num)
+        if DocumentOCR.is_identity_transform(page_transform):
+            return page_image, None
+        
+        factor = (self.pdf_viewer.dpi / 72.0) / page_transform.get('render_scale', OCR_RENDER_SCALE)
+        view_transform = DocumentOCR.scale_page_transform(page_transform, factor)
+        
+        key = (self.current_doc_id, page_num)
+        if key not in self.corrected_pages:
+            self.corrected_pages[key] = DocumentOCR.apply_page_transform(page_image, view_transform)
+        return self.corrected_pages[key], view_transform
+
     def update_metadata_display(self, doc_info, doc_version):
         """Update metadata information display"""
         try:
@@ -5523,16 +8703,7 @@ class MainWindow(QMainWindow):
                             
                             # Cập nhật page_count vào DB
                             if self.current_doc_id:
-                                try:
-                                    conn = self.db.conn_pool.get_connection()
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        'UPDATE documents SET page_count = ? WHERE id = ?',
-                                        (page_count, self.current_doc_id)
-                                    )
-                                    conn.commit()
-                                except Exception as e:
-                                    logger.error(f"Error updating page count: {str(e)}")
+                                self.db.set_page_count(self.current_doc_id, page_count)
                     except:
                         self.metadata_fields['pages'].setText("1")
                 else:
@@ -5584,11 +8755,10 @@ class MainWindow(QMainWindow):
         else:
             self.doc_info_label.setText("")
 
-    def document_selected(self, item):
+    def document_selected(self, index):
         """Handle document selection in table"""
         try:
-            row = item.row()
-            doc_id = int(self.doc_table.item(row, 0).text())
+            doc_id = self.doc_model.document_id(index.row())
             self.show_document(doc_id)
         except Exception as e:
             logger.error(f"Error selecting document: {str(e)}")
@@ -5634,19 +8804,10 @@ class MainWindow(QMainWindow):
             if doc_id != self.current_doc_id:
                 raise ValueError(f"Document ID mismatch: trying to update {doc_id} but current document is {self.current_doc_id}")
                 
-            # Create new version
+            # Create new version (document_changed cập nhật danh sách và editor)
             new_version = self.db.create_new_version(doc_id, updates)
             
             if new_version:
-                # Refresh document list
-                self.load_documents()
-                
-                # Reload the same document
-                self.show_document(doc_id)
-                
-                # Update suggestions
-                self.ocr_editor.update_suggestions(self.db)
-                
                 self.statusBar().showMessage(f"Document {doc_id} updated successfully", 5000)
             else:
                 raise Exception("Failed to create new version")
@@ -5655,6 +8816,30 @@ class MainWindow(QMainWindow):
             logger.error(f"Error updating document: {str(e)}")
             QMessageBox.critical(self, "Error", f"Error updating document: {str(e)}")
 
+    def document_changed(self, doc_id, version_number):
+        """Cập nhật giao diện sau khi văn bản có phiên bản mới (không tải lại toàn bộ)"""
+        try:
+            self.doc_model.refresh_document(doc_id)
+            
+            if doc_id != self.current_doc_id:
+                return
+                
+            doc_version = self.db.get_latest_version(doc_id)
+            doc_info = self.db.get_document_info(doc_id)
+            if not doc_version or not doc_info:
+                return
+                
+            # Không ghi đè nội dung người dùng đang sửa dở
+            if not self.ocr_editor.save_btn.isEnabled():
+                self.ocr_editor.load_data(doc_version)
+                self.ocr_editor.doc_id = doc_id
+                
+            self.update_version_list(self.db.get_document_versions(doc_id))
+            self.update_metadata_display(doc_info, doc_version)
+            
+        except Exception as e:
+            logger.error(f"Error refreshing changed document: {str(e)}")
+
     def field_value_changed(self, field_name, new_value):
         """Handle field value change for real-time updates"""
         # This can be used for real-time validation or UI updates
@@ -5678,12 +8863,11 @@ class MainWindow(QMainWindow):
         db_search_type = type_mapping.get(search_type, "all")
         
         try:
-            documents = self.db.search_documents(query, db_search_type)
-            self.update_document_table(documents)
-            self.update_document_gallery(documents)
+            filter_criteria, sort_by = self.db.search_filter_criteria(query, db_search_type)
+            self.doc_model.reset_query(filter_criteria, sort_by=sort_by, sort_desc=True)
             
             self.statusBar().showMessage(
-                f"Tìm thấy {len(documents)} tài liệu phù hợp với '{query}'", 5000
+                f"Tìm thấy {self.doc_model.total} tài liệu phù hợp với '{query}'", 5000
             )
             
         except Exception as e:
@@ -5731,6 +8915,73 @@ class MainWindow(QMainWindow):
             logger.error(f"Export error: {str(e)}")
             QMessageBox.critical(self, "Error", f"Export failed: {str(e)}")
 
+    def clean_backups(self):
+        """Áp dụng chính sách giữ bản sao lưu rồi dọn kho, báo dung lượng giải phóng"""
+        reply = QMessageBox.question(
+            self, "Dọn dẹp bản sao lưu",
+            f"Xóa các bản sao lưu cũ hơn {BACKUP_RETENTION_DAYS} ngày "
+            f"(luôn giữ {BACKUP_KEEP_PER_DOCUMENT} bản mới nhất mỗi văn bản) và các file trùng lặp?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+            
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            expired = self.db.apply_backup_retention()
+            report = self.db.collect_backup_garbage()
+        finally:
+            QApplication.restoreOverrideCursor()
+            
+        QMessageBox.information(
+            self, "Dọn dẹp bản sao lưu",
+            f"Bản ghi hết hạn: {expired}\n"
+            f"Bản sao lưu cũ đã đưa vào kho: {report['legacy_imported']}\n"
+            f"File đã xóa: {report['blobs_removed']}\n"
+            f"Dung lượng giải phóng: {report['bytes_reclaimed'] / (1024 * 1024):.1f} MB"
+        )
+
+    def maintenance_if_idle(self):
+        """Chạy bảo trì tự động nếu đã đến hạn và ứng dụng đang rảnh"""
+        if time.time() - self.last_maintenance < DB_MAINTENANCE_INTERVAL:
+            return
+        workers = (self.ocr_worker, self.batch_worker, self.repair_worker, self.verify_worker,
+                   self.db_backup_worker, self.maintenance_worker)
+        if any(worker and worker.isRunning() for worker in workers):
+            return
+        if self.db.writer.idle_seconds() < DB_MAINTENANCE_IDLE_SECONDS:
+            return
+        self.start_database_maintenance()
+
+    def start_database_maintenance(self, analyze=None, show_report=False):
+        """Chạy DatabaseMaintenanceWorker trong nền"""
+        if self.maintenance_worker and self.maintenance_worker.isRunning():
+            return
+            
+        self.last_maintenance = time.time()
+        self.maintenance_worker = DatabaseMaintenanceWorker(self.db, analyze)
+        self.maintenance_worker.finished.connect(
+            lambda report: self.database_maintenance_completed(report, show_report)
+        )
+        self.maintenance_worker.error.connect(self.show_error)
+        self.statusBar().showMessage("Đang bảo trì database...", 0)
+        self.maintenance_worker.start()
+
+    def database_maintenance_completed(self, report, show_report=False):
+        """Kết quả bảo trì database"""
+        reclaimed_mb = report['bytes_reclaimed'] / (1024 * 1024)
+        self.statusBar().showMessage(f"Bảo trì database xong, giải phóng {reclaimed_mb:.1f} MB", 5000)
+        if show_report:
+            before, after = report['before'], report['after']
+            QMessageBox.information(
+                self, "Bảo trì database",
+                f"Database: {before['db_bytes'] / (1024 * 1024):.1f} MB -> {after['db_bytes'] / (1024 * 1024):.1f} MB\n"
+                f"WAL: {before['wal_bytes'] / (1024 * 1024):.1f} MB -> {after['wal_bytes'] / (1024 * 1024):.1f} MB\n"
+                f"Trang trống: {before['free_pages']} -> {after['free_pages']}\n"
+                f"Thời gian: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in report['steps_ms'].items())
+            )
+
     def backup_database(self):
         """Create backup of the database"""
         try:
@@ -5745,25 +8996,48 @@ class MainWindow(QMainWindow):
                 if not backup_path.endswith('.db'):
                     backup_path += '.db'
                 
-                # Close database connections
-                self.db.close()
-                
-                # Copy database file
-                shutil.copy2(self.db.db_path, backup_path)
-                
-                # Reconnect
-                self.db = DocumentDatabase()
-                
-                QMessageBox.information(
-                    self, 
-                    "Backup Complete", 
-                    f"Database backed up to:\n{backup_path}"
-                )
+                self.start_database_backup(backup_path)
                 
         except Exception as e:
             logger.error(f"Database backup error: {str(e)}")
             QMessageBox.critical(self, "Backup Error", f"Database backup failed: {str(e)}")
 
+    def scheduled_database_backup(self):
+        """Sao lưu tự động theo lịch (DB_BACKUP_INTERVAL), không hỏi người dùng"""
+        self.start_database_backup(None)
+
+    def start_database_backup(self, backup_path):
+        """Chạy DatabaseBackupWorker trong nền, người dùng vẫn làm việc bình thường"""
+        if self.db_backup_worker and self.db_backup_worker.isRunning():
+            if backup_path:
+                QMessageBox.information(self, "Backup Database", "A database backup is already running")
+            return
+            
+        self.db_backup_worker = DatabaseBackupWorker(self.db, backup_path)
+        self.db_backup_worker.progress.connect(
+            lambda done, total, message: self.statusBar().showMessage(message, 2000)
+        )
+        if backup_path:
+            self.db_backup_worker.finished.connect(self.database_backup_completed)
+            self.db_backup_worker.error.connect(
+                lambda message: QMessageBox.critical(self, "Backup Error", f"Database backup failed: {message}")
+            )
+        else:
+            self.db_backup_worker.finished.connect(
+                lambda path: path and self.statusBar().showMessage(f"Database backed up to {path}", 5000)
+            )
+        self.db_backup_worker.start()
+
+    def database_backup_completed(self, backup_path):
+        """Kết quả sao lưu do người dùng yêu cầu"""
+        if backup_path:
+            self.statusBar().showMessage("Database backup completed", 3000)
+            QMessageBox.information(
+                self, 
+                "Backup Complete", 
+                f"Database backed up to:\n{backup_path}"
+            )
+
     def toggle_preview(self):
         """Toggle PDF preview for currently selected document"""
         if not self.current_doc_id:
@@ -5926,6 +9200,17 @@ class MainWindow(QMainWindow):
                 event.ignore()
                 return
         
+        # Dừng kiểm tra tệp trước khi đóng database (worker đang ghi file_status)
+        if self.verify_worker and self.verify_worker.isRunning():
+            self.verify_worker.cancel()
+            self.verify_worker.wait(3000)
+        if self.db_backup_worker and self.db_backup_worker.isRunning():
+            self.db_backup_worker.cancel()
+            self.db_backup_worker.wait(3000)
+        if self.maintenance_worker and self.maintenance_worker.isRunning():
+            self.maintenance_worker.cancel()
+            self.maintenance_worker.wait(3000)
+        
         # Close database connections
         self.db.close()
         
@@ -5941,20 +9226,21 @@ class MainWindow(QMainWindow):
         if self.repair_worker and self.repair_worker.isRunning():
             self.repair_worker.cancel()
             self.repair_worker.wait(1000)
+        
+        # Bỏ các job OCR vùng tự vẽ chưa chạy
+        self.custom_box_pool.clear()
+        self.custom_box_pool.waitForDone(1000)
+        
+        # Dừng các converter Word đang giữ
+        if self.converter_service:
+            self.converter_service.shutdown(wait=False)
             
         # Accept close event
         event.accept()
 
     def process_custom_box(self, rect, class_id):
-        """Xử lý OCR cho box tùy chỉnh vừa được tạo"""
+        """Xử lý OCR cho box tùy chỉnh vừa được tạo (chạy nền trên QThreadPool)"""
         try:
-            from PIL import Image  # Import sớm để tránh lỗi tham chiếu trước khi gán
-            import numpy as np
-            
-            # Hiển thị thông báo đang xử lý
-            self.statusBar().showMessage("Đang xử lý OCR cho vùng được chọn...", 2000)
-            QApplication.processEvents()  # Cho phép UI cập nhật
-            
             # Lấy thông tin trang hiện tại
             if not self.pdf_viewer.pages or self.pdf_viewer.current_page >= len(self.pdf_viewer.pages):
                 return
@@ -6008,234 +9294,102 @@ class MainWindow(QMainWindow):
                 margin_left = 10
                 margin_right = 10
             
-            # Thêm thông tin debug
-            print(f"Vùng cắt gốc: x={x}, y={y}, w={w}, h={h}, img_size={img_width}x{img_height}")
-            
-            # Tạo thư mục debug
-            debug_dir = TEMP_DIR / "debug"
-            debug_dir.mkdir(exist_ok=True)
-            timestamp = int(time.time())
-            
-            # Lưu ảnh gốc để debug
-            debug_orig_path = debug_dir / f"original_full_page_{timestamp}.png"
-            current_pil_image.save(str(debug_orig_path))
-            print(f"Đã lưu ảnh trang gốc tại: {debug_orig_path}")
-            
-            # Vẽ rect lên ảnh gốc để kiểm tra
-            debug_img = current_pil_image.copy()
-            draw = ImageDraw.Draw(debug_img)
-            draw.rectangle((x, y, x + w, y + h), outline="red", width=3)
-            debug_rect_path = debug_dir / f"original_with_rect_{class_id}_{timestamp}.png"
-            debug_img.save(str(debug_rect_path))
-            print(f"Đã lưu ảnh có khung tại: {debug_rect_path}")
-            
             # Cắt vùng ảnh với margin để đảm bảo không cắt mất chữ
             x_with_margin = max(0, x - margin_left)
             y_with_margin = max(0, y - margin_top)
             w_with_margin = min(w + margin_left + margin_right, img_width - x_with_margin)
             h_with_margin = min(h + margin_top + margin_bottom, img_height - y_with_margin)
             
-            # Lưu tọa độ cắt để debug
             crop_coords = (x_with_margin, y_with_margin, x_with_margin + w_with_margin, y_with_margin + h_with_margin)
-            print(f"Tọa độ cắt sau khi thêm margin: {crop_coords}")
+            debug_info = (current_pil_image, (x, y, x + w, y + h), crop_coords)
             
-            # Vẽ rect với margin lên ảnh gốc để kiểm tra
-            debug_img_margin = current_pil_image.copy()
-            draw_margin = ImageDraw.Draw(debug_img_margin)
-            draw_margin.rectangle(crop_coords, outline="blue", width=3)
-            debug_rect_margin_path = debug_dir / f"original_with_margin_rect_{class_id}_{timestamp}.png"
-            debug_img_margin.save(str(debug_rect_margin_path))
-            print(f"Đã lưu ảnh có khung margin tại: {debug_rect_margin_path}")
-            
-            # Cắt vùng ảnh
-            region = current_pil_image.crop(crop_coords)
-            
-            # Lưu ảnh vùng cắt để debug
-            debug_dir = TEMP_DIR / "debug"
-            debug_dir.mkdir(exist_ok=True)
-            timestamp = int(time.time())
-            debug_path = debug_dir / f"region_class_{class_id}_{timestamp}.png"
-            region.save(str(debug_path))
-            print(f"Đã lưu ảnh debug tại: {debug_path}")
+            # Dùng trang đã hiệu chỉnh hướng/độ nghiêng (tính một lần khi OCR) nếu người dùng không tự xoay
+            page_image = current_pil_image
+            if self.pdf_viewer.rotation == 0 and self.current_doc_id:
+                page_image, view_transform = self.get_corrected_page(
+                    self.pdf_viewer.current_page, current_pil_image
+                )
+                if view_transform:
+                    mx1, my1, mx2, my2 = DocumentOCR.map_box(crop_coords, view_transform['matrix'])
+                    page_w, page_h = page_image.size
+                    crop_coords = (max(0, int(mx1)), max(0, int(my1)),
+                                   min(page_w, int(round(mx2))), min(page_h, int(round(my2))))
+            region = page_image.crop(crop_coords)
             
             # Kiểm tra kích thước ảnh cắt
             if region.size[0] < 10 or region.size[1] < 10:
                 QMessageBox.warning(self, "Cảnh báo", "Vùng được chọn quá nhỏ để OCR. Vui lòng vẽ lại vùng lớn hơn.")
                 return
             
-            # Thực hiện OCR với class_id đã chọn
-            class_names = {
-                0: 'CQBH', 1: 'Chu_Ky', 2: 'Chuc_Vu', 3: 'Do_Khan',
-                4: 'Loai_VB', 5: 'ND_Chinh', 6: 'Ngay_BH', 7: 'Noi_Nhan', 8: 'So_Ki_Hieu'
-            }
-            class_name = class_names.get(class_id, '')
-            
-            # Thử cả hai phương pháp OCR, ưu tiên kết quả tốt hơn
-            final_text = ""
-            
-            # 1. Thử với EasyOCR trước
-            easyocr_success = False
-            try:
-                # Tiền xử lý ảnh tối ưu cho loại class
-                processed_region = self.ocr_system.preprocess_image_for_document(region, class_id)
-                
-                # Tạo PIL Image từ mảng đã xử lý nếu cần
-                if not isinstance(processed_region, Image.Image):
-                    processed_region = Image.fromarray(processed_region)
-                
-                # Lưu ảnh đã xử lý để debug
-                processed_path = debug_dir / f"processed_class_{class_id}_{timestamp}.png"
-                processed_region.save(str(processed_path))
-                print(f"Đã lưu ảnh đã xử lý tại: {processed_path}")
-                
-                # Khởi tạo EasyOCR nếu chưa có
-                if not hasattr(self.ocr_system, 'ocr_reader') or self.ocr_system.ocr_reader is None:
-                    import easyocr
-                    self.ocr_system.ocr_reader = easyocr.Reader(['vi'], gpu=False)
-                
-                # Chuẩn bị ngôn ngữ OCR
-                languages = ['vi']
-                if class_id in [7, 8, 4]:  # Noi_Nhan, So_Ki_Hieu, Loai_VB
-                    languages = ['vi', 'en']
-                
-                # Thực hiện OCR
-                img_array = np.array(processed_region)
-                
-                # Xử lý đặc biệt cho Noi_Nhan
-                if class_id == 7:  # Noi_Nhan
-                    # Thử với paragraph mode trước
-                    results = self.ocr_system.ocr_reader.readtext(img_array, paragraph=True)
-                    
-                    # Nếu không có kết quả hoặc kết quả quá ngắn, thử lại với paragraph=False
-                    if not results or len(results) == 0 or len("\n".join([r[1] for r in results])) < 10:
-                        results = self.ocr_system.ocr_reader.readtext(img_array, paragraph=False)
-                else:
-                    results = self.ocr_system.ocr_reader.readtext(img_array)
-                
-                # Xử lý kết quả
-                if results:
-                    # Trích xuất text từ kết quả
-                    if class_id == 7:  # Noi_Nhan - xử lý đặc biệt
-                        # Sắp xếp kết quả theo tọa độ y (từ trên xuống dưới)
-                        sorted_results = sorted(results, key=lambda r: (r[0][0][1] + r[0][2][1])/2)
-                        easy_ocr_text = "\n".join([r[1] for r in sorted_results])
-                    else:
-                        easy_ocr_text = "\n".join([r[1] for r in results])
-                    
-                    final_text = easy_ocr_text
-                    easyocr_success = len(final_text) > 0
-            except Exception as e:
-                print(f"Lỗi EasyOCR: {str(e)}")
-            
-            # 2. Thử với Tesseract nếu EasyOCR không cho kết quả tốt
-            tesseract_text = ""
-            if not easyocr_success or len(final_text) < 10:
-                tesseract_installed = True
-                try:
-                    import pytesseract
-                    pytesseract.get_tesseract_version()
-                except (ImportError, Exception):
-                    tesseract_installed = False
-                    print("Tesseract không được cài đặt hoặc không tìm thấy trong PATH")
-                
-                if tesseract_installed:
-                    try:
-                        # Xử lý ảnh đặc biệt cho Tesseract
-                        from PIL import ImageEnhance
-                        
-                        # Chuyển sang ảnh xám
-                        gray_img = region.convert('L')
-                        
-                        # Tăng độ tương phản
-                        enhancer = ImageEnhance.Contrast(gray_img)
-                        enhanced_img = enhancer.enhance(2.0)
-                        
-                        # Lưu ảnh tăng cường
-                        enhanced_path = debug_dir / f"tesseract_enhanced_{class_id}_{timestamp}.png"
-                        enhanced_img.save(str(enhanced_path))
-                        
-                        img_array = np.array(enhanced_img)
-                        
-                        # Thử các PSM khác nhau dựa trên loại vùng
-                        if class_id == 7:  # Noi_Nhan
-                            custom_config = '--oem 1 --psm 6 -l vie'  # PSM 6 cho block text
-                        elif class_id == 5:  # ND_Chinh
-                            custom_config = '--oem 1 --psm 6 -l vie'  # PSM 6 cho block text
-                        else:
-                            custom_config = '--oem 1 --psm 4 -l vie'  # PSM 4 cho single column
-                        
-                        # Thực hiện OCR
-                        tesseract_text = pytesseract.image_to_string(img_array, config=custom_config)
-                        
-                        # Nếu kết quả tesseract dài hơn, dùng kết quả của tesseract
-                        if not final_text or len(tesseract_text.strip()) > len(final_text.strip()):
-                            final_text = tesseract_text
-                    except Exception as e:
-                        print(f"Lỗi Tesseract: {str(e)}")
-            
-            # Nếu không có Tesseract và EasyOCR không thành công, thử phương pháp cuối cùng
-            if not final_text.strip():
-                # Thử một lần cuối với chế độ đặc biệt của EasyOCR
-                try:
-                    # Xử lý ảnh đặc biệt
-                    gray_img = region.convert('L')
-                    # Tăng độ tương phản
-                    from PIL import ImageEnhance
-                    enhancer = ImageEnhance.Contrast(gray_img)
-                    enhanced_img = enhancer.enhance(2.0)  # Tăng độ tương phản
-                    # Scale lên để dễ nhận dạng hơn
-                    scaled_img = enhanced_img.resize((enhanced_img.width*2, enhanced_img.height*2), Image.LANCZOS)
-                    
-                    # Lưu ảnh tăng cường để debug
-                    enhanced_path = debug_dir / f"enhanced_class_{class_id}_{timestamp}.png"
-                    scaled_img.save(str(enhanced_path))
-                    
-                    # Thử OCR với ảnh tăng cường
-                    results = self.ocr_system.ocr_reader.readtext(np.array(scaled_img), detail=0)
-                    if results:
-                        final_text = "\n".join(results)
-                except Exception as e:
-                    print(f"Lỗi xử lý ảnh nâng cao: {str(e)}")
-                    
-            # Nếu vẫn không thành công, thông báo lỗi
-            if not final_text.strip():
-                QMessageBox.warning(self, "OCR Error", "Không thể trích xuất text từ vùng đã chọn")
-                return
-                
-            # Xử lý kết quả dựa vào loại class
-            if class_id == 7:  # Noi_Nhan
-                # Xử lý đặc biệt cho Noi nhan
-                lines = final_text.split('\n')
-                final_text = "\n".join([line.strip() for line in lines if line.strip()])
-                
-                # Chuẩn hóa các lỗi thường gặp
-                final_text = final_text.replace("- ", "- ")
-                final_text = final_text.replace("..", ".")
-            
-            elif class_id == 0:  # CQBH
-                # Chuẩn hóa tên cơ quan
-                common_typos = {
-                    "UBND TINH": "UBND TỈNH",
-                    "UBND THANH PHO": "UBND THÀNH PHỐ",
-                    "CONG HOA": "CỘNG HÒA",
-                    "DOC LAP": "ĐỘC LẬP"
-                }
-                for typo, correct in common_typos.items():
-                    final_text = final_text.replace(typo, correct)
-            
-            elif class_id == 6:  # Ngay_BH
-                # Chuẩn hóa định dạng ngày tháng
-                final_text = self.standardize_date(final_text)
-            
-            # Cập nhật UI với kết quả OCR
-            self.update_ocr_field(class_name, final_text)
-            self.statusBar().showMessage(f"Đã trích xuất thành công {class_name}", 3000)
+            # Đưa job vào thread pool, kết quả trả về qua signal
+            self.custom_box_job_id += 1
+            self.custom_box_pending += 1
+            task = CustomBoxOCRTask(
+                self.ocr_system, self.custom_box_signals, self.custom_box_job_id,
+                self.current_doc_id if self.current_doc_id is not None else -1, class_id, region,
+                debug_info=debug_info
+            )
+            self.custom_box_pool.start(task)
+            self.statusBar().showMessage(
+                f"Đang xử lý OCR cho vùng được chọn ({self.custom_box_pending} đang chờ)...", 2000
+            )
             
         except Exception as e:
             logger.error(f"Error processing custom box: {str(e)}")
             traceback.print_exc()
             QMessageBox.warning(self, "Error", f"Lỗi xử lý OCR: {str(e)}")
     
+    def custom_box_ocr_finished(self, job_id, doc_id, class_id, final_text, engine, score):
+        """Nhận kết quả OCR vùng tự vẽ và cập nhật OCRResultEditor"""
+        self.custom_box_pending = max(0, self.custom_box_pending - 1)
+        
+        # Bỏ qua kết quả của văn bản khác (người dùng đã chuyển văn bản)
+        current_doc = self.current_doc_id if self.current_doc_id is not None else -1
+        if doc_id != current_doc:
+            logger.info(f"Bỏ qua kết quả OCR job {job_id} của văn bản {doc_id}")
+            return
+        
+        class_names = {
+            0: 'CQBH', 1: 'Chu_Ky', 2: 'Chuc_Vu', 3: 'Do_Khan',
+            4: 'Loai_VB', 5: 'ND_Chinh', 6: 'Ngay_BH', 7: 'Noi_Nhan', 8: 'So_Ki_Hieu'
+        }
+        class_name = class_names.get(class_id, '')
+        
+        # Xử lý kết quả dựa vào loại class
+        if class_id == 7:  # Noi_Nhan
+            # Xử lý đặc biệt cho Noi nhan
+            lines = final_text.split('\n')
+            final_text = "\n".join([line.strip() for line in lines if line.strip()])
+            
+            # Chuẩn hóa các lỗi thường gặp
+            final_text = final_text.replace("..", ".")
+        
+        elif class_id == 0:  # CQBH
+            # Chuẩn hóa tên cơ quan
+            common_typos = {
+                "UBND TINH": "UBND TỈNH",
+                "UBND THANH PHO": "UBND THÀNH PHỐ",
+                "CONG HOA": "CỘNG HÒA",
+                "DOC LAP": "ĐỘC LẬP"
+            }
+            for typo, correct in common_typos.items():
+                final_text = final_text.replace(typo, correct)
+        
+        elif class_id == 6:  # Ngay_BH
+            # Chuẩn hóa định dạng ngày tháng
+            final_text = self.standardize_date(final_text)
+        
+        # Cập nhật UI với kết quả OCR
+        self.update_ocr_field(class_name, final_text)
+        self.statusBar().showMessage(
+            f"Đã trích xuất thành công {class_name} ({engine}, độ tin cậy {score:.2f})", 3000
+        )
+    
+    def custom_box_ocr_failed(self, job_id, class_id, message):
+        """Thông báo lỗi OCR vùng tự vẽ"""
+        self.custom_box_pending = max(0, self.custom_box_pending - 1)
+        QMessageBox.warning(self, "OCR Error", message)
+    
     def standardize_date(self, date_text):
         """Chuẩn hóa định dạng ngày tháng"""
         try:
@@ -0,0 +1,445 @@
+"""Đo thời gian truy vấn danh sách/thống kê trên database tổng hợp
+
+Tạo database theo schema cũ (chỉ có document_versions), đo các truy vấn dùng
+subquery tương quan, sau đó mở bằng DocumentDatabase để chạy migration
+(document_current, FTS) và đo lại các truy vấn tương ứng.
+
+Chế độ --ingest so sánh thêm văn bản từng dòng (add_document + add_page_detections)
+với add_documents_bulk (một transaction) trên database mới.
+
+Chế độ --migrate chạy migration schema (PRAGMA user_version) trên bản sao của một
+database thật (hoặc database schema cũ tổng hợp) rồi kiểm tra toàn vẹn và số dòng.
+
+Chế độ --edits mô phỏng lịch sử chỉnh sửa (mỗi lần lưu sửa vài ký tự một trường) và so
+sánh dung lượng document_versions khi lưu bản đầy đủ mỗi phiên bản với snapshot + delta.
+
+Chạy: python db_benchmark.py --documents 50000 --versions 3
+      python db_benchmark.py --ingest 1000 10000 --pages 3
+      python db_benchmark.py --migrate database/documents.db
+      python db_benchmark.py --edits 50 --documents 500
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'assets'))
+from main_window_1 import DocumentDatabase
+
+LEGACY_SCHEMA = '''
+    CREATE TABLE documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_path TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_hash TEXT,
+        file_size INTEGER,
+        page_count INTEGER
+    );
+    CREATE TABLE document_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        version_number INTEGER,
+        cqbh_tren TEXT,
+        cqbh_duoi TEXT,
+        so_ki_hieu TEXT,
+        loai_vb TEXT,
+        nd_chinh TEXT,
+        ngay_bh TEXT,
+        noi_nhan TEXT,
+        chuc_vu TEXT,
+        chu_ky TEXT,
+        do_khan TEXT,
+        modified_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (document_id) REFERENCES documents(id)
+    );
+    CREATE INDEX idx_doc_filename ON documents(file_name);
+    CREATE INDEX idx_versions_docid ON document_versions(document_id);
+'''
+
+# Truy vấn danh sách trước khi có document_current (7 subquery tương quan mỗi dòng)
+LEGACY_LISTING_SQL = '''
+    SELECT
+        d.id, d.file_path, d.file_name, d.created_at, d.page_count,
+        (SELECT COUNT(v.id) FROM document_versions v WHERE v.document_id = d.id) as version_count,
+        (SELECT cqbh_tren FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT cqbh_duoi FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT so_ki_hieu FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT loai_vb FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT do_khan FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT modified_by FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1),
+        (SELECT created_at FROM document_versions WHERE document_id = d.id ORDER BY version_number DESC LIMIT 1)
+    FROM documents d
+    ORDER BY created_at DESC
+'''
+
+# Các truy vấn thống kê dùng MAX(version_number) tương quan
+LEGACY_STATS_SQL = [
+    '''
+    SELECT loai_vb, COUNT(*) as count
+    FROM document_versions
+    WHERE version_number = (
+        SELECT MAX(version_number) FROM document_versions v2
+        WHERE v2.document_id = document_versions.document_id
+    )
+    GROUP BY loai_vb ORDER BY count DESC
+    ''',
+    '''
+    SELECT do_khan, COUNT(*) as count
+    FROM document_versions
+    WHERE version_number = (
+        SELECT MAX(version_number) FROM document_versions v2
+        WHERE v2.document_id = document_versions.document_id
+    )
+    GROUP BY do_khan ORDER BY count DESC
+    ''',
+    '''
+    SELECT d.id, d.file_name, d.created_at, v.so_ki_hieu
+    FROM documents d
+    LEFT JOIN document_versions v ON d.id = v.document_id
+    WHERE v.version_number = (
+        SELECT MAX(version_number) FROM document_versions WHERE document_id = d.id
+    )
+    ORDER BY d.created_at DESC LIMIT 5
+    ''',
+]
+
+LEGACY_SEARCH_SQL = '''
+    SELECT d.id FROM documents d
+    WHERE EXISTS (
+        SELECT 1 FROM document_versions v
+        WHERE v.document_id = d.id
+        AND (v.cqbh_tren LIKE ? OR v.so_ki_hieu LIKE ? OR v.loai_vb LIKE ? OR v.nd_chinh LIKE ?
+             OR v.noi_nhan LIKE ? OR v.chuc_vu LIKE ? OR v.chu_ky LIKE ?)
+    )
+'''
+
+LOAI_VB = ['Quyết định', 'Công văn', 'Thông báo', 'Kế hoạch', 'Báo cáo', 'Tờ trình']
+DO_KHAN = ['Không', 'Khẩn', 'Thượng khẩn', 'Hỏa tốc']
+WORDS = ['về', 'việc', 'phê', 'duyệt', 'dự', 'toán', 'ngân', 'sách', 'đầu', 'tư', 'xây', 'dựng',
+         'quản', 'lý', 'đất', 'đai', 'kế', 'hoạch', 'triển', 'khai', 'nhiệm', 'vụ', 'năm']
+
+
+def populate(db_path: Path, documents: int, versions: int, seed: int = 42):
+    """Tạo database schema cũ với dữ liệu ngẫu nhiên"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_SCHEMA)
+    with conn:
+        conn.executemany(
+            "INSERT INTO documents (id, file_path, file_name, file_hash, file_size, page_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((i, f"/data/doc_{i}.pdf", f"doc_{i}.pdf", f"{i:064x}", 100000, rng.randint(1, 10))
+             for i in range(1, documents + 1))
+        )
+        conn.executemany(
+            "INSERT INTO document_versions (document_id, version_number, cqbh_tren, cqbh_duoi, so_ki_hieu, "
+            "loai_vb, nd_chinh, ngay_bh, noi_nhan, chuc_vu, chu_ky, do_khan, modified_by) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((doc_id, version, 'UBND TỈNH ĐỒNG NAI', f'SỞ {rng.choice(WORDS).upper()}',
+              f'{rng.randint(1, 999)}/QĐ-UBND', rng.choice(LOAI_VB),
+              ' '.join(rng.choice(WORDS) for _ in range(12)), '01/01/2024', 'Như trên',
+              'CHỦ TỊCH', 'Nguyễn Văn A', rng.choice(DO_KHAN), 'User')
+             for doc_id in range(1, documents + 1)
+             for version in range(1, versions + 1))
+        )
+    conn.close()
+
+
+def make_ingest_items(work_dir: Path, count: int, pages: int, seed: int = 42):
+    """Tạo file giả và kết quả OCR/detections cho benchmark thêm văn bản"""
+    rng = random.Random(seed)
+    files_dir = work_dir / f'files_{count}'
+    files_dir.mkdir()
+    items = []
+    for i in range(count):
+        file_path = files_dir / f'doc_{i}.pdf'
+        file_path.write_bytes(f'%PDF-bench {i}'.encode())
+        detections = [
+            {'class_id': rng.randint(0, 9), 'confidence': rng.random(),
+             'box': [rng.randint(0, 500), rng.randint(0, 700), rng.randint(500, 1000), rng.randint(700, 1400)],
+             'text': ' '.join(rng.choice(WORDS) for _ in range(6))}
+            for _ in range(10)
+        ]
+        items.append({
+            'file_path': str(file_path),
+            'page_count': pages,
+            'ocr_results': {
+                'CQBH_tren': 'UBND TỈNH ĐỒNG NAI', 'So_Ki_Hieu': f'{rng.randint(1, 999)}/QĐ-UBND',
+                'Loai_VB': rng.choice(LOAI_VB), 'ND_Chinh': ' '.join(rng.choice(WORDS) for _ in range(12)),
+                'Chuc_Vu': 'CHỦ TỊCH', 'Do_Khan': rng.choice(DO_KHAN),
+            },
+            'pages': [(page, detections, ' '.join(rng.choice(WORDS) for _ in range(200)), None)
+                      for page in range(pages)],
+        })
+    return items
+
+
+def ingest_per_row(db, items):
+    """Đường cũ: mỗi văn bản/trang/gợi ý một transaction"""
+    for item in items:
+        doc_id = db.add_document(item['file_path'], item['ocr_results'], page_count=item['page_count'])
+        for page_number, detections, page_text, page_transform in item['pages']:
+            db.add_page_detections(doc_id, page_number, detections, page_text=page_text,
+                                   page_transform=page_transform)
+
+
+def run_ingest(work_dir: Path, counts, pages: int):
+    """So sánh thời gian thêm văn bản từng dòng và theo lô"""
+    print(f"{'Số văn bản':<12}{'Từng dòng (s)':>16}{'Theo lô (s)':>14}{'Tăng tốc':>12}")
+    for count in counts:
+        items = make_ingest_items(work_dir, count, pages)
+        timings = {}
+        for name, ingest in (('per_row', ingest_per_row), ('bulk', lambda db, items: db.add_documents_bulk(items))):
+            db = DocumentDatabase(work_dir / f'ingest_{name}_{count}.db')
+            start = time.perf_counter()
+            ingest(db, items)
+            timings[name] = time.perf_counter() - start
+            db.close()
+        speedup = timings['per_row'] / timings['bulk'] if timings['bulk'] else float('inf')
+        print(f"{count:<12}{timings['per_row']:>16.2f}{timings['bulk']:>14.2f}{speedup:>11.1f}x")
+
+
+def copy_database(source: Path, dest: Path):
+    """Chép database bằng backup API (nhất quán cả khi ứng dụng đang mở, gồm phần trong WAL)"""
+    src = sqlite3.connect(source.resolve().as_uri() + '?mode=ro', uri=True)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def table_counts(db_path: Path) -> dict:
+    """Số dòng của mọi bảng thường (bỏ bảng FTS và bảng nội bộ)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' AND name NOT LIKE '%_fts_%'")]
+        return {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] for name in tables}
+    finally:
+        conn.close()
+
+
+def run_migration_check(work_dir: Path, source, documents: int, versions: int) -> bool:
+    """Chạy migration trên bản sao database, in thời gian từng bước và kết quả kiểm tra"""
+    db_path = work_dir / 'documents.db'
+    if source:
+        print(f"Chép {source}...")
+        copy_database(Path(source), db_path)
+    else:
+        print(f"Tạo {documents} văn bản x {versions} phiên bản (schema cũ)...")
+        populate(db_path, documents, versions)
+        
+    conn = sqlite3.connect(db_path)
+    version_before = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    counts_before = table_counts(db_path)
+    print(f"user_version: {version_before}, {os.path.getsize(db_path) / 1024 / 1024:.1f} MB")
+    
+    start = time.perf_counter()
+    db = DocumentDatabase(db_path)
+    open_ms = (time.perf_counter() - start) * 1000
+    for version, description, elapsed_ms in db.migration_log:
+        print(f"  {version:>3} {description:<55}{elapsed_ms:>10.1f} ms")
+    db.close()
+    print(f"Mở lần đầu (gồm migration): {open_ms:.1f} ms")
+    
+    # Mở lại: không còn migration nào phải chạy
+    start = time.perf_counter()
+    db = DocumentDatabase(db_path)
+    reopen_ms = (time.perf_counter() - start) * 1000
+    pending = len(db.migration_log)
+    db.close()
+    print(f"Mở lại: {reopen_ms:.1f} ms, migration chạy lại: {pending}")
+    
+    conn = sqlite3.connect(db_path)
+    version_after = conn.execute("PRAGMA user_version").fetchone()[0]
+    integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    plans = {sql: ' | '.join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, ('x',)))
+             for sql in ("SELECT id FROM documents WHERE file_hash = ?",
+                         "SELECT id FROM documents WHERE file_path = ?")}
+    conn.close()
+    counts_after = table_counts(db_path)
+    
+    # page_detections có thể giảm do bỏ bản ghi trùng trang (migration 3)
+    changed = {name: (count, counts_after.get(name)) for name, count in counts_before.items()
+               if name != 'page_detections' and counts_after.get(name) != count}
+    print(f"user_version sau migration: {version_after}")
+    print(f"integrity_check: {integrity}")
+    for sql, plan in plans.items():
+        print(f"{sql}: {plan}")
+    if changed:
+        print(f"Số dòng thay đổi: {changed}")
+    expected = DocumentDatabase.SCHEMA_MIGRATIONS[-1][0]
+    ok = integrity == 'ok' and not changed and pending == 0 and version_after == expected
+    print("OK" if ok else "LỖI")
+    return ok
+
+
+# Trọng số chọn trường khi mô phỏng chỉnh sửa (sửa nội dung chính/nơi nhận thường nhất)
+EDIT_FIELD_WEIGHTS = {'nd_chinh': 5, 'noi_nhan': 3, 'so_ki_hieu': 2, 'ngay_bh': 1, 'chuc_vu': 1,
+                      'chu_ky': 1, 'cqbh_duoi': 1, 'loai_vb': 1}
+
+
+def edit_history(current: dict, edits: int, rng: random.Random):
+    """Sinh các bản cập nhật đầy đủ như trình soạn thảo gửi: mỗi lần sửa 1-3 ký tự một trường"""
+    fields = list(EDIT_FIELD_WEIGHTS)
+    weights = list(EDIT_FIELD_WEIGHTS.values())
+    current = {field: value or '' for field, value in current.items()}
+    for _ in range(edits):
+        field = rng.choices(fields, weights)[0]
+        text = current[field]
+        pos = rng.randint(0, len(text))
+        inserted = ''.join(rng.choice(WORDS)[0] for _ in range(rng.randint(1, 3)))
+        current = dict(current)
+        current[field] = text[:pos] + inserted + text[pos:]
+        yield current
+
+
+def versions_size(db_path: Path) -> int:
+    """Số byte trang của document_versions và chỉ mục của nó (dbstat)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('''
+            SELECT SUM(pgsize) FROM dbstat WHERE name = 'document_versions'
+               OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'document_versions')
+        ''').fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def run_version_history(work_dir: Path, documents: int, edits: int, repeat: int):
+    """So sánh lưu phiên bản đầy đủ (snapshot mỗi phiên bản) với snapshot + delta"""
+    items = make_ingest_items(work_dir, documents, pages=0)
+    for item in items:
+        item['ocr_results'].update({'CQBH_duoi': 'SỞ TÀI CHÍNH', 'Ngay_BH': 'ngày 01 tháng 01 năm 2024',
+                                    'Noi_Nhan': '; '.join(f'- {word} {i}' for i, word in enumerate(WORDS[:15])),
+                                    'Chu_Ky': 'Nguyễn Văn A'})
+    results = {}
+    for name, interval in (('full', 1), ('delta', None)):
+        db_path = work_dir / f'versions_{name}.db'
+        db = DocumentDatabase(db_path)
+        if interval:
+            db.version_snapshot_interval = interval
+        db.add_documents_bulk(items)
+        doc_ids = [row[0] for row in db.get_all_documents()]
+        rng = random.Random(7)
+        start = time.perf_counter()
+        for doc_id in doc_ids:
+            latest = db.get_latest_version(doc_id)
+            current = dict(zip(DocumentDatabase.VERSION_ROW_COLUMNS[3:13], latest[3:13]))
+            for updates in edit_history(current, edits, rng):
+                db.create_new_version(doc_id, updates)
+        write_s = time.perf_counter() - start
+        
+        samples = [(rng.choice(doc_ids), rng.randint(1, edits + 1)) for _ in range(200)]
+        results[name] = {
+            'size': versions_size(db_path),
+            'write_ms': write_s * 1000 / (len(doc_ids) * edits),
+            'version_ms': measure(lambda: [db.get_document_version(d, v) for d, v in samples], repeat) / len(samples),
+            'history_ms': measure(lambda: [db.get_document_versions(d) for d, _ in samples[:50]], repeat) / 50,
+            'latest_ms': measure(lambda: [db.get_latest_version(d) for d, _ in samples], repeat) / len(samples),
+        }
+        # So sánh nội dung (bỏ id/created_at khác nhau giữa hai database)
+        results[name]['check'] = [version[2:13] + version[15:] for version in
+                                  (db.get_document_version(d, v) for d, v in samples)]
+        results[name]['interval'] = db.version_snapshot_interval
+        db.close()
+        
+    same = results['full']['check'] == results['delta']['check']
+    print(f"{documents} văn bản x {edits} lần sửa, snapshot mỗi {results['delta']['interval']} phiên bản")
+    print(f"{'':<28}{'Đầy đủ':>14}{'Delta':>14}")
+    print(f"{'document_versions (MB)':<28}{results['full']['size'] / 1024 / 1024:>14.2f}{results['delta']['size'] / 1024 / 1024:>14.2f}")
+    for key, label in (('write_ms', 'create_new_version (ms)'), ('version_ms', 'get_document_version (ms)'),
+                       ('history_ms', 'get_document_versions (ms)'), ('latest_ms', 'get_latest_version (ms)')):
+        print(f"{label:<28}{results['full'][key]:>14.3f}{results['delta'][key]:>14.3f}")
+    saved = 1 - results['delta']['size'] / results['full']['size'] if results['full']['size'] else 0
+    print(f"Tiết kiệm: {saved * 100:.1f}%, nội dung dựng lại giống nhau: {same}")
+    return same
+
+
+def measure(func, repeat: int) -> float:
+    """Trung vị thời gian chạy (ms)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark truy vấn danh sách văn bản")
+    parser.add_argument('--documents', type=int, default=50000)
+    parser.add_argument('--versions', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--ingest', type=int, nargs='+', metavar='N',
+                        help="Benchmark thêm N văn bản (từng dòng vs add_documents_bulk)")
+    parser.add_argument('--pages', type=int, default=3, help="Số trang mỗi văn bản khi --ingest")
+    parser.add_argument('--migrate', nargs='?', const='', metavar='DB',
+                        help="Kiểm tra migration trên bản sao của DB (bỏ trống: database tổng hợp)")
+    parser.add_argument('--edits', type=int, metavar='N',
+                        help="Mô phỏng N lần sửa mỗi văn bản, so sánh dung lượng phiên bản đầy đủ và delta")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='ocr_db_bench_'))
+    db_path = work_dir / 'documents.db'
+    try:
+        if args.ingest:
+            run_ingest(work_dir, args.ingest, args.pages)
+            return
+        if args.edits:
+            if not run_version_history(work_dir, args.documents, args.edits, args.repeat):
+                sys.exit(1)
+            return
+        if args.migrate is not None:
+            if not run_migration_check(work_dir, args.migrate, args.documents, args.versions):
+                sys.exit(1)
+            return
+
+        print(f"Tạo {args.documents} văn bản x {args.versions} phiên bản...")
+        populate(db_path, args.documents, args.versions)
+
+        conn = sqlite3.connect(db_path)
+        like = '%quyết định%'
+        before = {
+            'listing': measure(lambda: conn.execute(LEGACY_LISTING_SQL).fetchall(), args.repeat),
+            'statistics': measure(lambda: [conn.execute(sql).fetchall() for sql in LEGACY_STATS_SQL], args.repeat),
+            'text_search': measure(lambda: conn.execute(LEGACY_SEARCH_SQL, [like] * 7).fetchall(), args.repeat),
+        }
+        conn.close()
+
+        # Mở bằng DocumentDatabase: chạy migration cho database cũ
+        start = time.perf_counter()
+        db = DocumentDatabase(db_path)
+        migration_ms = (time.perf_counter() - start) * 1000
+
+        after = {
+            'listing': measure(lambda: db.get_all_documents(), args.repeat),
+            'statistics': measure(lambda: db.get_statistics(), args.repeat),
+            'text_search': measure(lambda: db.search_documents('quyet dinh'), args.repeat),
+        }
+        db.close()
+
+        print(f"\nMigration: {migration_ms:.1f} ms")
+        print(f"{'Truy vấn':<16}{'Trước (ms)':>14}{'Sau (ms)':>14}{'Tăng tốc':>12}")
+        for name in before:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<16}{before[name]:>14.1f}{after[name]:>14.1f}{speedup:>11.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
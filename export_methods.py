@@ -1,25 +1,49 @@
 import logging
 import json
 import pandas as pd
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import sqlite3
+from contextlib import contextmanager
 
 logger = logging.getLogger(__name__)
 
-def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None):
-    """Export database to Excel with optimized formatting"""
-    try:
-        # Kiểm tra thư viện
-        try:
-            import pandas as pd
-            from openpyxl import styles
-            from openpyxl.utils import get_column_letter
-        except ImportError:
-            raise ImportError("Thư viện 'openpyxl' chưa được cài đặt.")
-                
-        conn = db_conn_pool.get_connection()
-        # Base query với các cột được sắp xếp hợp lý nhưng loại bỏ cột do_mat
-        query = '''
+@contextmanager
+def _borrow_connection(db_conn_pool):
+    """Kết nối để đọc: nhận sqlite3.Connection, pool có connection() hoặc pool cũ chỉ có get_connection()"""
+    if isinstance(db_conn_pool, sqlite3.Connection):
+        yield db_conn_pool
+    elif hasattr(db_conn_pool, 'connection'):
+        with db_conn_pool.connection(readonly=True) as conn:
+            yield conn
+    else:
+        yield db_conn_pool.get_connection()
+
+def _latest_version_join(conn) -> Tuple[str, str]:
+    """(bảng, mệnh đề LEFT JOIN) lấy phiên bản mới nhất, giữ cả văn bản chưa có phiên bản
+    
+    Database đã chạy migration có document_current (phiên bản delta chỉ đọc đúng qua bảng này);
+    database cũ lấy dòng có version_number lớn nhất trong document_versions.
+    """
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_current'")
+    if cursor.fetchone():
+        return 'document_current', "LEFT JOIN document_current v ON v.document_id = d.id"
+    return 'document_versions', '''LEFT JOIN document_versions v ON v.document_id = d.id AND v.version_number = (
+                SELECT MAX(version_number)
+                FROM document_versions
+                WHERE document_id = d.id
+            )'''
+
+def _read_documents(db_conn_pool, filter_criteria: Dict = None) -> pd.DataFrame:
+    """Đọc danh sách văn bản (phiên bản mới nhất) theo filter_criteria vào DataFrame"""
+    # Mượn kết nối chỉ đọc trong lúc đọc dữ liệu
+    with _borrow_connection(db_conn_pool) as conn:
+        version_table, join = _latest_version_join(conn)
+        columns = [info[1] for info in conn.execute(f"PRAGMA table_info({version_table})").fetchall()]
+        # Database cũ có thể chưa có cột do_mat
+        do_mat = 'v.do_mat' if 'do_mat' in columns else 'NULL'
+        
+        # Base query với các cột được sắp xếp hợp lý
+        query = f'''
             SELECT 
                 d.id as "ID",
                 d.file_name as "Tên File",
@@ -29,18 +53,15 @@ def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None
                 v.so_ki_hieu as "Số Ký Hiệu",
                 v.ngay_bh as "Ngày Ban Hành",
                 v.do_khan as "Độ Khẩn",
+                {do_mat} as "Độ Mật",
                 v.loai_vb as "Loại Văn Bản",
                 v.nd_chinh as "Nội Dung Chính",
                 v.noi_nhan as "Nơi Nhận",
                 v.chuc_vu as "Chức Vụ",
                 v.chu_ky as "Chữ Ký"
             FROM documents d
-            LEFT JOIN document_versions v ON d.id = v.document_id
-            WHERE v.version_number = (
-                SELECT MAX(version_number) 
-                FROM document_versions 
-                WHERE document_id = d.id
-            )
+            {join}
+            WHERE 1 = 1
         '''
 
         # Xử lý filter criteria nếu có
@@ -61,24 +82,32 @@ def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None
                     elif field == 'date_to':
                         conditions.append("d.created_at <= ?")
                         params.append(value)
+                    elif field == 'do_mat':
+                        conditions.append(f"{do_mat} LIKE ?")
+                        params.append(f'%{value}%')
                     elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
-                                'do_khan', 'ngay_bh', 'chuc_vu']:  # Đã loại bỏ do_mat
+                                'do_khan', 'ngay_bh', 'chuc_vu', 'nd_chinh']:
                         conditions.append(f"v.{field} LIKE ?")
                         params.append(f'%{value}%')
-                    elif field == 'nd_chinh':
-                        conditions.append("v.nd_chinh LIKE ?")
-                        params.append(f'%{value}%')
             
             if conditions:
                 query += " AND " + " AND ".join(conditions)
         
         query += " ORDER BY d.created_at DESC"
-        
-        # Thực thi query
-        if params:
-            df = pd.read_sql_query(query, conn, params=params)
-        else:
-            df = pd.read_sql_query(query, conn)
+        return pd.read_sql_query(query, conn, params=params or None)
+
+def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None):
+    """Export database to Excel with optimized formatting"""
+    try:
+        # Kiểm tra thư viện
+        try:
+            import pandas as pd
+            from openpyxl import styles
+            from openpyxl.utils import get_column_letter
+        except ImportError:
+            raise ImportError("Thư viện 'openpyxl' chưa được cài đặt.")
+                
+        df = _read_documents(db_conn_pool, filter_criteria)
         
         # Xử lý datetime columns
         datetime_columns = ['Ngày Tạo', 'Ngày Ban Hành']
@@ -153,68 +182,7 @@ def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None
 def export_to_json(db_conn_pool, output_path: str, filter_criteria: Dict = None):
     """Export database to JSON"""
     try:
-        conn = db_conn_pool.get_connection()
-        # Base query với các cột được sắp xếp hợp lý nhưng loại bỏ cột do_mat
-        query = '''
-            SELECT 
-                d.id as "ID",
-                d.file_name as "Tên File",
-                d.created_at as "Ngày Tạo",
-                v.cqbh_tren as "CQBH Trên",
-                v.cqbh_duoi as "CQBH Dưới",
-                v.so_ki_hieu as "Số Ký Hiệu",
-                v.ngay_bh as "Ngày Ban Hành",
-                v.do_khan as "Độ Khẩn",
-                v.loai_vb as "Loại Văn Bản",
-                v.nd_chinh as "Nội Dung Chính",
-                v.noi_nhan as "Nơi Nhận",
-                v.chuc_vu as "Chức Vụ",
-                v.chu_ky as "Chữ Ký"
-            FROM documents d
-            LEFT JOIN document_versions v ON d.id = v.document_id
-            WHERE v.version_number = (
-                SELECT MAX(version_number) 
-                FROM document_versions 
-                WHERE document_id = d.id
-            )
-        '''
-
-        # Xử lý filter criteria nếu có
-        params = []
-        if filter_criteria:
-            conditions = []
-            for field, value in filter_criteria.items():
-                if value:
-                    if field == 'id':
-                        conditions.append("d.id = ?")
-                        params.append(value)
-                    elif field == 'file_name':
-                        conditions.append("d.file_name LIKE ?")
-                        params.append(f'%{value}%')
-                    elif field == 'date_from':
-                        conditions.append("d.created_at >= ?")
-                        params.append(value)
-                    elif field == 'date_to':
-                        conditions.append("d.created_at <= ?")
-                        params.append(value)
-                    elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
-                                'do_khan', 'ngay_bh', 'chuc_vu']:  # Đã loại bỏ do_mat
-                        conditions.append(f"v.{field} LIKE ?")
-                        params.append(f'%{value}%')
-                    elif field == 'nd_chinh':
-                        conditions.append("v.nd_chinh LIKE ?")
-                        params.append(f'%{value}%')
-            
-            if conditions:
-                query += " AND " + " AND ".join(conditions)
-        
-        query += " ORDER BY d.created_at DESC"
-        
-        # Thực thi query
-        if params:
-            df = pd.read_sql_query(query, conn, params=params)
-        else:
-            df = pd.read_sql_query(query, conn)
+        df = _read_documents(db_conn_pool, filter_criteria)
         
         # Chuyển đổi DataFrame thành JSON
         result_json = df.to_json(orient='records', force_ascii=False, date_format='iso')
@@ -63,7 +63,7 @@ def export_to_excel(db_conn_pool, output_path: str, filter_criteria: Dict = None
                         conditions.append("d.created_at <= ?")
                         params.append(value)
                     elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
-                                'do_khan', 'do_mat', 'ngay_bh', 'chuc_vu']:  # Đã thêm lại do_mat
+                                'do_khan', 'do_mat', 'ngay_bh', 'chuc_vu']:
                         conditions.append(f"v.{field} LIKE ?")
                         params.append(f'%{value}%')
                     elif field == 'nd_chinh':
@@ -200,7 +200,7 @@ def export_to_json(db_conn_pool, output_path: str, filter_criteria: Dict = None)
                         conditions.append("d.created_at <= ?")
                         params.append(value)
                     elif field in ['cqbh_tren', 'cqbh_duoi', 'so_ki_hieu', 'loai_vb',
-                                'do_khan', 'do_mat', 'ngay_bh', 'chuc_vu']:  # Đã thêm lại do_mat
+                                'do_khan', 'do_mat', 'ngay_bh', 'chuc_vu']:
                         conditions.append(f"v.{field} LIKE ?")
                         params.append(f'%{value}%')
                     elif field == 'nd_chinh':
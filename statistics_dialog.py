@@ -87,6 +87,31 @@ class StatisticsDialog(QDialog):
         time_layout.addWidget(self.time_table)
         self.tab_widget.addTab(time_tab, "Thống kê theo thời gian")
         
+        # Tab cơ quan ban hành và thẻ
+        agency_tab = QWidget()
+        agency_layout = QVBoxLayout(agency_tab)
+        self.agency_table = QTableWidget()
+        self.agency_table.setColumnCount(2)
+        self.agency_table.setHorizontalHeaderLabels(["Cơ quan ban hành", "Số lượng"])
+        self.agency_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        agency_layout.addWidget(self.agency_table)
+        self.tag_table = QTableWidget()
+        self.tag_table.setColumnCount(2)
+        self.tag_table.setHorizontalHeaderLabels(["Thẻ", "Số lượng"])
+        self.tag_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        agency_layout.addWidget(self.tag_table)
+        self.tab_widget.addTab(agency_tab, "Cơ quan & thẻ")
+        
+        # Tab hiệu năng xử lý
+        perf_tab = QWidget()
+        perf_layout = QVBoxLayout(perf_tab)
+        self.perf_table = QTableWidget()
+        self.perf_table.setColumnCount(4)
+        self.perf_table.setHorizontalHeaderLabels(["Giai đoạn", "Số mẫu", "p50 (ms)", "p95 (ms)"])
+        self.perf_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        perf_layout.addWidget(self.perf_table)
+        self.tab_widget.addTab(perf_tab, "Hiệu năng xử lý")
+        
         layout.addWidget(self.tab_widget)
         
         # Nút điều khiển
@@ -145,6 +170,23 @@ class StatisticsDialog(QDialog):
             self.time_table.setItem(i, 0, QTableWidgetItem(month))
             self.time_table.setItem(i, 1, QTableWidgetItem(str(count)))
 
+        # Cập nhật thống kê theo cơ quan ban hành và thẻ
+        for table, rows, empty_label in ((self.agency_table, stats.get('by_agency', []), "Không xác định"),
+                                         (self.tag_table, stats.get('by_tag', []), "")):
+            table.setRowCount(len(rows))
+            for i, (name, count) in enumerate(rows):
+                table.setItem(i, 0, QTableWidgetItem(name or empty_label))
+                table.setItem(i, 1, QTableWidgetItem(str(count)))
+
+        # Cập nhật thời gian xử lý theo giai đoạn
+        stage_timings = stats.get('stage_timings', [])
+        self.perf_table.setRowCount(len(stage_timings))
+        for i, (stage, samples, p50, p95) in enumerate(stage_timings):
+            self.perf_table.setItem(i, 0, QTableWidgetItem(stage))
+            self.perf_table.setItem(i, 1, QTableWidgetItem(str(samples)))
+            self.perf_table.setItem(i, 2, QTableWidgetItem(f"{p50:.1f}"))
+            self.perf_table.setItem(i, 3, QTableWidgetItem(f"{p95:.1f}"))
+
     def export_statistics(self):
         """Xuất thống kê ra file Excel"""
         try:
@@ -181,6 +223,12 @@ class StatisticsDialog(QDialog):
                 time_data = pd.DataFrame(stats['by_month'], columns=['Tháng', 'Số lượng'])
                 time_data.to_excel(writer, sheet_name='Theo thời gian', index=False)
 
+                # Thống kê theo cơ quan ban hành và thẻ
+                agency_data = pd.DataFrame(stats.get('by_agency', []), columns=['Cơ quan ban hành', 'Số lượng'])
+                agency_data.to_excel(writer, sheet_name='Theo cơ quan', index=False)
+                tag_data = pd.DataFrame(stats.get('by_tag', []), columns=['Thẻ', 'Số lượng'])
+                tag_data.to_excel(writer, sheet_name='Theo thẻ', index=False)
+
                 # Văn bản mới nhất
                 recent_data = pd.DataFrame(
                     stats['recent_docs'],
@@ -188,6 +236,13 @@ class StatisticsDialog(QDialog):
                 )
                 recent_data.to_excel(writer, sheet_name='Văn bản mới', index=False)
 
+                # Hiệu năng xử lý
+                perf_data = pd.DataFrame(
+                    stats.get('stage_timings', []),
+                    columns=['Giai đoạn', 'Số mẫu', 'p50 (ms)', 'p95 (ms)']
+                )
+                perf_data.to_excel(writer, sheet_name='Hiệu năng', index=False)
+
             QMessageBox.information(self, "Thành công", f"Đã xuất báo cáo thống kê tới {file_path}")
 
         except Exception as e:
@@ -0,0 +1,208 @@
+"""Kiểm tra DocumentDatabase trên file database tạm (cần đủ thư viện của assets/main_window_1.py)"""
+import json
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'assets'))
+
+try:
+    from main_window_1 import DocumentDatabase
+except ImportError as e:
+    raise unittest.SkipTest(f"main_window_1 dependencies are not installed: {e}")
+
+
+class DocumentDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.db_path = self.root / 'documents.db'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_db(self):
+        db = DocumentDatabase(self.db_path)
+        self.addCleanup(db.close)
+        return db
+
+
+class DatabaseWriterTest(DocumentDatabaseTestCase):
+
+    def test_failed_command_does_not_roll_back_batch_mates(self):
+        db = self.open_db()
+        db.writer.execute(lambda conn: conn.execute('CREATE TABLE items (value TEXT)'))
+        db.writer.batch_ms = 5000  # Giữ mọi lệnh dưới đây trong cùng một transaction
+        before = db.writer.get_metrics()
+
+        def insert(conn, value, fail=False):
+            conn.execute('INSERT INTO items (value) VALUES (?)', (value,))
+            if fail:
+                raise ValueError(value)
+            return value
+
+        gate = threading.Event()
+        blocker = db.writer.submit(lambda conn: gate.wait(5))
+        futures = [db.writer.submit(insert, 'a'),
+                   db.writer.submit(insert, 'b', fail=True),
+                   db.writer.submit(insert, 'c')]
+        gate.set()
+
+        self.assertTrue(blocker.result(5))
+        self.assertEqual(futures[0].result(5), 'a')
+        with self.assertRaises(ValueError):
+            futures[1].result(5)
+        self.assertEqual(futures[2].result(5), 'c')
+
+        after = db.writer.get_metrics()
+        self.assertEqual(after['transactions'] - before['transactions'], 1)
+        self.assertEqual(after['failed'] - before['failed'], 1)
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute('SELECT value FROM items ORDER BY value').fetchall()
+        self.assertEqual(rows, [('a',), ('c',)])
+
+
+# Schema trước khi có PRAGMA user_version (bản phát hành đầu tiên)
+LEGACY_SCHEMA = '''
+    CREATE TABLE documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_path TEXT NOT NULL,
+        file_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        file_hash TEXT,
+        file_size INTEGER,
+        page_count INTEGER
+    );
+    CREATE TABLE document_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        version_number INTEGER,
+        cqbh_tren TEXT, cqbh_duoi TEXT, so_ki_hieu TEXT, loai_vb TEXT, nd_chinh TEXT,
+        ngay_bh TEXT, noi_nhan TEXT, chuc_vu TEXT, chu_ky TEXT, do_khan TEXT,
+        modified_by TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE page_detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        page_number INTEGER,
+        detection_data TEXT,
+        page_text TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE field_suggestions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        field_name TEXT NOT NULL,
+        value TEXT NOT NULL,
+        frequency INTEGER DEFAULT 1,
+        last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(field_name, value)
+    );
+    CREATE TABLE document_backups (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        backup_path TEXT NOT NULL,
+        reason TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE document_tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        document_id INTEGER,
+        tag_name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(document_id, tag_name)
+    );
+'''
+
+
+class SchemaMigrationTest(DocumentDatabaseTestCase):
+
+    def create_legacy_db(self):
+        detections = json.dumps([{'box': [1, 2, 3, 4], 'text': 'Số: 12/QĐ-UBND', 'confidence': 0.9}])
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executescript(LEGACY_SCHEMA)
+            conn.execute("INSERT INTO documents (file_path, file_name, file_hash, file_size, page_count) "
+                         "VALUES ('/tmp/a.pdf', 'a.pdf', 'abc', 10, 1)")
+            conn.execute("INSERT INTO document_versions (document_id, version_number, so_ki_hieu, loai_vb, "
+                         "do_khan, modified_by) VALUES (1, 1, '12/QĐ-UBND', 'Quyết định', 'Khẩn', 'OCR')")
+            conn.execute("INSERT INTO page_detections (document_id, page_number, detection_data, page_text) "
+                         "VALUES (1, 1, ?, 'Quyết định phê duyệt')", (detections,))
+
+    def schema(self):
+        with sqlite3.connect(self.db_path) as conn:
+            return (conn.execute("PRAGMA user_version").fetchone()[0],
+                    conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall())
+
+    def test_legacy_db_migrates_to_latest_then_reopens_without_migrations(self):
+        self.create_legacy_db()
+        latest = DocumentDatabase.SCHEMA_MIGRATIONS[-1][0]
+
+        db = DocumentDatabase(self.db_path)
+        try:
+            self.assertEqual([entry[0] for entry in db.migration_log], list(range(1, latest + 1)))
+            latest_version = db.get_latest_version(1)
+            self.assertEqual(latest_version[2], 1)
+            self.assertEqual(latest_version[5], '12/QĐ-UBND')
+            detections = db.get_document_detections(1, 1)
+            self.assertEqual([det['text'] for det in detections], ['Số: 12/QĐ-UBND'])
+            self.assertEqual(list(detections[0]['box']), [1, 2, 3, 4])
+        finally:
+            db.close()
+        migrated = self.schema()
+        self.assertEqual(migrated[0], latest)
+
+        db = self.open_db()
+        self.assertEqual(db.migration_log, [])
+        self.assertEqual(self.schema(), migrated)
+        self.assertEqual(db.get_latest_version(1)[5], '12/QĐ-UBND')
+
+
+class VersionDeltaTest(DocumentDatabaseTestCase):
+
+    def version_fields(self, row):
+        values = dict(zip(DocumentDatabase.VERSION_ROW_COLUMNS, row))
+        return {field: values[field] for field in DocumentDatabase.VERSION_DELTA_FIELDS}
+
+    def test_every_version_round_trips_across_snapshots(self):
+        db = self.open_db()
+        file_path = self.root / 'a.pdf'
+        file_path.write_bytes(b'%PDF test')
+        doc_id = db.add_document(str(file_path), {'So_Ki_Hieu': '1/QĐ-UBND', 'Loai_VB': 'Quyết định'}, page_count=1)
+
+        current = self.version_fields(db.get_latest_version(doc_id))
+        expected = {1: dict(current)}
+        interval = db.version_snapshot_interval
+        last_version = 2 * interval + 5
+        for version in range(2, last_version + 1):
+            current['nd_chinh'] = f'Nội dung {version}'
+            if version % 3 == 0:
+                current['so_ki_hieu'] = f'{version}/QĐ-UBND'
+            if version == interval + 5:
+                current['do_mat'] = 'Mật'
+            self.assertEqual(db.create_new_version(doc_id, current), version)
+            expected[version] = dict(current)
+
+        with sqlite3.connect(self.db_path) as conn:
+            snapshots = [row[0] for row in conn.execute(
+                'SELECT version_number FROM document_versions WHERE document_id = ? AND changed_mask IS NULL '
+                'ORDER BY version_number', (doc_id,))]
+        self.assertEqual(snapshots, [1, interval + 1, 2 * interval + 1])
+
+        for version, fields in expected.items():
+            row = db.get_document_version(doc_id, version)
+            self.assertEqual(row[2], version)
+            self.assertEqual(self.version_fields(row), fields, f"version {version}")
+        history = db.get_document_versions(doc_id)
+        self.assertEqual([row[2] for row in history], list(range(last_version, 0, -1)))
+        self.assertEqual(self.version_fields(db.get_latest_version(doc_id)), expected[last_version])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Kiểm tra lập lịch của WordConverterService bằng converter giả (không cần Word/LibreOffice)"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import CancelledError
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from word_converter import BaseConverter, ConversionError, WordConverterService
+
+
+class StubConverter(BaseConverter):
+    """Ghi nội dung nguồn ra "PDF", có thể chặn tới khi release được set"""
+    name = "stub"
+
+    def __init__(self, calls, release=None, fail=False):
+        self.calls = calls
+        self.release = release
+        self.fail = fail
+        self.closed = False
+
+    def convert(self, src_path, pdf_path):
+        self.calls.append(src_path)
+        if self.release is not None:
+            self.release.wait(5)
+        if self.fail:
+            raise ConversionError("stub failure")
+        with open(src_path, 'rb') as src, open(pdf_path, 'wb') as dst:
+            dst.write(b'%PDF ' + src.read())
+
+    def close(self):
+        self.closed = True
+
+
+class WordConverterServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.calls = []
+        self.converters = []
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_service(self, workers=1, **stub_options):
+        def factory(index):
+            converter = StubConverter(self.calls, **stub_options)
+            self.converters.append(converter)
+            return converter
+        service = WordConverterService(factory, self.root / 'out', self.root / 'cache', workers=workers)
+        self.addCleanup(service.shutdown)
+        return service
+
+    def write_source(self, name, content=b'content'):
+        path = self.root / name
+        path.write_bytes(content)
+        return str(path)
+
+    def test_cache_hit_skips_converter(self):
+        service = self.make_service()
+        first = service.convert(self.write_source('a.docx'), timeout=5)
+        second = service.convert(self.write_source('b.docx'), timeout=5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertNotEqual(first, second)
+        self.assertEqual(Path(second).read_bytes(), b'%PDF content')
+
+    def test_identical_inflight_inputs_share_one_conversion(self):
+        release = threading.Event()
+        service = self.make_service(workers=2, release=release)
+        futures = [service.submit(self.write_source(f'{i}.docx')) for i in range(3)]
+        release.set()
+        paths = [future.result(5) for future in futures]
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(set(paths)), 3)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+
+    def test_failure_propagates_to_every_waiter(self):
+        service = self.make_service(fail=True)
+        futures = [service.submit(self.write_source(f'{i}.docx')) for i in range(2)]
+
+        for future in futures:
+            with self.assertRaises(ConversionError):
+                future.result(5)
+        with self.assertRaises(FileNotFoundError):
+            service.convert(str(self.root / 'missing.docx'), timeout=5)
+
+    def test_shutdown_cancels_queued_jobs_and_closes_converter(self):
+        release = threading.Event()
+        service = self.make_service(release=release)
+        running = service.submit(self.write_source('a.docx', b'a'))
+        queued = service.submit(self.write_source('b.docx', b'b'))
+        while not self.calls:
+            threading.Event().wait(0.01)
+
+        stopper = threading.Thread(target=service.shutdown)
+        stopper.start()
+        with self.assertRaises(CancelledError):
+            queued.result(5)
+        release.set()
+        stopper.join(5)
+
+        self.assertTrue(running.result(5).endswith('.pdf'))
+        self.assertTrue(self.converters[0].closed)
+        with self.assertRaises(RuntimeError):
+            service.submit(self.write_source('c.docx'))
+
+
+if __name__ == '__main__':
+    unittest.main()
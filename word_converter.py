@@ -0,0 +1,411 @@
+"""Dịch vụ chuyển đổi Word -> PDF chạy nền
+
+Mỗi worker giữ một converter trong suốt vòng đời dịch vụ, nhận việc qua hàng đợi
+và lưu cache kết quả theo hash nội dung file nguồn. Word COM và unoserver giữ tiến
+trình thường trực giữa các lần chuyển đổi; SofficeConverter (khi không có unoserver)
+vẫn khởi động soffice cho từng file, chỉ dùng lại profile riêng của worker. Converter được truyền vào qua factory nên có thể
+thay bằng converter giả để kiểm tra phần lập lịch mà không cần LibreOffice.
+"""
+import os
+import sys
+import time
+import queue
+import shutil
+import socket
+import hashlib
+import itertools
+import logging
+import subprocess
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger("OCRApp")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CACHE_MAX_FILES = 200
+UNOSERVER_BASE_PORT = 2003
+UNOSERVER_START_TIMEOUT = 30
+
+
+class ConversionError(Exception):
+    """Lỗi khi chuyển đổi tài liệu sang PDF"""
+    pass
+
+
+class BaseConverter:
+    """Converter cơ sở: start() một lần, convert() nhiều lần, close() khi dừng"""
+    name = "base"
+
+    def start(self):
+        pass
+
+    def convert(self, src_path: str, pdf_path: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class WordComConverter(BaseConverter):
+    """Microsoft Word qua COM, giữ Word.Application mở giữa các lần chuyển đổi"""
+    name = "word"
+
+    def __init__(self):
+        self.word = None
+
+    def start(self):
+        import comtypes
+        import comtypes.client
+        # Mỗi thread worker cần khởi tạo COM riêng
+        comtypes.CoInitialize()
+        self.word = comtypes.client.CreateObject('Word.Application')
+        self.word.Visible = False
+
+    def convert(self, src_path, pdf_path):
+        doc = self.word.Documents.Open(str(src_path), ReadOnly=True)
+        try:
+            doc.SaveAs(str(pdf_path), FileFormat=17)  # 17 = PDF format
+        finally:
+            doc.Close(False)
+
+    def close(self):
+        if self.word is None:
+            return
+        try:
+            self.word.Quit()
+        except Exception as e:
+            logger.warning(f"Error closing Word: {str(e)}")
+        self.word = None
+        try:
+            import comtypes
+            comtypes.CoUninitialize()
+        except Exception:
+            pass
+
+
+class UnoserverConverter(BaseConverter):
+    """LibreOffice thường trực qua unoserver, chuyển đổi bằng UnoClient"""
+    name = "unoserver"
+
+    def __init__(self, soffice: str, port: int, profile_dir: Path):
+        self.soffice = soffice
+        self.port = port
+        self.profile_dir = Path(profile_dir)
+        self.process = None
+        self.client = None
+
+    def start(self):
+        from unoserver.client import UnoClient
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        cmd = [
+            shutil.which('unoserver'),
+            '--port', str(self.port),
+            '--uno-port', str(self.port + 1000),
+            '--executable', self.soffice,
+            '--user-installation', self.profile_dir.as_uri(),
+        ]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Đợi server mở cổng XML-RPC
+        deadline = time.time() + UNOSERVER_START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise ConversionError(f"unoserver exited with code {self.process.returncode}")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            self.close()
+            raise ConversionError("unoserver did not start in time")
+
+        self.client = UnoClient(server='127.0.0.1', port=str(self.port))
+
+    def convert(self, src_path, pdf_path):
+        self.client.convert(inpath=str(src_path), outpath=str(pdf_path), convert_to='pdf')
+
+    def close(self):
+        self.client = None
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class SofficeConverter(BaseConverter):
+    """soffice --headless với profile riêng cho từng worker
+
+    Mỗi lần convert() chạy một tiến trình soffice mới (không thường trực, chi phí
+    khởi động LibreOffice trả cho từng file); cài unoserver để có backend thường trực.
+    Profile cố định chỉ bỏ qua bước tạo profile lần đầu và cho phép nhiều instance
+    chạy song song mà không tranh chấp khóa profile mặc định.
+    """
+    name = "soffice"
+
+    def __init__(self, soffice: str, profile_dir: Path, work_dir: Path):
+        self.soffice = soffice
+        self.profile_dir = Path(profile_dir)
+        self.work_dir = Path(work_dir)
+
+    def start(self):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+
+    def convert(self, src_path, pdf_path):
+        cmd = [
+            self.soffice,
+            f'-env:UserInstallation={self.profile_dir.as_uri()}',
+            '--headless',
+            '--convert-to', 'pdf',
+            '--outdir', str(self.work_dir),
+            str(src_path)
+        ]
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        converted_path = self.work_dir / (Path(src_path).stem + '.pdf')
+        if process.returncode != 0 or not converted_path.exists():
+            raise ConversionError(
+                f"LibreOffice conversion failed: {process.stderr.decode('utf-8', 'ignore')}"
+            )
+        os.replace(converted_path, pdf_path)
+
+
+class Docx2PdfConverter(BaseConverter):
+    """Dự phòng bằng thư viện docx2pdf"""
+    name = "docx2pdf"
+
+    def convert(self, src_path, pdf_path):
+        from docx2pdf import convert
+        convert(str(src_path), str(pdf_path))
+        if not os.path.exists(pdf_path):
+            raise ConversionError("docx2pdf did not produce an output file")
+
+
+def find_soffice() -> Optional[str]:
+    """Tìm đường dẫn soffice"""
+    if sys.platform == 'win32':
+        libreoffice_paths = [
+            r"C:\Program Files\LibreOffice\program\soffice.exe",
+            r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
+        ]
+        return next((path for path in libreoffice_paths if os.path.exists(path)), None)
+    return shutil.which('soffice') or shutil.which('libreoffice')
+
+
+def _module_available(name: str) -> bool:
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def make_default_converter_factory(work_root: Path) -> Callable[[int], BaseConverter]:
+    """Chọn backend tốt nhất đang có: Word COM > unoserver > soffice > docx2pdf"""
+    work_root = Path(work_root)
+    soffice = find_soffice()
+
+    if sys.platform == 'win32' and _module_available('comtypes'):
+        return lambda index: WordComConverter()
+
+    if soffice and shutil.which('unoserver') and _module_available('unoserver.client'):
+        return lambda index: UnoserverConverter(
+            soffice, UNOSERVER_BASE_PORT + 2 * index, work_root / f'profile_{index}'
+        )
+
+    if soffice:
+        return lambda index: SofficeConverter(
+            soffice, work_root / f'profile_{index}', work_root / f'out_{index}'
+        )
+
+    if _module_available('docx2pdf'):
+        return lambda index: Docx2PdfConverter()
+
+    raise ConversionError(
+        "No Word converter available. Please install Microsoft Word, "
+        "LibreOffice, or the docx2pdf Python package."
+    )
+
+
+class WordConverterService:
+    """Hàng đợi chuyển đổi với các worker giữ converter riêng và cache theo hash"""
+
+    def __init__(self, converter_factory: Callable[[int], BaseConverter],
+                 output_dir: Path, cache_dir: Path, workers: int = 2,
+                 cache_max_files: int = DEFAULT_CACHE_MAX_FILES):
+        self.converter_factory = converter_factory
+        self.output_dir = Path(output_dir)
+        self.cache_dir = Path(cache_dir)
+        self.workers = max(1, workers)
+        self.cache_max_files = cache_max_files
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self.jobs = queue.Queue()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._closed = False
+        self._seq = itertools.count(1)
+
+    @staticmethod
+    def hash_file(path) -> str:
+        """SHA-256 nội dung file, dùng làm khóa cache"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _ensure_workers(self):
+        # Chỉ khởi động worker khi có việc đầu tiên
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop, args=(index,),
+                name=f"word-converter-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, src_path) -> Future:
+        """Đưa file vào hàng đợi, trả về Future với đường dẫn PDF riêng cho lần gọi này
+
+        Không chặn người gọi: hash, tra cache và chuyển đổi đều chạy trong worker.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Converter service has been shut down")
+            self._ensure_workers()
+            self.jobs.put((str(src_path), future))
+        return future
+
+    def convert(self, src_path, timeout: Optional[float] = None) -> str:
+        """Chuyển đổi đồng bộ"""
+        return self.submit(src_path).result(timeout)
+
+    def _deliver(self, base_future: Future, result: Future, src_path: str):
+        """Khi job chuyển đổi (base_future) xong, đặt bản sao PDF riêng vào result"""
+        def on_done(done):
+            error = done.exception()
+            if error is not None:
+                result.set_exception(error)
+                return
+            try:
+                result.set_result(self._materialize(done.result(), src_path))
+            except Exception as e:
+                result.set_exception(e)
+
+        base_future.add_done_callback(on_done)
+
+    def _materialize(self, cached_path: Path, src_path: str) -> str:
+        """Sao chép PDF từ cache ra thư mục output (người gọi có thể xóa bản sao)"""
+        file_base = Path(src_path).stem
+        pdf_path = self.output_dir / f"{file_base}_{int(time.time())}_{next(self._seq)}.pdf"
+        shutil.copyfile(cached_path, pdf_path)
+        os.utime(cached_path, None)
+        return str(pdf_path)
+
+    def _worker_loop(self, index: int):
+        converter = self.converter_factory(index)
+        started = False
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    break
+                src_path, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    file_hash = self.hash_file(src_path)
+                except Exception as e:
+                    logger.error(f"Cannot read Word file {src_path}: {str(e)}")
+                    future.set_exception(e)
+                    continue
+                cached_path = self.cache_dir / f"{file_hash}.pdf"
+
+                # Cùng nội dung đã có trong cache hoặc đang được worker khác chuyển đổi
+                # thì dùng lại kết quả đó
+                with self._lock:
+                    base_future = self._inflight.get(file_hash)
+                    owner = base_future is None and not cached_path.exists()
+                    if owner:
+                        base_future = Future()
+                        self._inflight[file_hash] = base_future
+                if base_future is None:
+                    self._deliver(self._cached(cached_path), future, src_path)
+                    continue
+                self._deliver(base_future, future, src_path)
+                if not owner:
+                    continue
+
+                try:
+                    if not started:
+                        converter.start()
+                        started = True
+                    tmp_path = self.cache_dir / f"{file_hash}.{index}.part.pdf"
+                    converter.convert(src_path, str(tmp_path))
+                    os.replace(tmp_path, cached_path)
+                    with self._lock:
+                        self._inflight.pop(file_hash, None)
+                    base_future.set_result(cached_path)
+                    self._prune_cache()
+                except Exception as e:
+                    logger.error(f"Word conversion failed ({converter.name}) for {src_path}: {str(e)}")
+                    # Converter có thể đã hỏng, khởi động lại ở job sau
+                    if started:
+                        converter.close()
+                        started = False
+                    with self._lock:
+                        self._inflight.pop(file_hash, None)
+                    base_future.set_exception(e)
+        finally:
+            if started:
+                converter.close()
+
+    @staticmethod
+    def _cached(cached_path: Path) -> Future:
+        future = Future()
+        future.set_result(cached_path)
+        return future
+
+    def _prune_cache(self):
+        """Giữ lại tối đa cache_max_files bản PDF mới dùng gần nhất"""
+        try:
+            files = sorted(self.cache_dir.glob('*.pdf'), key=lambda p: p.stat().st_mtime, reverse=True)
+            for old_file in files[self.cache_max_files:]:
+                if '.part' not in old_file.name:
+                    old_file.unlink()
+        except Exception as e:
+            logger.warning(f"Error pruning conversion cache: {str(e)}")
+
+    def shutdown(self, wait: bool = True):
+        """Dừng worker và đóng converter"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        # Hủy các job chưa chạy
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[1].cancel()
+
+        for _ in self._threads:
+            self.jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()